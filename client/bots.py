@@ -0,0 +1,317 @@
+"""Bot chơi headless: nhiều phiên đồng thời trong một process, chiến lược tính theo lô bằng NumPy
+
+Mỗi bot là một `client_logic.AsyncClient` trên chung một event loop. Phần việc theo
+từng bot chỉ là nhận tin nhắn và gửi nước đi; trạng thái chiến lược của mọi bot nằm trong
+mảng NumPy (một hàng mỗi bot), và mỗi vòng event loop cập nhật/chọn nước đi cho tất cả
+các bot đang chờ bằng một lần tính trên mảng (BotPool._flush).
+
+Chiến lược (`--mix`, trọng số theo số bot):
+    random     chọn đều ngẫu nhiên
+    frequency  đếm nước đi của đối thủ (có suy giảm), đánh nước thắng nước hay gặp nhất
+    markov     ma trận chuyển 3x3 trên nước đi trước của đối thủ, đánh nước thắng nước dự đoán
+    mixed      mỗi round chọn ngẫu nhiên một trong các chiến lược trên theo trọng số
+
+Cần cài numpy. Ví dụ:
+    python client/bots.py --bots 2000 --ramp 5 --duration 30 --mix frequency=1,markov=1,mixed=2
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from client_logic import HOST, PORT, AsyncClient
+
+MOVE_NAMES = ("rock", "paper", "scissors")   # cùng thứ tự với rules.Move của server
+MOVE_INDEX = {name: i for i, name in enumerate(MOVE_NAMES)}
+RESULT_INDEX = {"win": 0, "lose": 1, "draw": 2}
+BEATS = np.array([1, 2, 0])                  # BEATS[m]: nước thắng m (paper thắng rock, ...)
+
+
+class Strategy:
+    """Chiến lược cho một nhóm n bot; `ids` luôn là mảng chỉ số trong nhóm (0..n-1)"""
+
+    name = "random"
+
+    def __init__(self, n, rng):
+        self.n = n
+        self.rng = rng
+
+    def reset(self, ids):
+        """Các bot này vừa vào trận mới (đối thủ mới)"""
+
+    def update(self, ids, opp_moves):
+        """Các bot này vừa thấy đối thủ đi opp_moves (mảng cùng độ dài)"""
+
+    def choose(self, ids):
+        """Nước đi (mảng số 0..2) cho các bot này"""
+        return self.rng.integers(0, 3, size=len(ids))
+
+    def _argmax(self, scores):
+        # Nhiễu rất nhỏ để phá thế hòa ngẫu nhiên thay vì luôn chọn rock
+        return np.argmax(scores + self.rng.random(scores.shape) * 1e-6, axis=1)
+
+
+class FrequencyStrategy(Strategy):
+    """Đếm nước đi của đối thủ (suy giảm theo `decay` để theo kịp thay đổi), đánh khắc nước phổ biến nhất"""
+
+    name = "frequency"
+
+    def __init__(self, n, rng, decay=0.9):
+        super().__init__(n, rng)
+        self.decay = decay
+        self.counts = np.zeros((n, 3))
+
+    def update(self, ids, opp_moves):
+        self.counts[ids] *= self.decay
+        np.add.at(self.counts, (ids, opp_moves), 1.0)
+
+    def choose(self, ids):
+        return BEATS[self._argmax(self.counts[ids])]
+
+
+class MarkovStrategy(Strategy):
+    """Chuỗi Markov bậc 1 trên lịch sử đối thủ: đếm chuyển (nước trước -> nước sau) của đối thủ"""
+
+    name = "markov"
+
+    def __init__(self, n, rng, decay=0.9):
+        super().__init__(n, rng)
+        self.decay = decay
+        self.transitions = np.zeros((n, 3, 3))
+        self.last = np.full(n, -1, dtype=np.int8)   # nước trước của đối thủ hiện tại, -1 = chưa có
+
+    def reset(self, ids):
+        self.last[ids] = -1
+
+    def update(self, ids, opp_moves):
+        prev = self.last[ids]
+        seen = prev >= 0
+        rows, prev = ids[seen], prev[seen]
+        self.transitions[rows, prev] *= self.decay
+        np.add.at(self.transitions, (rows, prev, opp_moves[seen]), 1.0)
+        self.last[ids] = opp_moves
+
+    def choose(self, ids):
+        last = self.last[ids]
+        moves = BEATS[self._argmax(self.transitions[ids, np.maximum(last, 0)])]
+        fresh = last < 0
+        moves[fresh] = self.rng.integers(0, 3, size=int(fresh.sum()))
+        return moves
+
+
+class MixedStrategy(Strategy):
+    """Chiến lược hỗn hợp: mỗi round mỗi bot bốc một chiến lược con theo trọng số"""
+
+    name = "mixed"
+    PARTS = {"random": 0.2, "frequency": 0.4, "markov": 0.4}
+
+    def __init__(self, n, rng, parts=None):
+        super().__init__(n, rng)
+        parts = parts or self.PARTS
+        self.parts = [STRATEGIES[name](n, rng) for name in parts]
+        weights = np.array(list(parts.values()), dtype=float)
+        self.weights = weights / weights.sum()
+
+    def reset(self, ids):
+        for part in self.parts:
+            part.reset(ids)
+
+    def update(self, ids, opp_moves):
+        for part in self.parts:
+            part.update(ids, opp_moves)
+
+    def choose(self, ids):
+        options = np.stack([part.choose(ids) for part in self.parts])   # (số chiến lược con, len(ids))
+        pick = self.rng.choice(len(self.parts), size=len(ids), p=self.weights)
+        return options[pick, np.arange(len(ids))]
+
+
+STRATEGIES = {cls.name: cls for cls in (Strategy, FrequencyStrategy, MarkovStrategy, MixedStrategy)}
+
+
+class BotPool:
+    """Chạy nhiều bot trên một event loop; gom việc của các bot thành lô cho mỗi vòng loop"""
+
+    def __init__(self, mix, host=HOST, port=PORT, codec="json", think=0.0, prefix="Bot", seed=None):
+        """mix: list (tên chiến lược, số bot)"""
+        self.host, self.port, self.codec = host, port, codec
+        self.think = think
+        self.prefix = prefix
+        self.rng = np.random.default_rng(seed)
+        self.strategies = [STRATEGIES[name](count, self.rng) for name, count in mix]
+        # Bot i thuộc nhóm group_of[i], là hàng local_of[i] trong mảng của chiến lược nhóm đó
+        self.group_of = np.concatenate([np.full(count, g) for g, (_, count) in enumerate(mix)])
+        self.local_of = np.concatenate([np.arange(count) for _, count in mix])
+        self.size = len(self.group_of)
+        self.clients = [None] * self.size
+        self.results = np.zeros((len(mix), 3), dtype=np.int64)   # win/lose/draw theo nhóm
+        self.rounds = 0
+        self.games = 0
+        self.errors = 0        # tin nhắn `error` (server từ chối vì quá tải)
+        self.connected = 0
+        self.connect_errors = 0
+        # Việc chờ xử lý ở lần _flush tới
+        self._moves = []      # bot cần chọn nước đi
+        self._seen = []       # (bot, nước đi của đối thủ, kết quả) từ round_result
+        self._resets = []     # bot vừa vào trận mới
+        self._scheduled = False
+        self._loop = None
+
+    # --- sự kiện từ client (theo từng bot, chỉ ghi lại rồi hẹn _flush)
+
+    def _on_messages(self, client, batch):
+        bot = client.bot_id
+        for msg in batch:
+            msg_type = msg.get("type")
+            if msg_type == "request_move":
+                self._moves.append(bot)
+            elif msg_type == "round_result":
+                self.rounds += 1
+                opp = MOVE_INDEX.get(msg.get("opponent_move"))
+                if opp is not None:
+                    self._seen.append((bot, opp, RESULT_INDEX.get(msg.get("result"), 2)))
+            elif msg_type == "match_found":
+                self._resets.append(bot)
+            elif msg_type == "game_over":
+                self.games += 1
+            elif msg_type == "error":
+                self.errors += 1
+                if msg.get("reason") == "overloaded":
+                    # Server đang cắt tải: vào hàng đợi lại sau retry_after giây
+                    self._loop.call_later(msg.get("retry_after", 1.0), client.send_json, {"type": "join_queue"})
+        if not self._scheduled:
+            self._scheduled = True
+            self._loop.call_soon(self._flush)
+
+    def _flush(self):
+        """Một lô: cập nhật chiến lược theo các round vừa xong, rồi chọn nước đi cho mọi bot đang chờ"""
+        self._scheduled = False
+        if self._seen:
+            seen = np.array(self._seen)
+            self._seen = []
+            bots, opp, result = seen[:, 0], seen[:, 1], seen[:, 2]
+            np.add.at(self.results, (self.group_of[bots], result), 1)
+            for strategy, local, sel in self._groups(bots):
+                strategy.update(local, opp[sel])
+        if self._resets:
+            for strategy, local, _ in self._groups(np.array(self._resets)):
+                strategy.reset(local)
+            self._resets = []
+        if self._moves:
+            bots = np.array(self._moves)
+            self._moves = []
+            moves = np.empty(len(bots), dtype=np.int64)
+            for strategy, local, sel in self._groups(bots):
+                moves[sel] = strategy.choose(local)
+            for bot, move in zip(bots.tolist(), moves.tolist()):
+                msg = {"type": "move", "move": MOVE_NAMES[move]}
+                if self.think:
+                    self._loop.call_later(self.rng.uniform(0, 2 * self.think), self.clients[bot].send_json, msg)
+                else:
+                    self.clients[bot].send_json(msg)
+
+    def _groups(self, bots):
+        """Chia mảng bot theo nhóm: (chiến lược, chỉ số trong nhóm, mặt nạ trên `bots`)"""
+        groups = self.group_of[bots]
+        for g, strategy in enumerate(self.strategies):
+            sel = groups == g
+            if sel.any():
+                yield strategy, self.local_of[bots[sel]], sel
+
+    # --- chạy
+
+    async def _run_bot(self, bot):
+        client = AsyncClient(self._on_messages)
+        client.bot_id = bot
+        self.clients[bot] = client
+        try:
+            await client.connect(self.host, self.port)
+            await client.join(f"{self.prefix}_{bot}", codecs=[self.codec])
+        except OSError:
+            self.connect_errors += 1
+            return
+        self.connected += 1
+        client.send_json({"type": "join_queue"})
+        await client.run()
+
+    async def run(self, duration, ramp=0.0):
+        """Mở dần các bot trong `ramp` giây, chạy thêm `duration` giây rồi đóng; trả về báo cáo"""
+        self._loop = asyncio.get_running_loop()
+        tasks = []
+        interval = ramp / self.size if self.size else 0
+        for bot in range(self.size):
+            tasks.append(asyncio.create_task(self._run_bot(bot)))
+            if interval:
+                await asyncio.sleep(interval)
+        rounds, start = self.rounds, time.perf_counter()
+        await asyncio.sleep(duration)
+        elapsed = time.perf_counter() - start
+        steady_rounds = self.rounds - rounds
+        for client in self.clients:
+            if client is not None:
+                client.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return self.report(steady_rounds, elapsed)
+
+    def report(self, rounds, elapsed):
+        groups = {}
+        for g, strategy in enumerate(self.strategies):
+            win, lose, draw = self.results[g].tolist()
+            total = win + lose + draw
+            groups[strategy.name] = {"bots": strategy.n, "win": win, "lose": lose, "draw": draw,
+                                     "win_rate": round(win / total, 4) if total else None}
+        return {"bots": self.size, "connected": self.connected, "connect_errors": self.connect_errors,
+                "errors": self.errors,
+                # round_result đến cả hai người chơi nên chia đôi
+                "rounds_per_sec": round(rounds / 2 / elapsed, 2) if elapsed else None,
+                "games": self.games // 2, "strategies": groups}
+
+
+def parse_mix(text, total):
+    """"frequency=1,markov=2" + tổng số bot -> [(tên, số bot)], chia theo trọng số"""
+    weights = []
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in STRATEGIES:
+            raise ValueError(f"chiến lược không có: {name} (có: {', '.join(STRATEGIES)})")
+        weights.append((name, float(weight or 1)))
+    scale = sum(w for _, w in weights)
+    counts = [int(total * w / scale) for _, w in weights]
+    counts[0] += total - sum(counts)
+    return [(name, count) for (name, _), count in zip(weights, counts) if count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bot chơi Rock Paper Scissors (nhiều phiên, chiến lược theo lô)")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--bots", type=int, default=200)
+    parser.add_argument("--mix", default="random=1,frequency=1,markov=1,mixed=1",
+                        help="chiến lược và trọng số theo số bot, ví dụ frequency=1,markov=2")
+    parser.add_argument("--ramp", type=float, default=2.0, help="số giây để mở hết các bot")
+    parser.add_argument("--duration", type=float, default=20.0, help="số giây chạy sau khi mở hết")
+    parser.add_argument("--think", type=float, default=0.0, help="thời gian suy nghĩ trung bình (giây)")
+    parser.add_argument("--codec", default="json", help="codec đề xuất khi join (json | orjson | msgpack)")
+    parser.add_argument("--prefix", default="Bot", help="tiền tố tên người chơi")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--json", dest="json_out", help="ghi báo cáo JSON ra file")
+    args = parser.parse_args()
+
+    pool = BotPool(parse_mix(args.mix, args.bots), args.host, args.port, args.codec,
+                   args.think, args.prefix, args.seed)
+    report = asyncio.run(pool.run(args.duration, args.ramp))
+    text = json.dumps(report, indent=2)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
-import threading
 import tkinter as tk
 from tkinter import messagebox
 from client_logic import client_logic
+from collections import deque
 import os
 
 class RPSClientGUI:
@@ -15,6 +15,9 @@ class RPSClientGUI:
         self.network = client_logic()
         self.name = ""
         self.opponent = None
+        self.board = []
+        self.inbox = deque()     # tin nhắn chờ xử lý, theo đúng thứ tự nhận
+        self.draining = False
 
         BASE_DIR = os.path.dirname(os.path.abspath(__file__))
         self.rock_img = tk.PhotoImage(file=os.path.join(BASE_DIR, "rock.png")).subsample(4, 4)
@@ -43,6 +46,10 @@ class RPSClientGUI:
                                      fg="white", relief="flat", cursor="hand2",
                                      command=self.connect_server, padx=20, pady=10)
         self.connect_btn.pack(pady=10)
+        self.board_btn = tk.Button(conn_frame, text="🏆 LEADERBOARD", font=("Arial", 10, "bold"),
+                                   bg="#e2e8f0", fg="#334155", relief="flat", cursor="hand2",
+                                   command=lambda: self.network.get_leaderboard(0, 10), state="disabled")
+        self.board_btn.pack()
 
         # --- Status Section ---
         status_frame = tk.Frame(master, bg="white", height=120, relief="solid", borderwidth=1)
@@ -103,71 +110,90 @@ class RPSClientGUI:
             self.status_label.config(text="🟢 Connected to Server", fg="#10b981")
             self.connect_btn.config(state="disabled")
             self.name_entry.config(state="disabled")
-            self.network.send_json({"type": "join", "player": self.name})
+            self.board_btn.config(state="normal")
+            self.network.join(self.name)
             self.network.send_json({"type": "join_queue"})
             self.status_label.config(text="🟡 Searching for Opponent...", fg="#f59e0b")
-            threading.Thread(target=self.listen_server, daemon=True).start()
+            self.network.attach_tk(self.master, self.on_messages, self.on_disconnect)
         except Exception as e:
             messagebox.showerror("Connection Error", f"Cannot connect to server:\n{str(e)}")
 
-    def listen_server(self):
+    def on_messages(self, batch):
+        """Một lô tin nhắn từ server (client_logic.attach_tk gọi trong thread của Tk)
+
+        Chỉ xếp vào inbox rồi xử lý bằng after_idle: messagebox chạy vòng sự kiện lồng bên trong,
+        lô đến trong lúc đó phải chờ các tin nhắn trước xử lý xong để giữ đúng thứ tự.
+        """
+        self.inbox.extend(batch)
+        self.master.after_idle(self.drain_messages)
+
+    def drain_messages(self):
+        if self.draining:
+            return   # gọi lồng từ trong một messagebox: vòng while bên ngoài sẽ xử lý tiếp
+        self.draining = True
         try:
-            while self.network.is_connected():
-                msg = self.network.recv_json()
-                if not msg:
-                    continue
-                
-                msg_type = msg.get("type")
-
-                if msg_type == "match_found":
-                    self.opponent = msg.get("opponent")
-                    self.master.after(0, lambda opp=self.opponent: self.opponent_label.config(
-                        text=f"⚔️ Opponent: {opp}", fg="#f43f5e"))
-                    self.master.after(0, lambda: self.status_label.config(
-                        text="🟣 Match Started!", fg="#a855f7"))
-
-                elif msg_type == "request_move":
-                    self.master.after(0, self.enable_move_request)
-
-                elif msg_type == "round_result":
-                    your_move = msg.get("your_move", "")
-                    opponent_move = msg.get("opponent_move", "")
-                    result = msg.get("result", "draw")
-                    
-                    # Hiển thị kết quả NGAY LẬP TỨC
-                    self.master.after(0, lambda r=result, ym=your_move, om=opponent_move: 
-                                     self.show_result(r, ym, om))
-                    
-                    # Sau 3 giây, tự động chuyển sang vòng mới
-                    self.master.after(3000, self.enable_move_request)
-
-                elif msg_type == "game_over":
-                    # Thay vì dừng vòng lắng nghe, hiển thị thông báo và tự động vào lại hàng đợi
-                    self.master.after(0, lambda: messagebox.showinfo("Game Over", "The game has ended!"))
-                    # reset trạng thái đối thủ và giao diện
-                    self.opponent = None
-                    self.master.after(0, lambda: self.opponent_label.config(text="Opponent: Waiting...", fg="#94a3b8"))
-                    # Gửi yêu cầu vào lại hàng đợi để được ghép trận
-                    try:
-                        self.network.send_json({"type": "join_queue"})
-                        self.master.after(0, lambda: self.status_label.config(text="🟡 Searching for Opponent...", fg="#f59e0b"))
-                    except:
-                        pass
-
-                elif msg_type == "opponent_disconnected":
-                    # Khi server thông báo đối thủ rời — hành xử giống như trên
-                    self.master.after(0, lambda: messagebox.showinfo("Opponent Left", "Your opponent disconnected. Rejoining queue..."))
-                    self.opponent = None
-                    self.master.after(0, lambda: self.opponent_label.config(text="Opponent: Waiting...", fg="#94a3b8"))
-                    try:
-                        self.network.send_json({"type": "join_queue"})
-                        self.master.after(0, lambda: self.status_label.config(text="🟡 Searching for Opponent...", fg="#f59e0b"))
-                    except:
-                        pass
-        except Exception as e:
-            if self.network.is_connected():
-                self.master.after(0, lambda err=str(e): self.status_label.config(
-                    text=f"🔴 Connection Lost: {err}", fg="#ef4444"))
+            while self.inbox:
+                self.handle_message(self.inbox.popleft())
+        finally:
+            self.draining = False
+
+    def handle_message(self, msg):
+        msg_type = msg.get("type")
+
+        if msg_type == "match_found":
+            self.opponent = msg.get("opponent")
+            self.opponent_label.config(text=f"⚔️ Opponent: {self.opponent}", fg="#f43f5e")
+            self.status_label.config(text="🟣 Match Started!", fg="#a855f7")
+
+        elif msg_type == "request_move":
+            self.enable_move_request()
+
+        elif msg_type == "round_result":
+            # Hiển thị kết quả NGAY LẬP TỨC
+            self.show_result(msg.get("result", "draw"), msg.get("your_move", ""),
+                             msg.get("opponent_move", ""))
+            # Round tiếp theo bắt đầu khi có request_move (server gửi ngay sau round_result,
+            # hoặc game_over nếu trận đã kết thúc)
+
+        elif msg_type == "game_over":
+            # Thay vì dừng vòng lắng nghe, hiển thị thông báo; server tự đưa vào lại hàng đợi
+            messagebox.showinfo("Game Over", f"Winner: {msg.get('winner')}\n"
+                                f"Score: {msg.get('your_score', 0)} - {msg.get('opponent_score', 0)}")
+            # reset trạng thái đối thủ và giao diện
+            self.reset_opponent()
+
+        elif msg_type == "leaderboard":
+            self.board = msg.get("entries", [])
+
+        elif msg_type == "leaderboard_rank":
+            # Luôn đi ngay sau trang `leaderboard`
+            lines = [f"{e['rank']:>3}. {e['player']}  {e['score']}" for e in self.board]
+            rank = msg.get("rank")
+            lines.append(f"\nYou: #{rank} ({msg.get('score')})" if rank else "\nYou: not ranked yet")
+            messagebox.showinfo("Leaderboard", "\n".join(lines))
+
+        elif msg_type == "opponent_disconnected":
+            # Khi server thông báo đối thủ rời — server cũng tự đưa mình về hàng đợi
+            messagebox.showinfo("Opponent Left", "Your opponent disconnected. Rejoining queue...")
+            self.reset_opponent()
+
+        elif msg_type == "error":
+            delay = int(msg.get("retry_after", 1) * 1000)
+            if msg.get("reason") == "overloaded":
+                # Server đang cắt tải: thử vào hàng đợi lại sau retry_after giây
+                self.status_label.config(text="🟠 Server busy, retrying...", fg="#f97316")
+                self.master.after(delay, lambda: self.network.send_json({"type": "join_queue"}))
+            else:
+                self.status_label.config(text=f"🟠 Server: {msg.get('reason')}", fg="#f97316")
+
+    def on_disconnect(self):
+        self.disable_game_buttons()
+        self.status_label.config(text="🔴 Connection Lost", fg="#ef4444")
+
+    def reset_opponent(self):
+        self.opponent = None
+        self.opponent_label.config(text="Opponent: Waiting...", fg="#94a3b8")
+        self.status_label.config(text="🟡 Searching for Opponent...", fg="#f59e0b")
 
     def show_result(self, result, your_move, opponent_move):
         """Hiển thị kết quả lên giao diện"""
@@ -1,44 +1,253 @@
+import asyncio
+import os
+import select
 import socket
-import json
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.codec import JSON, CODECS, available_codecs
+from common.framing import RECV_SIZE, recv_frame
 
 HOST = '127.0.0.1'
 PORT = 9009
 
+# Đọc không chặn trên socket blocking (gửi vẫn blocking như cũ); không có cờ này thì hỏi select
+_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+POLL_INTERVAL = 20   # ms, chu kỳ poll() trong Tk khi không có createfilehandler (Windows)
+
 class client_logic:
     def __init__(self):
         self.sock = None
         self.connected = False
-        self.buffer = b""
+        self.codec = JSON
+        self.framer = self.codec.framer()
+        self.host, self.port = HOST, PORT
+        self.player = None
+        self.codecs = None
+        self.session = None      # token server cấp khi join, dùng để kết nối lại
+        self.auto_resume = True  # tự kết nối lại khi mất kết nối giữa chừng
+        # Chế độ hướng sự kiện (start_events / attach_tk)
+        self.on_messages = None  # on_messages(list các tin nhắn), gọi một lần cho mỗi lô
+        self.on_disconnect = None
+        self._watch = self._unwatch = None
 
     def connect(self, host=HOST, port=PORT):
+        self.host, self.port = host, port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.connect((host, port))
+        self.codec = JSON
+        self.framer = self.codec.framer()
         self.connected = True
 
+    def join(self, player, codecs=None, timeout=3):
+        """Gửi `join` kèm danh sách codec và chờ server xác nhận codec.
+
+        Server cũ không trả lời `joined` thì sau `timeout` giây vẫn dùng JSON.
+        """
+        if codecs is None:
+            codecs = available_codecs()
+        self.player, self.codecs = player, codecs
+        if not self.send_json({"type": "join", "player": player, "codecs": codecs}):
+            return False
+        reply = self._recv_reply(timeout)
+        if reply and reply.get("type") == "joined":
+            self.session = reply.get("session")
+            self.set_codec(CODECS.get(reply.get("codec"), JSON))
+        return self.is_connected()
+
+    def resume(self, retries=5, delay=0.5, timeout=3):
+        """Kết nối lại và khôi phục phiên (trận, nước đi đang chờ) sau khi mất kết nối.
+
+        Trả về False nếu server không còn giữ phiên (hết thời gian chờ).
+        """
+        if not self.session:
+            return False
+        for _ in range(retries):
+            self._close_socket()
+            try:
+                self.connect(self.host, self.port)
+            except OSError:
+                time.sleep(delay)
+                continue
+            self._send({"type": "resume", "session": self.session, "codecs": self.codecs})
+            reply = self._recv_reply(timeout)
+            if reply and reply.get("type") == "resumed":
+                self.set_codec(CODECS.get(reply.get("codec"), JSON))
+                return True
+            break
+        self.session = None
+        self._close_socket()
+        return False
+
+    def set_codec(self, codec):
+        rest = self.framer.drain()
+        self.codec = codec
+        self.framer = codec.framer()
+        if rest:
+            self.framer.feed(rest)
+
     def send_json(self, obj):
         if self.sock and self.connected:
-            self.sock.sendall((json.dumps(obj) + "\n").encode('utf-8'))
+            try:
+                self._send(obj)
+            except OSError:
+                # Qua _lost để chế độ sự kiện theo dõi lại socket mới (hoặc báo on_disconnect)
+                if not self._lost():
+                    raise
+                self._send(obj)
             return True
         return False
 
+    def _send(self, obj):
+        self.sock.sendall(self.codec.encode(obj))
+
     def recv_json(self):
         if not self.sock or not self.connected:
             return None
         try:
-            while b"\n" not in self.buffer:
-                part = self.sock.recv(4096)
-                if not part:
-                    self.connected = False
-                    return None
-                self.buffer += part
-            line, sep, remaining = self.buffer.partition(b"\n")
-            self.buffer = remaining
-            return json.loads(line.decode('utf-8'))
+            frame = recv_frame(self.sock, self.framer)
+        except socket.timeout:
+            return None
         except:
+            frame = None
+        if frame is None:
+            # Mất kết nối: thử kết nối lại phiên cũ trước khi báo ngắt
+            if self.auto_resume and self.resume():
+                return self.recv_json()
             self.connected = False
             return None
+        try:
+            return self.codec.decode(frame)
+        except:
+            self.connected = False
+            return None
+
+    def _recv_reply(self, timeout):
+        """Chờ một tin nhắn trả lời (join/resume), không tự kết nối lại"""
+        self.sock.settimeout(timeout)
+        try:
+            frame = recv_frame(self.sock, self.framer)
+            return self.codec.decode(frame) if frame is not None else None
+        except:
+            return None
+        finally:
+            if self.sock:
+                self.sock.settimeout(None)
+
+    def start_events(self, on_messages, on_disconnect=None):
+        """Chế độ hướng sự kiện: mỗi lần poll() giao mọi tin nhắn đã nhận thành một lô
+
+        on_messages(list) được gọi một lần cho mỗi lô, on_disconnect() khi mất kết nối
+        hẳn (sau khi đã thử kết nối lại phiên). Nơi gọi tự quyết định khi nào poll():
+        theo event loop của Tk (attach_tk), selector, hoặc vòng lặp riêng.
+        """
+        self.on_messages = on_messages
+        self.on_disconnect = on_disconnect
+
+    def fileno(self):
+        return self.sock.fileno() if self.sock else -1
+
+    def poll(self):
+        """Đọc hết dữ liệu đang có mà không chặn, giải mã và giao một lô; trả về số tin nhắn"""
+        if not self.is_connected():
+            return 0
+        closed = False
+        try:
+            while True:
+                if _DONTWAIT:
+                    data = self.sock.recv(RECV_SIZE, _DONTWAIT)
+                elif select.select([self.sock], [], [], 0)[0]:
+                    data = self.sock.recv(RECV_SIZE)
+                else:
+                    break
+                if not data:
+                    closed = True
+                    break
+                self.framer.feed(data)
+                if len(data) < RECV_SIZE:
+                    break   # đã lấy hết phần đang chờ, không cần thêm một lần recv
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            closed = True
+        batch = []
+        try:
+            for frame in self.framer.frames():
+                batch.append(self.codec.decode(frame))
+        except:
+            closed = True   # dữ liệu rác hoặc frame quá lớn
+        if batch and self.on_messages:
+            self.on_messages(batch)
+        if closed:
+            self._lost()
+        return len(batch)
+
+    def _lost(self):
+        """Mất kết nối: thử kết nối lại phiên (True nếu được), không được thì báo on_disconnect
+
+        Ở chế độ sự kiện, bỏ theo dõi socket cũ và theo dõi socket mới sau khi kết nối lại.
+        """
+        if self._unwatch:
+            self._unwatch()
+        if self.auto_resume and self.resume():
+            if self._watch:
+                self._watch()
+            return True
+        self.connected = False
+        if self.on_disconnect:
+            self.on_disconnect()
+        return False
+
+    def attach_tk(self, master, on_messages, on_disconnect=None):
+        """Gắn vào event loop của Tk, không cần thread đọc: callback chạy ngay trong thread Tk
+
+        Dùng createfilehandler để Tk gọi poll() khi socket có dữ liệu; nơi không có
+        (Tk trên Windows) thì poll() mỗi POLL_INTERVAL ms bằng after().
+        """
+        self.start_events(on_messages, on_disconnect)
+        tk = master.tk
+        if sys.platform != "win32" and hasattr(tk, "createfilehandler"):
+            import tkinter
+            fd = None
+
+            def watch():
+                nonlocal fd
+                fd = self.sock.fileno()
+                tk.createfilehandler(fd, tkinter.READABLE, lambda *_: self.poll())
+
+            def unwatch():
+                if fd is not None:
+                    tk.deletefilehandler(fd)
+
+            self._watch, self._unwatch = watch, unwatch
+            watch()
+        else:
+            def tick():
+                if self.is_connected():
+                    self.poll()
+                    master.after(POLL_INTERVAL, tick)
+
+            master.after(POLL_INTERVAL, tick)
+
+    def get_leaderboard(self, offset=0, limit=20):
+        """Xin một trang bảng xếp hạng; server trả `leaderboard` rồi `leaderboard_rank` (hạng của mình)"""
+        return self.send_json({"type": "get_leaderboard", "offset": offset, "limit": limit})
 
     def disconnect(self):
+        # Báo server đây là thoát chủ động để không giữ phiên
+        if self.sock and self.connected and self.session:
+            try:
+                self._send({"type": "leave"})
+            except:
+                pass
+        if self._unwatch:
+            self._unwatch()
+            self._watch = self._unwatch = None
+        self.session = None
+        self._close_socket()
+
+    def _close_socket(self):
         self.connected = False
         if self.sock:
             try:
@@ -51,3 +260,91 @@ class client_logic:
 
     def is_connected(self):
         return self.connected and self.sock is not None
+
+
+class AsyncClient:
+    """Client asyncio cho bot không giao diện: hàng trăm client chạy chung một event loop
+
+    Cùng giao thức với client_logic (join có đề xuất codec); on_messages(client, list)
+    nhận theo lô mọi tin nhắn giải mã được sau mỗi lần đọc socket. Không tự kết nối lại.
+    """
+
+    def __init__(self, on_messages, on_disconnect=None):
+        self.on_messages = on_messages
+        self.on_disconnect = on_disconnect   # on_disconnect(client)
+        self.reader = self.writer = None
+        self.codec = JSON
+        self.framer = self.codec.framer()
+        self.player = None
+        self.session = None
+        self.connected = False
+
+    async def connect(self, host=HOST, port=PORT):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.connected = True
+
+    async def join(self, player, codecs=None, timeout=3):
+        """Gửi `join` và chờ `joined` để đổi codec; server cũ không trả lời thì vẫn dùng JSON"""
+        if codecs is None:
+            codecs = available_codecs()
+        self.player = player
+        self.send_json({"type": "join", "player": player, "codecs": codecs})
+        try:
+            frame = self.framer.next_frame()
+            while frame is None:
+                data = await asyncio.wait_for(self.reader.read(RECV_SIZE), timeout)
+                if not data:
+                    self.connected = False
+                    return False
+                self.framer.feed(data)
+                frame = self.framer.next_frame()
+        except asyncio.TimeoutError:
+            return True
+        reply = self.codec.decode(frame)
+        if reply.get("type") == "joined":
+            self.session = reply.get("session")
+            self.set_codec(CODECS.get(reply.get("codec"), JSON))
+        else:
+            self.on_messages(self, [reply])
+        return True
+
+    def set_codec(self, codec):
+        rest = self.framer.drain()
+        self.codec = codec
+        self.framer = codec.framer()
+        if rest:
+            self.framer.feed(rest)
+
+    def send_json(self, obj):
+        """Đưa tin nhắn vào buffer gửi của transport (không chờ), False nếu đã mất kết nối"""
+        if not self.connected or self.writer.is_closing():
+            return False
+        self.writer.write(self.codec.encode(obj))
+        return True
+
+    async def run(self):
+        """Đọc cho tới khi mất kết nối, giao tin nhắn theo lô cho on_messages"""
+        try:
+            while True:
+                data = await self.reader.read(RECV_SIZE)
+                if not data:
+                    break
+                self.framer.feed(data)
+                batch = [self.codec.decode(frame) for frame in self.framer.frames()]
+                if batch:
+                    self.on_messages(self, batch)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self.connected = False
+            self.writer.close()
+            if self.on_disconnect:
+                self.on_disconnect(self)
+
+    def close(self):
+        """Thoát chủ động (server không giữ phiên); run() sẽ kết thúc"""
+        if self.connected and self.session:
+            self.send_json({"type": "leave"})
+        self.session = None
+        if self.writer is not None:
+            self.writer.close()
@@ -0,0 +1,94 @@
+# common/codec.py
+"""Codec cho giao thức: JSON theo dòng (mặc định) và các lựa chọn nhanh hơn.
+
+Client gửi danh sách codec nó hỗ trợ trong tin nhắn `join` (trường "codecs"), server
+chọn codec đầu tiên mà nó cũng hỗ trợ và trả lời `{"type": "joined", "codec": ...}`
+bằng JSON. Sau tin nhắn đó cả hai phía chuyển sang codec đã chọn.
+"""
+import json
+import struct
+
+from common.framing import LineFramer, LengthPrefixedFramer
+
+try:
+    import orjson
+except ImportError:  # orjson không bắt buộc
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack không bắt buộc
+    msgpack = None
+
+
+class JsonCodec:
+    """JSON theo dòng, chỉ dùng thư viện chuẩn"""
+
+    name = "json"
+
+    def encode(self, obj) -> bytes:
+        return (json.dumps(obj) + "\n").encode()
+
+    def decode(self, frame: bytes):
+        return json.loads(frame)
+
+    def framer(self):
+        return LineFramer()
+
+
+class OrjsonCodec(JsonCodec):
+    """JSON theo dòng qua orjson: ra thẳng bytes, không qua str. Tương thích dây với "json"."""
+
+    name = "orjson"
+
+    def encode(self, obj) -> bytes:
+        return orjson.dumps(obj) + b"\n"
+
+    def decode(self, frame: bytes):
+        return orjson.loads(frame)
+
+
+class MsgpackCodec:
+    """msgpack nhị phân, mỗi frame có 4 byte độ dài phía trước"""
+
+    name = "msgpack"
+
+    def encode(self, obj) -> bytes:
+        payload = msgpack.packb(obj)
+        return struct.pack(">I", len(payload)) + payload
+
+    def decode(self, frame: bytes):
+        return msgpack.unpackb(frame)
+
+    def framer(self):
+        return LengthPrefixedFramer()
+
+
+JSON = JsonCodec()
+
+# Theo thứ tự ưu tiên khi client đề xuất
+CODECS = {JSON.name: JSON}
+if orjson is not None:
+    CODECS[OrjsonCodec.name] = OrjsonCodec()
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+
+
+def available_codecs():
+    """Tên các codec dùng được, ưu tiên giảm dần (để client gửi kèm `join`)"""
+    order = ["msgpack", "orjson", "json"]
+    return [name for name in order if name in CODECS]
+
+
+def negotiate(offered):
+    """Chọn codec đầu tiên trong danh sách client đề xuất mà máy này hỗ trợ
+
+    `offered` đến thẳng từ client: không phải list thì dùng JSON, phần tử không phải str bị bỏ qua.
+    """
+    if not isinstance(offered, (list, tuple)):
+        return JSON
+    for name in offered:
+        codec = CODECS.get(name) if isinstance(name, str) else None
+        if codec is not None:
+            return codec
+    return JSON
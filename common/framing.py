@@ -0,0 +1,130 @@
+# common/framing.py
+"""Tách frame JSON theo dòng, dùng chung cho server, client_logic và client giả lập."""
+
+MAX_FRAME = 64 * 1024   # độ dài tối đa một frame (byte, không tính '\n')
+RECV_SIZE = 64 * 1024
+
+
+class FrameTooLarge(ValueError):
+    """Frame vượt quá max_frame (client gửi rác hoặc quên '\\n')"""
+
+
+class LineFramer:
+    """Buffer theo từng kết nối, trả về MỌI dòng hoàn chỉnh đã nhận.
+
+    Dữ liệu được nối vào một bytearray dùng lại (không `bytes +=`), vị trí quét
+    được nhớ lại nên mỗi byte chỉ được tìm '\\n' một lần. Phần còn dư sau một dòng
+    (tin nhắn gửi dồn trong cùng một segment TCP) được giữ lại cho lần sau.
+    """
+    __slots__ = ("max_frame", "_buf", "_start", "_scan")
+
+    def __init__(self, max_frame: int = MAX_FRAME):
+        self.max_frame = max_frame
+        self._buf = bytearray()
+        self._start = 0   # đầu frame chưa đọc
+        self._scan = 0    # vị trí bắt đầu tìm '\n'
+
+    def feed(self, data: bytes):
+        if self._start:
+            # Dồn phần chưa đọc lên đầu buffer (chỉ còn dữ liệu của frame dở dang)
+            del self._buf[:self._start]
+            self._scan -= self._start
+            self._start = 0
+        self._buf += data
+
+    def next_frame(self):
+        """Trả về dòng hoàn chỉnh tiếp theo (bytes, không có '\\n') hoặc None"""
+        i = self._buf.find(b"\n", self._scan)
+        if i < 0:
+            self._scan = len(self._buf)
+            if self._scan - self._start > self.max_frame:
+                raise FrameTooLarge(f"frame > {self.max_frame} bytes")
+            return None
+        if i - self._start > self.max_frame:
+            raise FrameTooLarge(f"frame > {self.max_frame} bytes")
+        with memoryview(self._buf) as view:
+            frame = view[self._start:i].tobytes()
+        self._start = self._scan = i + 1
+        return frame
+
+    def frames(self):
+        """Generator lấy lần lượt mọi dòng hoàn chỉnh đang có trong buffer"""
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            yield frame
+
+    def drain(self) -> bytes:
+        """Lấy ra toàn bộ dữ liệu chưa đọc và làm rỗng buffer"""
+        rest = bytes(self._buf[self._start:])
+        self._buf.clear()
+        self._start = self._scan = 0
+        return rest
+
+    def pending(self) -> int:
+        return len(self._buf) - self._start
+
+
+class LengthPrefixedFramer:
+    """Frame nhị phân: 4 byte độ dài (big-endian) + payload. Cùng giao diện với LineFramer."""
+
+    HEADER = 4
+    __slots__ = ("max_frame", "_buf", "_start")
+
+    def __init__(self, max_frame: int = MAX_FRAME):
+        self.max_frame = max_frame
+        self._buf = bytearray()
+        self._start = 0
+
+    def feed(self, data: bytes):
+        if self._start:
+            del self._buf[:self._start]
+            self._start = 0
+        self._buf += data
+
+    def next_frame(self):
+        start = self._start
+        if len(self._buf) - start < self.HEADER:
+            return None
+        size = int.from_bytes(self._buf[start:start + self.HEADER], "big")
+        if size > self.max_frame:
+            raise FrameTooLarge(f"frame > {self.max_frame} bytes")
+        end = start + self.HEADER + size
+        if len(self._buf) < end:
+            return None
+        with memoryview(self._buf) as view:
+            frame = view[start + self.HEADER:end].tobytes()
+        self._start = end
+        return frame
+
+    def frames(self):
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            yield frame
+
+    def drain(self) -> bytes:
+        rest = bytes(self._buf[self._start:])
+        self._buf.clear()
+        self._start = 0
+        return rest
+
+    def pending(self) -> int:
+        return len(self._buf) - self._start
+
+
+def recv_frame(sock, framer: LineFramer, bufsize: int = RECV_SIZE):
+    """Đọc frame tiếp theo từ socket (blocking). Trả về None khi socket đóng.
+
+    Có thể ném socket.timeout / OSError / FrameTooLarge cho nơi gọi xử lý.
+    """
+    while True:
+        frame = framer.next_frame()
+        if frame is not None:
+            return frame
+        part = sock.recv(bufsize)
+        if not part:
+            return None
+        framer.feed(part)
@@ -0,0 +1,154 @@
+# server/admission.py
+"""Kiểm soát tải: giới hạn tốc độ tin nhắn, trần số kết nối, cắt tải khi hàng đợi ghép quá dài
+
+- Mỗi kết nối có một token bucket chung cho mọi tin nhắn ("*") và một bucket cho từng
+  loại tin nhắn trong RATE_LIMITS. Tin nhắn vượt giới hạn bị bỏ, client nhận `error`
+  (reason "rate_limited"). Mỗi lần vượt trừ một "strike" (bucket nạp 1/giây, chứa
+  MAX_STRIKES); hết strike thì ngắt kết nối.
+- Tầng I/O gọi `admit_connection()` ngay khi accept. Đã đủ MAX_CONNECTIONS kết nối thì
+  gửi `error` (reason "server_full") rồi đóng, không tạo thread/task cho kết nối đó.
+- `join_queue` bị từ chối (reason "overloaded") khi số người chờ ghép đã tới MAX_BACKLOG.
+
+Bucket được nạp lười mỗi khi có tin nhắn (không có timer), trạng thái nằm trên kết nối.
+Các giới hạn áp dụng cho từng process (mỗi worker của cluster giới hạn riêng).
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.codec import JSON
+from connection import ACTIVE_CONNECTIONS
+import metrics
+
+MAX_CONNECTIONS = 10000   # kết nối đang mở tối đa của process, 0 = không giới hạn
+MAX_BACKLOG = 5000        # người chờ ghép tối đa, quá thì từ chối join_queue, 0 = không giới hạn
+MAX_STRIKES = 20          # số lần vượt giới hạn (nạp lại 1/giây) trước khi ngắt kết nối
+RETRY_AFTER = 1.0         # giây, gợi ý cho client trong `error`
+
+# {loại tin nhắn: (token mỗi giây, dung lượng bucket)}; "*" tính mọi tin nhắn của kết nối
+RATE_LIMITS = {
+    "*": (100.0, 200),
+    "join": (1.0, 5),
+    "resume": (1.0, 5),
+    "join_queue": (5.0, 10),
+    "get_leaderboard": (5.0, 20),
+    "move": (50.0, 100),
+}
+_limits = dict(RATE_LIMITS)   # RATE_LIMITS đã nhân hệ số của set_limits, rỗng = tắt
+
+# Kết quả của check_message
+ALLOW, LIMITED, ABUSIVE = 0, 1, 2
+
+REJECTED = {reason: metrics.counter("rps_admission_rejected_total", "Số yêu cầu bị từ chối vì quá tải",
+                                    {"reason": reason})
+            for reason in ("server_full", "rate_limited", "overloaded")}
+ABUSIVE_DISCONNECTS = metrics.counter("rps_rate_limit_disconnects_total",
+                                      "Số kết nối bị ngắt vì liên tục vượt giới hạn tốc độ")
+
+# Trả lời kết nối bị từ chối lúc accept (chưa chọn codec nên luôn là JSON)
+SERVER_FULL = JSON.encode({"type": "error", "reason": "server_full", "retry_after": RETRY_AFTER})
+
+
+class TokenBucket:
+    """Token bucket nạp lười: `rate` token mỗi giây, chứa tối đa `burst`"""
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now, n=1):
+        """Lấy n token, False (không lấy gì) nếu không đủ"""
+        tokens = self.tokens + (now - self.updated) * self.rate
+        if tokens > self.burst:
+            tokens = self.burst
+        self.updated = now
+        if tokens < n:
+            self.tokens = tokens
+            return False
+        self.tokens = tokens - n
+        return True
+
+
+class RateLimiter:
+    """Các bucket của một kết nối, tạo khi kết nối gửi tin nhắn đầu tiên"""
+    __slots__ = ("buckets", "strikes")
+
+    def __init__(self, now):
+        self.buckets = {}   # {loại tin nhắn: TokenBucket}, chỉ các loại có trong giới hạn
+        self.strikes = TokenBucket(1.0, MAX_STRIKES, now)
+
+    def allow(self, msg_type, now):
+        bucket = self.buckets.get("*")
+        if bucket is None:
+            bucket = self._bucket("*", now)
+        if not bucket.take(now):
+            return False
+        bucket = self.buckets.get(msg_type)
+        if bucket is None:
+            if msg_type not in _limits:
+                return True
+            bucket = self._bucket(msg_type, now)
+        return bucket.take(now)
+
+    def _bucket(self, msg_type, now):
+        rate, burst = _limits[msg_type]
+        bucket = self.buckets[msg_type] = TokenBucket(rate, burst, now)
+        return bucket
+
+
+def set_limits(max_connections=None, max_backlog=None, rate_scale=None):
+    """Đổi trần kết nối, ngưỡng hàng đợi và nhân mọi giới hạn tốc độ với rate_scale (0 = tắt)"""
+    global MAX_CONNECTIONS, MAX_BACKLOG, _limits
+    if max_connections is not None:
+        MAX_CONNECTIONS = max_connections
+    if max_backlog is not None:
+        MAX_BACKLOG = max_backlog
+    if rate_scale is not None:
+        if rate_scale < 0:
+            raise ValueError("rate_scale phải >= 0")
+        _limits = {msg_type: (rate * rate_scale, max(1, int(burst * rate_scale)))
+                   for msg_type, (rate, burst) in RATE_LIMITS.items()} if rate_scale else {}
+
+
+def admit_connection():
+    """Gọi lúc accept, trước khi tính kết nối mới vào ACTIVE_CONNECTIONS"""
+    if MAX_CONNECTIONS and ACTIVE_CONNECTIONS.value >= MAX_CONNECTIONS:
+        REJECTED["server_full"].inc()
+        return False
+    return True
+
+
+def check_message(sock, msg_type, now):
+    """ALLOW | LIMITED (bỏ tin nhắn) | ABUSIVE (ngắt kết nối) cho tin nhắn loại msg_type"""
+    if not _limits:
+        return ALLOW
+    if not isinstance(msg_type, str):
+        msg_type = None   # type lạ chỉ tính vào bucket chung
+    limiter = sock.limiter
+    if limiter is None:
+        limiter = sock.limiter = RateLimiter(now)
+    if limiter.allow(msg_type, now):
+        return ALLOW
+    if not limiter.strikes.take(now):
+        ABUSIVE_DISCONNECTS.inc()
+        return ABUSIVE
+    REJECTED["rate_limited"].inc()
+    return LIMITED
+
+
+def backlog_full(backlog):
+    """True nếu hàng đợi ghép (`backlog` người chờ) đã tới ngưỡng cắt tải"""
+    if MAX_BACKLOG and backlog >= MAX_BACKLOG:
+        REJECTED["overloaded"].inc()
+        return True
+    return False
+
+
+def error_message(reason, msg_type=None):
+    msg = {"type": "error", "reason": reason, "retry_after": RETRY_AFTER}
+    if msg_type is not None:
+        msg["message"] = msg_type
+    return msg
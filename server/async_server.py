@@ -0,0 +1,88 @@
+import asyncio
+
+from connection import StreamConnection, CONNECTIONS, ACTIVE_CONNECTIONS
+import admission
+import game_manager
+from common.framing import RECV_SIZE
+from game_manager import handle_message, handle_connect, handle_disconnect, clients
+from leaderboard import start_writer, stop_writer
+from logger import save_log, event_log
+import metrics
+
+HOST = '127.0.0.1'
+PORT = 9009
+METRICS_PORT = 9100
+
+
+async def handle_stream(reader, writer, on_message=handle_message, on_disconnect=handle_disconnect):
+    """Xử lý một client trên event loop (tương đương server.handle_client)"""
+    addr = writer.get_extra_info("peername")
+    if not admission.admit_connection():
+        writer.write(admission.SERVER_FULL)
+        writer.close()
+        return
+    conn = StreamConnection(writer, addr)
+    CONNECTIONS.inc()
+    ACTIVE_CONNECTIONS.inc()
+    handle_connect(conn)
+    print(f"[CONNECT] {addr} connected")
+    try:
+        while True:
+            try:
+                data = await reader.read(RECV_SIZE)
+            except ConnectionError:
+                break
+            if not data:
+                break
+            conn.feed(data)
+            try:
+                for msg in conn.messages():
+                    on_message(conn, msg)
+            except ValueError:  # dữ liệu lỗi hoặc FrameTooLarge
+                break
+    except asyncio.CancelledError:
+        pass   # event loop đang dừng: dọn kết nối như ngắt thường, không in traceback
+    finally:
+        player_name = clients.get(conn)
+        on_disconnect(conn)
+        conn.close()
+        ACTIVE_CONNECTIONS.dec()
+        print(f"[DISCONNECT] {player_name or addr}")
+        if player_name:
+            save_log(f"{player_name} disconnected")
+
+
+async def run_timers():
+    """Quay bánh xe hạn giờ trên event loop (callback chạy trên loop, như handle_message)"""
+    timers = game_manager.timers
+    while True:
+        await asyncio.sleep(timers.tick)
+        timers.advance()
+
+
+async def serve(host=HOST, port=PORT, metrics_port=METRICS_PORT):
+    server = await asyncio.start_server(handle_stream, host, port, backlog=4096)
+    print(f"[SERVER] Running on {host}:{port} (asyncio)")
+    save_log("Server started (asyncio)")
+    start_writer()
+    game_manager.schedule_housekeeping()
+    timer_task = asyncio.create_task(run_timers())  # giữ tham chiếu để task không bị thu hồi
+    if metrics_port:
+        metrics.start_metrics_server(port=metrics_port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        timer_task.cancel()
+
+
+def start_async_server(host=HOST, port=PORT, metrics_port=METRICS_PORT):
+    """Chạy server ở chế độ asyncio: một thread, không tạo thread cho mỗi kết nối"""
+    try:
+        asyncio.run(serve(host, port, metrics_port))
+    except KeyboardInterrupt:
+        print("[SERVER] Shutting down...")
+        save_log("Server stopped")
+    finally:
+        stop_writer()
+        event_log.stop()
@@ -0,0 +1,509 @@
+"""Chế độ cluster: nhiều worker process cùng nhận kết nối trên một cổng.
+
+- Mỗi worker chạy server asyncio riêng (SO_REUSEPORT, hoặc chia sẻ socket
+  listen tạo sẵn trước khi fork nếu hệ điều hành không hỗ trợ) và tự xử lý
+  các trận của mình.
+- Coordinator (tiến trình cha) nghe trên Unix socket, giữ hàng đợi ghép cặp
+  chung và leaderboard. Nó ưu tiên ghép hai người cùng worker (trận chạy hoàn
+  toàn trong worker đó), chỉ ghép chéo worker khi cần.
+- Trận chéo worker do worker của người chơi thứ nhất quản lý; người chơi ở
+  worker kia được đại diện bằng `RemotePlayer`, tin nhắn hai chiều được
+  coordinator chuyển tiếp.
+
+Giao thức IPC: JSON theo dòng, trường "op":
+  worker -> coordinator: hello, enqueue, cancel, offline, score, relay
+  coordinator -> worker: match, relay, board (ảnh chụp leaderboard cho get_leaderboard)
+"""
+import asyncio
+import functools
+import itertools
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from async_server import handle_stream, run_timers
+from common.codec import CODECS, JSON
+from connection import Connection
+from match_queue import MatchQueue
+import admission
+import game_manager
+import journal
+import leaderboard
+from logger import save_log, event_log
+import metrics
+from rules import Move, parse_move
+
+IPC_PATH = "/tmp/rps_coordinator.sock"
+IPC_CODEC = CODECS.get("orjson", JSON)
+
+
+def worker_of(pid):
+    """pid có dạng "<worker>:<số thứ tự>" """
+    return int(pid.split(":", 1)[0])
+
+
+def stop_on_sigterm():
+    """SIGTERM hủy task chính của event loop (như asyncio xử lý Ctrl+C)
+
+    Gọi trong task chính. Không để KeyboardInterrupt bung ra giữa callback của một kết nối,
+    các task còn lại bị hủy và tự dọn khi asyncio.run đóng loop.
+    """
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+
+# ---------------------------------------------------------------- coordinator
+
+class Coordinator:
+    """Ghép cặp xuyên worker và giữ leaderboard chung cho cả cluster"""
+
+    def __init__(self):
+        self.workers = {}    # {worker_id: StreamWriter}
+        self.queues = {}     # {worker_id: MatchQueue của pid}
+        self.names = {}      # {pid: player_name}
+        self.online = set()  # pid còn kết nối (do worker sở hữu pid báo)
+        self.board = None    # ảnh chụp leaderboard đã gửi cho các worker
+
+    def send(self, worker_id, obj):
+        writer = self.workers.get(worker_id)
+        if writer is not None and not writer.is_closing():
+            writer.write(IPC_CODEC.encode(obj))
+
+    def enqueue(self, pid, name, sender):
+        w = worker_of(pid)
+        if sender == w:
+            self.online.add(pid)
+        elif pid not in self.online:
+            # Worker khác trả người chơi về hàng đợi nhưng người đó đã rời
+            return
+        self.names[pid] = name
+        local = self.queues.setdefault(w, MatchQueue())
+        if pid in local:
+            return
+        # 1. Cùng worker: trận không cần chuyển tiếp qua IPC
+        other = local.pop()
+        if other is None:
+            # 2. Worker khác đang có người chờ
+            for ow, q in self.queues.items():
+                if ow != w and len(q):
+                    other = q.pop()
+                    break
+        if other is None:
+            local.push(pid)
+            return
+        self.pair(other, pid)
+
+    def cancel(self, pid):
+        q = self.queues.get(worker_of(pid))
+        if q is not None:
+            q.discard(pid)
+
+    def offline(self, pid):
+        self.cancel(pid)
+        self.online.discard(pid)
+        self.names.pop(pid, None)
+
+    def pair(self, pid1, pid2):
+        host = worker_of(pid1)
+        msg = {"op": "match", "host": host,
+               "p1": [pid1, self.names.get(pid1, "Unknown")],
+               "p2": [pid2, self.names.get(pid2, "Unknown")]}
+        self.send(host, msg)
+        if worker_of(pid2) != host:
+            self.send(worker_of(pid2), msg)
+
+    def handle(self, msg, sender):
+        op = msg.get("op")
+        if op == "enqueue":
+            self.enqueue(msg["pid"], msg.get("name", "Unknown"), sender)
+        elif op == "cancel":
+            self.cancel(msg["pid"])
+        elif op == "offline":
+            self.offline(msg["pid"])
+        elif op == "relay":
+            self.send(msg["worker"], msg)
+        elif op == "score":
+            leaderboard.record_match(msg["player"], msg["result"], msg["opponent"], msg["opponent_result"])
+
+    async def handle_worker(self, reader, writer):
+        framer = IPC_CODEC.framer()
+        worker_id = None
+        try:
+            while True:
+                try:
+                    data = await reader.read(65536)
+                except ConnectionError:
+                    break
+                if not data:
+                    break
+                framer.feed(data)
+                for frame in framer.frames():
+                    msg = IPC_CODEC.decode(frame)
+                    if msg.get("op") == "hello":
+                        worker_id = msg["worker"]
+                        self.workers[worker_id] = writer
+                        self.queues.setdefault(worker_id, MatchQueue())
+                        if self.board is not None:
+                            self.send(worker_id, self.board_message(self.board))
+                    else:
+                        self.handle(msg, worker_id)
+        except asyncio.CancelledError:
+            pass   # coordinator đang dừng
+        finally:
+            if worker_id is not None:
+                self.workers.pop(worker_id, None)
+                self.queues.pop(worker_id, None)
+                self.online = {pid for pid in self.online if worker_of(pid) != worker_id}
+            writer.close()
+
+    @staticmethod
+    def board_message(snap):
+        return {"op": "board", "version": snap.version, "rows": snap.rows}
+
+    async def publish_board(self):
+        """Gửi ảnh chụp leaderboard cho mọi worker, tối đa một lần mỗi SNAPSHOT_INTERVAL và chỉ khi đổi"""
+        while True:
+            snap = leaderboard.board_snapshot()
+            if snap is not self.board:
+                self.board = snap
+                msg = self.board_message(snap)
+                for worker_id in list(self.workers):
+                    self.send(worker_id, msg)
+            await asyncio.sleep(leaderboard.SNAPSHOT_INTERVAL)
+
+    async def serve(self, path, ready):
+        if os.path.exists(path):
+            os.remove(path)
+        parent = os.getppid()
+        stop_on_sigterm()
+        server = await asyncio.start_unix_server(self.handle_worker, path)
+        publisher = asyncio.create_task(self.publish_board())  # giữ tham chiếu để task không bị thu hồi
+        ready.set()
+        try:
+            async with server:
+                # Tiến trình cha chết (kể cả bị kill -9) thì coordinator cũng dừng,
+                # các worker mất kết nối IPC sẽ tự thoát theo
+                while os.getppid() == parent:
+                    await asyncio.sleep(1)
+        finally:
+            publisher.cancel()
+
+
+def run_coordinator(path, ready, metrics_port=0, journal_dir=None):
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    if journal_dir:
+        # Kết quả trận (và leaderboard) chỉ nằm ở coordinator
+        journal.setup(journal_dir)
+    leaderboard.start_writer()
+    if metrics_port:
+        metrics.start_metrics_server(port=metrics_port)
+    try:
+        asyncio.run(Coordinator().serve(path, ready))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        leaderboard.stop_writer()
+        journal.shutdown()
+
+
+# ---------------------------------------------------------------- worker
+
+class RemotePlayer(Connection):
+    """Đại diện cho người chơi ở worker khác trong một trận do worker này quản lý"""
+    __slots__ = ("worker", "pid", "name")
+
+    def __init__(self, worker, pid, name):
+        super().__init__(("worker", worker_of(pid)))
+        self.worker = worker
+        self.pid = pid
+        self.name = name
+
+    def send_message(self, obj):
+        self.worker.relay(worker_of(self.pid), "send", self.pid, obj)
+
+    def send_messages(self, objs):
+        for obj in objs:
+            self.send_message(obj)
+
+    def close(self):
+        # Server ngắt người chơi (vd. _reap khi hết giờ nhiều round): worker sở hữu cắt kết nối thật,
+        # on_disconnect ở đó gửi lại "leave" để trận ở đây kết thúc như với kết nối cục bộ
+        if not self.closed:
+            self.closed = True
+            self.worker.relay(worker_of(self.pid), "close", self.pid)
+
+
+class ClusterMatchmaker:
+    """Bộ ghép cặp của worker: chuyển enqueue/cancel sang coordinator"""
+
+    def __init__(self, worker):
+        self.worker = worker
+
+    def enqueue(self, sock):
+        if isinstance(sock, RemotePlayer):
+            # Người chơi ở worker khác quay lại hàng đợi: bỏ proxy ở đây
+            pid, name = sock.pid, sock.name
+            self.worker.drop_proxy(sock)
+        else:
+            if sock in self.worker.remote or sock in game_manager.matches:
+                return
+            pid, name = self.worker.pid_of(sock), game_manager.clients.get(sock, "Unknown")
+        self.worker.send({"op": "enqueue", "pid": pid, "name": name})
+
+    def cancel(self, sock):
+        pid = self.worker.pids.get(sock)
+        if pid is not None:
+            self.worker.send({"op": "cancel", "pid": pid})
+
+    def __len__(self):
+        # Coordinator ghép ngay khi có hai người chờ nên hàng đợi không dồn: không cắt tải ở worker
+        return 0
+
+    def __contains__(self, sock):
+        # Hàng đợi nằm ở coordinator: coi client đã đăng ký với coordinator mà chưa có trận là đang chờ
+        return sock in self.worker.pids and sock not in game_manager.matches and sock not in self.worker.remote
+
+
+class Worker:
+    """Một worker process: server asyncio + kết nối IPC tới coordinator"""
+
+    def __init__(self, worker_id):
+        self.id = worker_id
+        self.writer = None
+        self.counter = itertools.count(1)
+        self.pids = {}      # {conn: pid} của client kết nối vào worker này
+        self.conns = {}     # {pid: conn}
+        self.proxies = {}   # {pid: RemotePlayer} trong các trận worker này quản lý
+        self.remote = {}    # {conn: worker quản lý trận} cho client đang đánh trận ở worker khác
+
+    def send(self, obj):
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.write(IPC_CODEC.encode(obj))
+
+    def relay(self, worker_id, kind, pid, msg=None):
+        self.send({"op": "relay", "worker": worker_id, "kind": kind, "pid": pid, "msg": msg})
+
+    def pid_of(self, conn):
+        pid = self.pids.get(conn)
+        if pid is None:
+            pid = f"{self.id}:{next(self.counter)}"
+            self.pids[conn] = pid
+            self.conns[pid] = conn
+        return pid
+
+    # --- sự kiện từ client
+
+    def on_message(self, conn, msg):
+        host = self.remote.get(conn)
+        if host is not None and msg.get("type") == "move":
+            # Trận do worker khác quản lý: chuyển nước đi sang đó (giới hạn tốc độ như handle_message)
+            now = conn.last_seen = time.monotonic()
+            verdict = admission.check_message(conn, "move", now)
+            if verdict != admission.ALLOW:
+                game_manager._rate_limited(conn, "move", verdict)
+                return
+            move = parse_move(msg.get("move"))
+            if move is not None:
+                self.relay(host, "move", self.pids[conn], int(move))
+            return
+        game_manager.handle_message(conn, msg)
+
+    def on_disconnect(self, conn):
+        host = self.remote.pop(conn, None)
+        if host is not None:
+            self.relay(host, "leave", self.pids[conn])
+            game_manager.clients.pop(conn, None)
+        else:
+            game_manager.handle_disconnect(conn)
+        pid = self.pids.pop(conn, None)
+        if pid is not None:
+            self.conns.pop(pid, None)
+            self.send({"op": "offline", "pid": pid})
+
+    def drop_proxy(self, proxy):
+        self.proxies.pop(proxy.pid, None)
+        game_manager.clients.pop(proxy, None)
+
+    # --- sự kiện từ coordinator
+
+    def on_match(self, msg):
+        host = msg["host"]
+        (pid1, _), (pid2, name2) = msg["p1"], msg["p2"]
+        if host != self.id:
+            # Trận do worker khác quản lý, client của mình là p2
+            conn = self.conns.get(pid2)
+            if conn is None:
+                self.relay(host, "leave", pid2)
+            else:
+                self.remote[conn] = host
+            return
+
+        conn1 = self.conns.get(pid1)
+        if worker_of(pid2) == self.id:
+            conn2 = self.conns.get(pid2)
+        else:
+            conn2 = RemotePlayer(self, pid2, name2)
+            self.proxies[pid2] = conn2
+            game_manager.clients[conn2] = name2
+
+        if conn1 is None or conn1 not in game_manager.clients:
+            # p1 đã rời trước khi trận bắt đầu: hủy trận, đưa p2 về hàng đợi
+            if isinstance(conn2, RemotePlayer):
+                self.relay(worker_of(pid2), "void", pid2)
+            if conn2 is not None:
+                game_manager.matchmaker.enqueue(conn2)
+            return
+        if conn2 is None or conn2 not in game_manager.clients:
+            game_manager.matchmaker.enqueue(conn1)
+            return
+        game_manager.start_match(conn1, conn2)
+
+    def on_relay(self, msg):
+        kind, pid = msg["kind"], msg["pid"]
+        if kind == "send":
+            conn = self.conns.get(pid)
+            if conn is None:
+                return
+            obj = msg["msg"]
+            if obj.get("type") in ("opponent_disconnected", "game_over"):
+                self.remote.pop(conn, None)
+            game_manager.send_json(conn, obj)
+        elif kind == "void":
+            conn = self.conns.get(pid)
+            if conn is not None:
+                self.remote.pop(conn, None)
+        elif kind == "close":
+            conn = self.conns.get(pid)
+            if conn is not None:
+                conn.abort()
+        elif kind == "move":
+            proxy = self.proxies.get(pid)
+            if proxy is not None:
+                proxy.missed_rounds = 0   # như handle_message với nước đi cục bộ
+                game_manager.handle_move(proxy, Move(msg["msg"]))
+        elif kind == "leave":
+            proxy = self.proxies.pop(pid, None)
+            if proxy is not None:
+                game_manager.handle_disconnect(proxy)
+
+    async def read_coordinator(self, reader):
+        framer = IPC_CODEC.framer()
+        while True:
+            try:
+                data = await reader.read(65536)
+            except ConnectionError:
+                data = b""
+            if not data:
+                print(f"[WORKER {self.id}] Lost coordinator")
+                return
+            framer.feed(data)
+            for frame in framer.frames():
+                msg = IPC_CODEC.decode(frame)
+                op = msg.get("op")
+                if op == "match":
+                    self.on_match(msg)
+                elif op == "relay":
+                    self.on_relay(msg)
+                elif op == "board":
+                    leaderboard.install_snapshot(msg["rows"], msg["version"])
+
+    async def run(self, listen_sock, ipc_path):
+        stop_on_sigterm()
+        reader, self.writer = await asyncio.open_unix_connection(ipc_path)
+        self.send({"op": "hello", "worker": self.id})
+
+        game_manager.set_matchmaker(ClusterMatchmaker(self))
+        game_manager.set_remote_match_check(self.remote.__contains__)
+        # Bảng điểm nằm ở coordinator: get_leaderboard dùng ảnh chụp coordinator gửi tới
+        leaderboard.install_snapshot(())
+        # Kết nối lại có thể rơi vào worker khác (SO_REUSEPORT) nên không giữ phiên
+        game_manager.set_resume_grace(0)
+        game_manager.set_score_sink(
+            lambda player, result, opponent, opponent_result: self.send(
+                {"op": "score", "player": player, "result": result,
+                 "opponent": opponent, "opponent_result": opponent_result}))
+
+        game_manager.schedule_housekeeping()
+        timer_task = asyncio.create_task(run_timers())  # giữ tham chiếu để task không bị thu hồi
+        handler = functools.partial(handle_stream, on_message=self.on_message,
+                                    on_disconnect=self.on_disconnect)
+        server = await asyncio.start_server(handler, sock=listen_sock, backlog=4096)
+        try:
+            async with server:
+                await self.read_coordinator(reader)
+        finally:
+            timer_task.cancel()
+
+
+def make_listener(host, port, reuse_port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(4096)
+    sock.setblocking(False)
+    return sock
+
+
+def run_worker(worker_id, host, port, ipc_path, shared_sock=None, metrics_port=0, journal_dir=None):
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    # Mỗi worker ghi log sự kiện (và journal join/match/move) ra file riêng
+    event_log.filename = f"game_log.worker{worker_id}.txt"
+    if journal_dir:
+        journal.setup(os.path.join(journal_dir, f"worker{worker_id}"), recover=False)
+    if metrics_port:
+        metrics.start_metrics_server(port=metrics_port + 1 + worker_id)
+    listen_sock = shared_sock or make_listener(host, port, reuse_port=True)
+    print(f"[WORKER {worker_id}] pid={os.getpid()} listening on {host}:{port}")
+    try:
+        asyncio.run(Worker(worker_id).run(listen_sock, ipc_path))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        event_log.stop()
+        journal.shutdown()
+
+
+def start_cluster(host, port, workers=None, ipc_path=IPC_PATH, metrics_port=0, journal_dir=None):
+    """Chạy coordinator + N worker process (mặc định N = số CPU)
+
+    Nếu có `metrics_port`: coordinator mở /metrics trên cổng đó, worker i trên cổng + 1 + i.
+    """
+    workers = workers or os.cpu_count() or 1
+    ctx = multiprocessing.get_context("fork")
+
+    ready = ctx.Event()
+    coordinator = ctx.Process(target=run_coordinator, args=(ipc_path, ready, metrics_port, journal_dir),
+                              daemon=True)
+    coordinator.start()
+    ready.wait(10)
+
+    # Không có SO_REUSEPORT: tạo socket listen một lần, các worker dùng chung sau khi fork
+    shared = None if hasattr(socket, "SO_REUSEPORT") else make_listener(host, port, reuse_port=False)
+    procs = [ctx.Process(target=run_worker,
+                         args=(i, host, port, ipc_path, shared, metrics_port, journal_dir), daemon=True)
+             for i in range(workers)]
+    for p in procs:
+        p.start()
+    print(f"[SERVER] Cluster running on {host}:{port} with {workers} workers")
+    save_log(f"Cluster started with {workers} workers")
+    # SIGTERM dừng như Ctrl+C: tắt worker rồi coordinator theo thứ tự ở finally bên dưới
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        print("[SERVER] Shutting down...")
+        save_log("Server stopped")
+    finally:
+        # Dừng worker trước để các kết quả cuối kịp tới coordinator
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.join(timeout=5)
+        coordinator.terminate()
+        coordinator.join(timeout=5)
+        event_log.stop()
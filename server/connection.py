@@ -0,0 +1,300 @@
+import asyncio
+import os
+import selectors
+import socket
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.codec import JSON
+from common.framing import RECV_SIZE
+import metrics
+
+CONNECTIONS = metrics.counter("rps_connections_total", "Số kết nối đã chấp nhận")
+ACTIVE_CONNECTIONS = metrics.gauge("rps_connections_active", "Số kết nối đang mở")
+SLOW_DISCONNECTS = metrics.counter("rps_slow_consumer_disconnects_total",
+                                   "Số kết nối bị ngắt vì không đọc dữ liệu (vượt HIGH_WATER)")
+
+# Số byte tối đa chờ gửi cho một kết nối; vượt quá thì coi là client không đọc nữa và ngắt
+HIGH_WATER = 1024 * 1024
+# Gửi không chặn cho socket blocking (không có trên Windows: khi đó gửi blocking như cũ)
+_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+
+
+class Connection:
+    """Một kết nối client: codec đang dùng + framer đọc dữ liệu vào
+
+    Đối tượng kết nối được dùng làm khóa trong `clients`, `queue`, `matches`
+    của game_manager, ở cả chế độ thread lẫn asyncio. Dùng __slots__ (cả ở lớp con)
+    để mỗi kết nối không mang theo một __dict__.
+    """
+    __slots__ = ("addr", "codec", "framer", "session", "closed", "last_seen", "missed_rounds", "limiter")
+
+    def __init__(self, addr):
+        self.addr = addr
+        self.codec = JSON
+        self.framer = self.codec.framer()
+        self.session = None   # token phiên, cấp khi join
+        self.closed = False
+        self.last_seen = 0.0  # time.monotonic() của tin nhắn gần nhất
+        self.missed_rounds = 0
+        self.limiter = None   # admission.RateLimiter, tạo khi có tin nhắn đầu tiên
+
+    def feed(self, data):
+        self.framer.feed(data)
+
+    def messages(self):
+        """Giải mã lần lượt các tin nhắn đã nhận đủ
+
+        Đọc lại self.framer ở mỗi vòng để việc đổi codec giữa chừng (sau `join`)
+        áp dụng ngay cho các frame phía sau.
+        """
+        while True:
+            frame = self.framer.next_frame()
+            if frame is None:
+                return
+            msg = self.codec.decode(frame)
+            if not isinstance(msg, dict):
+                raise ValueError("message must be an object")
+            yield msg
+
+    def set_codec(self, codec):
+        """Đổi codec; phần dữ liệu chưa đọc được chuyển sang framer mới"""
+        if codec is self.codec:
+            return
+        rest = self.framer.drain()
+        self.codec = codec
+        self.framer = codec.framer()
+        if rest:
+            self.framer.feed(rest)
+
+    def send_message(self, obj):
+        self.sendall(self.codec.encode(obj))
+
+    def send_messages(self, objs):
+        """Gửi nhiều tin nhắn bằng một lần ghi (vd. round_result + request_move)"""
+        self.sendall(b"".join([self.codec.encode(obj) for obj in objs]))
+
+    def sendall(self, data):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def abort(self):
+        """Cắt kết nối từ phía server; vòng đọc của kết nối sẽ thoát và dọn dẹp
+
+        `closed` đặt ngay, để các tin nhắn còn trong buffer không được xử lý nữa.
+        """
+        self.close()
+
+
+class SocketConnection(Connection):
+    """Kết nối socket blocking (chế độ thread)
+
+    Thread nhận đọc blocking như cũ. Việc gửi không bao giờ chặn thread gọi: dữ liệu
+    được gửi ngay nếu socket còn chỗ, phần còn lại nằm trong hàng đợi `_out` và do
+    thread `_sender` gửi tiếp khi socket ghi được. Các tin nhắn đến khi hàng đợi chưa
+    trống được gộp vào cùng một lần ghi.
+    """
+
+    __slots__ = ("sock", "_out", "_out_lock", "_watched", "_failed")
+
+    def __init__(self, sock, addr):
+        super().__init__(addr)
+        self.sock = sock
+        self._out = bytearray()
+        self._out_lock = threading.Lock()
+        self._watched = False   # đang chờ _sender gửi tiếp
+        self._failed = False    # lỗi gửi hoặc vượt HIGH_WATER, chờ thread nhận dọn dẹp
+
+    def recv_message(self):
+        """Đọc tin nhắn tiếp theo (blocking), None khi client đóng kết nối"""
+        while True:
+            for msg in self.messages():
+                return msg
+            part = self.sock.recv(RECV_SIZE)
+            if not part:
+                return None
+            self.feed(part)
+
+    def sendall(self, data):
+        if not _DONTWAIT:
+            self.sock.sendall(data)
+            return
+        with self._out_lock:
+            if self.closed or self._failed:
+                raise ConnectionError("connection closed")
+            if not self._out:
+                try:
+                    sent = self.sock.send(data, _DONTWAIT)
+                except (BlockingIOError, InterruptedError):
+                    sent = 0
+                except OSError:
+                    self._fail()
+                    raise
+                if sent == len(data):
+                    return
+                data = memoryview(data)[sent:]
+            self._out += data
+            if len(self._out) > HIGH_WATER:
+                print(f"[SLOW] {self.addr} không đọc dữ liệu, ngắt kết nối")
+                SLOW_DISCONNECTS.inc()
+                self._fail()
+                raise ConnectionError("send queue over high-water mark")
+            if not self._watched:
+                self._watched = True
+                _sender.watch(self)
+
+    def _fail(self):
+        """Bỏ dữ liệu chờ gửi và shutdown socket để thread nhận thoát và dọn dẹp"""
+        self._failed = True
+        self._out.clear()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _drain(self):
+        """Gửi tiếp phần đang chờ (gọi từ _sender), trả về True nếu còn dữ liệu"""
+        with self._out_lock:
+            if self._out and not self.closed and not self._failed:
+                try:
+                    sent = self.sock.send(self._out, _DONTWAIT)
+                    del self._out[:sent]
+                except (BlockingIOError, InterruptedError):
+                    pass
+                except OSError:
+                    self._fail()
+            if self._out and not self.closed and not self._failed:
+                return True
+            self._watched = False
+            return False
+
+    def abort(self):
+        with self._out_lock:
+            self.closed = True
+            self._fail()
+
+    def close(self):
+        with self._out_lock:
+            self.closed = True
+            watched = self._watched
+        if watched:
+            # _sender còn giữ socket trong selector: để nó bỏ đăng ký rồi mới đóng,
+            # tránh fd bị tái sử dụng khi selector còn tham chiếu
+            _sender.watch(self)
+        else:
+            self.sock.close()
+
+
+class _SendLoop:
+    """Một thread dùng selector gửi tiếp dữ liệu chờ của mọi SocketConnection"""
+
+    def __init__(self):
+        self._sel = None
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wake_r = self._wake_w = None
+
+    def watch(self, conn):
+        with self._lock:
+            if self._sel is None:
+                self._start()
+            self._pending.append(conn)
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:  # buffer đánh thức đầy: thread chắc chắn sẽ thức dậy
+            pass
+
+    def _start(self):
+        self._sel = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._sel.register(self._wake_r, selectors.EVENT_READ)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _service(self, conn):
+        if conn._drain():
+            try:
+                self._sel.register(conn.sock, selectors.EVENT_WRITE, conn)
+            except KeyError:  # đã đăng ký
+                pass
+            return
+        try:
+            self._sel.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        if conn.closed:
+            conn.sock.close()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            for conn in pending:
+                self._service(conn)
+            for key, _ in self._sel.select():
+                if key.fileobj is self._wake_r:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except OSError:
+                        pass
+                else:
+                    self._service(key.data)
+
+
+_sender = _SendLoop()
+
+
+class StreamConnection(Connection):
+    """Bọc StreamWriter của asyncio (chế độ async)
+
+    Các tin nhắn gửi trong cùng một lượt của event loop được gộp lại và ghi một lần
+    (call_soon). Transport giữ phần chưa gửi được; vượt HIGH_WATER thì ngắt kết nối.
+    """
+
+    __slots__ = ("writer", "_loop", "_pending", "_pending_size")
+
+    def __init__(self, writer, addr):
+        super().__init__(addr)
+        self.writer = writer
+        self._loop = asyncio.get_running_loop()
+        self._pending = []
+        self._pending_size = 0
+
+    def sendall(self, data):
+        if self.writer.is_closing():
+            raise ConnectionError("connection closed")
+        if not self._pending:
+            self._loop.call_soon(self._flush)
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size + self.writer.transport.get_write_buffer_size() > HIGH_WATER:
+            print(f"[SLOW] {self.addr} không đọc dữ liệu, ngắt kết nối")
+            SLOW_DISCONNECTS.inc()
+            self._pending.clear()
+            self._pending_size = 0
+            self.writer.transport.abort()
+            raise ConnectionError("send queue over high-water mark")
+
+    def _flush(self):
+        if not self._pending:
+            return
+        data = b"".join(self._pending)
+        self._pending.clear()
+        self._pending_size = 0
+        if not self.writer.is_closing():
+            # write() chỉ ghi vào buffer của transport, không chặn event loop
+            self.writer.write(data)
+
+    def abort(self):
+        self.closed = True
+        self.writer.transport.abort()
+
+    def close(self):
+        self.closed = True
+        self._flush()
+        self.writer.close()
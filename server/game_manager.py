@@ -1,46 +1,616 @@
+import itertools
+import os
+import random
+import secrets
+import sys
 import threading
-import json
-from datetime import datetime
-from leaderboard import update_score
+import time
 
-lock = threading.Lock()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.codec import negotiate
+from leaderboard import board_snapshot, clamp_page, record_match
+from logger import save_log
+from match_queue import MatchQueue
+from rules import MOVES, Result, MOVE_NAMES, RESULT_NAMES, judge, parse_move
+from timer_wheel import TimerWheel
+import admission
+import metrics
+
+# chỉ bảo vệ hàng đợi ghép cặp, giữ trong thời gian rất ngắn
+queue_lock = metrics.TimedLock(threading.Lock(), metrics.histogram(
+    "rps_lock_wait_seconds", "Thời gian chờ lấy lock", {"lock": "queue"}))
 clients = {}   # {socket: player_name}
-queue = []     # client chờ ghép cặp
-matches = {}   # {socket: opponent_socket}
-moves = {}     # {socket: move}
+queue = MatchQueue()  # client chờ ghép cặp
+matches = {}   # {socket: Match}
+match_ids = itertools.count(1)
+journal = None  # journal.Journal nếu bật: ghi join/match/move
+MAX_NAME_BYTES = 65535   # tên người chơi (UTF-8) tối đa, journal ghi độ dài bằng U16
+
+# Phiên chơi: token cấp khi join, dùng để kết nối lại trong RESUME_GRACE giây
+RESUME_GRACE = 30.0
+session_lock = threading.Lock()
+sessions = {}    # {token: socket} của các kết nối đang sống
+suspended = {}   # {token: SuspendedSession}, theo thứ tự hết hạn
+
+# Hạn giờ: mọi hạn giờ (round, kết nối rảnh, phiên, tick ghép cặp) nằm trên một bánh xe,
+# tầng I/O gọi timers.advance() mỗi timers.tick giây
+MOVE_TIMEOUT = 30.0        # giây cho mỗi round, 0 = không giới hạn
+TIMEOUT_POLICY = "random"  # hết giờ: "random" đi hộ một nước ngẫu nhiên | "forfeit" xử thua round
+IDLE_TIMEOUT = 300.0       # ngắt kết nối không gửi gì trong chừng này giây (ngoài trận/hàng đợi)
+MAX_MISSED_ROUNDS = 3      # hết giờ liên tiếp chừng này round thì coi là bỏ đi và ngắt kết nối
+BEST_OF = 3                # mỗi trận tối đa N round có thắng thua, ai thắng N // 2 + 1 round trước thì thắng trận
+timers = TimerWheel()
+
+# Ghép cặp FIFO theo lô: join_queue chỉ thêm vào hàng đợi, một lượt match_players ghép cả
+# hàng đợi sau MATCH_TICK giây (làm tròn lên theo tick của `timers`), hoặc ngay khi đủ MATCH_BATCH người chờ
+MATCH_TICK = 0.1           # 0 = ghép ngay ở mỗi lần vào hàng đợi
+MATCH_BATCH = 64
+
+JOINS = metrics.counter("rps_joins_total", "Số lần join")
+SEND_FAILURES = metrics.counter("rps_send_failures_total", "Số lần gửi tin nhắn thất bại")
+MATCHES = metrics.counter("rps_matches_total", "Số trận đã tạo")
+ROUNDS = metrics.counter("rps_rounds_total", "Số round đã có kết quả")
+GAMES = metrics.counter("rps_games_over_total", "Số trận đã kết thúc (game_over)")
+FORFEITS = metrics.counter("rps_match_forfeits_total", "Số trận bị xử thua vì rời giữa chừng")
+MATCH_LOCK_WAIT = metrics.histogram("rps_lock_wait_seconds", "Thời gian chờ lấy lock", {"lock": "match"})
+QUEUE_WAIT = metrics.histogram("rps_queue_wait_seconds", "Thời gian từ lúc vào hàng đợi tới khi được ghép cặp")
+MOVE_TO_RESULT = metrics.histogram("rps_move_to_result_seconds", "Thời gian từ nước đi đầu tiên của round tới khi có kết quả")
+MATCH_PLAYERS_TIME = metrics.histogram("rps_match_players_seconds", "Thời gian chạy match_players")
+HANDLE_MOVE_TIME = metrics.histogram("rps_handle_move_seconds", "Thời gian chạy handle_move")
+metrics.gauge("rps_clients", "Số client đã join").set_function(lambda: len(clients))
+metrics.gauge("rps_queue_depth", "Số client trong hàng đợi").set_function(lambda: len(queue))
+metrics.gauge("rps_active_matches", "Số trận đang diễn ra").set_function(lambda: len(matches) // 2)
+metrics.gauge("rps_suspended_sessions", "Số phiên đang chờ kết nối lại").set_function(lambda: len(suspended))
+RESUMES = metrics.counter("rps_session_resumes_total", "Số lần kết nối lại thành công")
+EXPIRED = metrics.counter("rps_session_expired_total", "Số phiên hết hạn chờ kết nối lại")
+MOVE_TIMEOUTS = metrics.counter("rps_move_timeouts_total", "Số lần người chơi hết giờ chọn nước đi")
+IDLE_REAPED = metrics.counter("rps_idle_reaped_total", "Số kết nối bị ngắt vì không hoạt động")
+LEADERBOARD_QUERIES = metrics.counter("rps_leaderboard_queries_total", "Số tin nhắn get_leaderboard đã trả lời")
+metrics.gauge("rps_timers_pending", "Số hạn giờ trong bánh xe").set_function(lambda: len(timers))
+MATCH_TICK_DELAY = metrics.histogram("rps_match_tick_delay_seconds",
+                                     "Thời gian từ lúc có người vào hàng đợi tới lượt ghép cặp kế tiếp")
+MATCH_BATCH_PAIRS = metrics.histogram("rps_match_batch_pairs", "Số cặp ghép được mỗi lượt match_players",
+                                      buckets=(0, 1, 2, 5, 10, 50, 100, 500, 1000, 5000, 10000))
+
+
+class Match:
+    """Trạng thái một trận đấu, có lock riêng
+
+    Xử lý round của trận này không chặn các trận khác. Mọi thứ theo thứ tự của
+    `players`: nước đi của round hiện tại `moves` ([Move | None] * 2), số round thắng
+    `wins`; cùng với `draws`. Trận kết thúc khi một người thắng đủ `to_win` round.
+    """
+    __slots__ = ("id", "players", "moves", "active", "lock", "first_move_at", "round",
+                 "deadline", "wins", "draws", "to_win")
+
+    def __init__(self, p1, p2, best_of=None):
+        self.id = next(match_ids)
+        self.players = (p1, p2)
+        self.moves = [None, None]
+        self.active = True
+        self.lock = metrics.TimedLock(threading.Lock(), MATCH_LOCK_WAIT)
+        self.first_move_at = None  # thời điểm nước đi đầu tiên của round hiện tại
+        self.round = 0
+        self.deadline = None       # Timer hết giờ của round hiện tại
+        self.wins = [0, 0]
+        self.draws = 0
+        self.to_win = (best_of or BEST_OF) // 2 + 1
+
+    def next_round(self):
+        """Bắt đầu round mới và đặt hạn giờ cho nó (gọi khi giữ self.lock)"""
+        self.round += 1
+        if self.deadline is not None:
+            self.deadline.cancel()
+        if MOVE_TIMEOUT:
+            self.deadline = timers.schedule(MOVE_TIMEOUT, _round_timeout, self, self.round)
+
+    def score_round(self, r1):
+        """Cộng kết quả round (theo người chơi thứ nhất) vào điểm trận, gọi khi giữ self.lock
+
+        Xóa nước đi của round. Trả về True nếu trận kết thúc; nếu chưa thì bắt đầu round tiếp theo.
+        """
+        self.moves[0] = self.moves[1] = None
+        if r1 == Result.DRAW:
+            self.draws += 1
+        else:
+            self.wins[0 if r1 == Result.WIN else 1] += 1
+        if max(self.wins) >= self.to_win:
+            self.active = False
+            if self.deadline is not None:
+                self.deadline.cancel()
+            return True
+        self.next_round()
+        return False
+
+    def rounds_played(self):
+        return self.wins[0] + self.wins[1] + self.draws
+
+    def opponent(self, sock):
+        p1, p2 = self.players
+        return p2 if sock is p1 else p1
+
+    def has_moved(self, sock):
+        return self.moves[0 if sock is self.players[0] else 1] is not None
+
+
+class SuspendedSession:
+    """Chỗ giữ cho người chơi mất kết nối trong thời gian chờ kết nối lại
+
+    Thay kết nối cũ trong `clients`, `matches` và nước đi đang chờ của trận, nên trận
+    vẫn tiếp tục bình thường. Tin nhắn gửi tới được giữ lại (tối đa OUTBOX_MAX) để
+    gửi bù khi client quay lại. Chỉ giữ vài trường, không giữ socket hay buffer.
+    """
+    __slots__ = ("token", "addr", "expires", "queued", "outbox")
+    OUTBOX_MAX = 16
+
+    def __init__(self, token, addr, expires):
+        self.token = token
+        self.addr = addr
+        self.expires = expires
+        self.queued = False
+        self.outbox = None
+
+    def send_message(self, obj):
+        if self.outbox is None:
+            self.outbox = []
+        if len(self.outbox) < self.OUTBOX_MAX:
+            self.outbox.append(obj)
+
+    def send_messages(self, objs):
+        for obj in objs:
+            self.send_message(obj)
+
+
+class LocalMatchmaker:
+    """Ghép cặp ngay trong tiến trình này, dùng hàng đợi `queue`
+
+    enqueue chỉ thêm vào hàng đợi và hẹn một lượt ghép trên `timers` (nếu chưa hẹn), nên
+    nhiều lần join cùng lúc chỉ tốn một lượt match_players. Hàng đợi đủ MATCH_BATCH người
+    thì ghép ngay không chờ tick.
+    """
+
+    def __init__(self):
+        self._scheduled = False    # đã hẹn lượt ghép trên `timers`
+        self._signalled_at = None  # lần vào hàng đợi đầu tiên chưa được ghép (perf_counter)
+
+    def enqueue(self, sock):
+        if isinstance(sock, SuspendedSession):
+            # Chưa thể ghép khi đang mất kết nối: vào hàng đợi khi client quay lại
+            sock.queued = True
+            return
+        with queue_lock:
+            if not queue.push(sock):
+                return   # join_queue lặp lại khi đã chờ sẵn
+            if self._signalled_at is None:
+                self._signalled_at = time.perf_counter()
+            run_now = not MATCH_TICK or len(queue) >= MATCH_BATCH
+            schedule = not run_now and not self._scheduled
+            if schedule:
+                self._scheduled = True
+        if run_now:
+            self.tick()
+        elif schedule:
+            timers.schedule(MATCH_TICK, self.tick)
+
+    def tick(self):
+        """Một lượt ghép cho mọi người đang chờ"""
+        with queue_lock:
+            self._scheduled = False
+            signalled_at, self._signalled_at = self._signalled_at, None
+        if signalled_at is not None:
+            MATCH_TICK_DELAY.observe(time.perf_counter() - signalled_at)
+        match_players()
+
+    def __contains__(self, sock):
+        return sock in queue
+
+    def __len__(self):
+        return len(queue)
+
+    def cancel(self, sock):
+        """Bỏ client khỏi hàng đợi, trả về True nếu nó đang chờ"""
+        with queue_lock:
+            return queue.discard(sock)
+
+
+matchmaker = LocalMatchmaker()
+score_sink = record_match  # nơi nhận kết quả mỗi trận để cập nhật leaderboard
+in_remote_match = lambda sock: False  # kết nối đang đánh trận do process khác quản lý (cluster)
+
+
+def set_matchmaker(mm):
+    """Thay bộ ghép cặp (vd. chế độ cluster ghép qua coordinator)"""
+    global matchmaker
+    matchmaker = mm
+
 
+def set_score_sink(fn):
+    """Thay nơi cập nhật điểm, fn(player_name, result, opponent_name, opponent_result), gọi một lần mỗi trận"""
+    global score_sink
+    score_sink = fn
 
-def save_log(msg: str):
-    """Lưu log vào file"""
+
+def set_remote_match_check(fn):
+    """fn(sock) -> True nếu kết nối đang trong trận không nằm trong `matches` của process này"""
+    global in_remote_match
+    in_remote_match = fn
+
+
+def set_journal(j):
+    """Ghi các sự kiện join, match, move vào journal nhị phân"""
+    global journal
+    journal = j
+
+
+def set_best_of(n):
+    """Số round tối đa của một trận (áp dụng cho các trận tạo sau đó)"""
+    global BEST_OF
+    if n < 1:
+        raise ValueError("best_of phải >= 1")
+    BEST_OF = n
+
+
+def set_timeouts(move_timeout=None, policy=None, idle_timeout=None):
+    """Đổi hạn giờ round (giây), cách xử lý khi hết giờ và hạn giờ kết nối rảnh"""
+    global MOVE_TIMEOUT, TIMEOUT_POLICY, IDLE_TIMEOUT
+    if move_timeout is not None:
+        MOVE_TIMEOUT = move_timeout
+    if policy is not None:
+        if policy not in ("random", "forfeit"):
+            raise ValueError("policy phải là 'random' | 'forfeit'")
+        TIMEOUT_POLICY = policy
+    if idle_timeout is not None:
+        IDLE_TIMEOUT = idle_timeout
+
+
+def schedule_housekeeping():
+    """Đăng ký các việc định kỳ lên `timers` (gọi một lần khi server khởi động)"""
+    timers.every(1.0, expire_sessions)
+    if getattr(matchmaker, "tick_interval", None):
+        timers.every(matchmaker.tick_interval, matchmaker.tick)
+
+
+def set_match_tick(tick=None, batch=None):
+    """Đổi chu kỳ ghép cặp theo lô của hàng đợi FIFO (giây, 0 = ghép ngay) và ngưỡng ghép sớm"""
+    global MATCH_TICK, MATCH_BATCH
+    if tick is not None:
+        if tick < 0:
+            raise ValueError("tick phải >= 0")
+        MATCH_TICK = tick
+    if batch is not None:
+        if batch < 2:
+            raise ValueError("batch phải >= 2")
+        MATCH_BATCH = batch
+
+
+def set_resume_grace(seconds):
+    """Thời gian giữ phiên sau khi mất kết nối (0 = tắt, dọn ngay như cũ)"""
+    global RESUME_GRACE
+    RESUME_GRACE = seconds
+
+
+def send_json(sock, obj):
+    """Gửi tin nhắn đến client (mã hóa theo codec của kết nối, mặc định JSON)"""
     try:
-        with open("game_log.txt", "a", encoding="utf-8") as f:
-            f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - {msg}\n")
+        sock.send_message(obj)
+        return True
     except:
-        pass
+        SEND_FAILURES.inc()
+        return False
 
 
-def send_json(sock, obj):
-    """Gửi dữ liệu JSON đến client"""
+def send_many(sock, objs):
+    """Gửi nhiều tin nhắn cho một client bằng một lần ghi"""
     try:
-        sock.sendall((json.dumps(obj) + "\n").encode())
+        sock.send_messages(objs)
         return True
     except:
+        SEND_FAILURES.inc()
         return False
 
 
-def recv_json(sock):
-    """Nhận dữ liệu JSON từ client"""
+def handle_message(sock, msg):
+    """Xử lý một tin nhắn từ client (dùng chung cho chế độ thread và asyncio)"""
+    if sock.closed:
+        return   # server đã cắt kết nối (abort): bỏ các tin nhắn còn lại trong buffer
+    msg_type = msg.get("type")
+    now = sock.last_seen = time.monotonic()
+    verdict = admission.check_message(sock, msg_type, now)
+    if verdict != admission.ALLOW:
+        _rate_limited(sock, msg_type, verdict)
+        return
+
+    if msg_type == "join":
+        player_name = msg.get("player", f"Player_{sock.addr[1]}")
+        handle_join(sock, player_name, sock.addr, msg.get("codecs"))
+
+    elif msg_type == "join_queue":
+        handle_join_queue(sock)
+
+    elif msg_type == "move":
+        move = parse_move(msg.get("move"))
+        if move is not None:
+            sock.missed_rounds = 0
+            handle_move(sock, move)
+
+    elif msg_type == "resume":
+        handle_resume(sock, msg.get("session"), msg.get("codecs"))
+
+    elif msg_type == "get_leaderboard":
+        handle_get_leaderboard(sock, msg.get("offset"), msg.get("limit"))
+
+    elif msg_type == "leave":
+        # Client chủ động thoát: không giữ phiên khi kết nối đóng
+        _end_session(sock)
+
+
+def _rate_limited(sock, msg_type, verdict):
+    """Tin nhắn vượt giới hạn tốc độ: bỏ và báo client, hết strike thì ngắt kết nối"""
+    if verdict == admission.ABUSIVE:
+        print(f"[LIMIT] {clients.get(sock) or sock.addr}: liên tục vượt giới hạn tốc độ, ngắt kết nối")
+        _end_session(sock)
+        sock.abort()
+        return
+    send_json(sock, admission.error_message("rate_limited", msg_type if isinstance(msg_type, str) else None))
+
+
+def handle_get_leaderboard(sock, offset=None, limit=None):
+    """Trả một trang bảng xếp hạng (`leaderboard`) và hạng của người hỏi (`leaderboard_rank`)
+
+    Trang lấy từ ảnh chụp đã encode sẵn (leaderboard.board_snapshot), không đụng tới
+    bảng điểm hay lock của nó; hai tin nhắn đi trong một lần ghi.
+    """
+    snap = board_snapshot()
+    offset, limit = clamp_page(offset, limit)
+    data = snap.page(sock.codec, offset, limit)
+    name = clients.get(sock)
+    if name is not None:
+        data += sock.codec.encode(snap.rank_message(name))
     try:
-        data = b""
-        while b"\n" not in data:
-            part = sock.recv(4096)
-            if not part:
-                return None
-            data += part
-        line, _, _ = data.partition(b"\n")
-        return json.loads(line.decode())
+        sock.sendall(data)
     except:
-        return None
+        SEND_FAILURES.inc()
+    LEADERBOARD_QUERIES.inc()
+
+
+def _end_session(sock):
+    with session_lock:
+        if sessions.get(sock.session) is sock:
+            del sessions[sock.session]
+
+
+def handle_connect(sock):
+    """Kết nối mới: bắt đầu theo dõi thời gian rảnh"""
+    sock.last_seen = time.monotonic()
+    if IDLE_TIMEOUT:
+        timers.schedule(IDLE_TIMEOUT, _check_idle, sock)
+
+
+def _check_idle(sock):
+    """Hạn giờ rảnh của một kết nối: ngắt nếu không gửi gì đủ lâu, nếu không thì hẹn lại"""
+    if sock.closed or not IDLE_TIMEOUT:
+        return
+    idle = time.monotonic() - sock.last_seen
+    if idle < IDLE_TIMEOUT:
+        timers.schedule(IDLE_TIMEOUT - idle, _check_idle, sock)
+    elif sock in matches or sock in matchmaker or in_remote_match(sock):
+        # Đang chờ ghép hoặc đang trong trận (đã có hạn giờ round) thì không tính là rảnh
+        timers.schedule(IDLE_TIMEOUT, _check_idle, sock)
+    else:
+        _reap(sock, f"không hoạt động {idle:.0f}s")
+
+
+def _reap(sock, reason):
+    """Ngắt một kết nối bỏ đi, không giữ phiên"""
+    IDLE_REAPED.inc()
+    print(f"[IDLE] {clients.get(sock) or sock.addr}: {reason}, ngắt kết nối")
+    _end_session(sock)
+    sock.abort()
+
+
+def handle_join(sock, player_name, addr, codecs=None):
+    """Đăng ký tên người chơi cho kết nối
+
+    Trả lời `joined` (bằng JSON) kèm token `session` để kết nối lại. Nếu client gửi
+    kèm danh sách `codecs`, chọn codec; các tin nhắn sau đó theo codec mới. Tên không phải
+    chuỗi hoặc dài quá MAX_NAME_BYTES bị từ chối bằng `error` (reason "invalid_name").
+    """
+    if not _valid_name(player_name):
+        send_json(sock, {"type": "error", "reason": "invalid_name", "message": "join"})
+        return
+    if sock.session is None:
+        sock.session = secrets.token_urlsafe(12)
+        with session_lock:
+            sessions[sock.session] = sock
+    reply = {"type": "joined", "session": sock.session}
+    codec = negotiate(codecs) if codecs else None
+    if codec is not None:
+        reply["codec"] = codec.name
+    send_json(sock, reply)
+    if codec is not None:
+        sock.set_codec(codec)
+    clients[sock] = player_name
+    JOINS.inc()
+    if journal is not None:
+        journal.join(player_name)
+    print(f"[JOIN] {player_name} from {addr}")
+    save_log(f"{player_name} joined from {addr}")
+
+
+def _valid_name(name):
+    if not isinstance(name, str):
+        return False
+    try:
+        return len(name.encode("utf-8")) <= MAX_NAME_BYTES
+    except UnicodeEncodeError:   # surrogate lẻ từ "\udXXX" trong JSON
+        return False
+
+
+def handle_join_queue(sock):
+    """Đưa client vào hàng đợi rồi thử ghép cặp (bỏ qua nếu đang trong trận)
+
+    Hàng đợi đã tới admission.MAX_BACKLOG thì từ chối người mới bằng `error` (reason
+    "overloaded"); người đã chờ sẵn và người vừa xong trận (do _end_match đưa vào) không bị ảnh hưởng.
+    """
+    if sock in matches:
+        return
+    if sock not in matchmaker and admission.backlog_full(len(matchmaker)):
+        send_json(sock, admission.error_message("overloaded", "join_queue"))
+        return
+    matchmaker.enqueue(sock)
+
+
+def _swap_player(old, new):
+    """Thay `old` bằng `new` trong clients, hàng đợi và trận đang chơi
+
+    Trả về trận của người chơi (hoặc None). Gọi khi giữ session_lock.
+    """
+    queued = matchmaker.cancel(old)
+    with queue_lock:
+        match = matches.pop(old, None)
+        if match is not None:
+            with match.lock:
+                if match.active:
+                    p1, p2 = match.players
+                    # Nước đi đang chờ giữ theo vị trí nên đi theo người chơi mới
+                    match.players = (new, p2) if p1 is old else (p1, new)
+                    matches[new] = match
+                else:
+                    match = None
+    name = clients.pop(old, None)
+    if name is not None:
+        clients[new] = name
+    return match, queued
+
+
+def _suspend(sock):
+    """Giữ phiên của kết nối vừa mất trong RESUME_GRACE giây, trả về False nếu không giữ"""
+    if isinstance(sock, SuspendedSession):
+        return False
+    token = sock.session
+    with session_lock:
+        if not RESUME_GRACE or token is None or sessions.get(token) is not sock or sock not in clients:
+            return False
+        del sessions[token]
+        placeholder = SuspendedSession(token, sock.addr, time.monotonic() + RESUME_GRACE)
+        _, placeholder.queued = _swap_player(sock, placeholder)
+        suspended[token] = placeholder
+    print(f"[SUSPEND] {clients.get(placeholder)} ({sock.addr}), chờ kết nối lại {RESUME_GRACE:g}s")
+    return True
+
+
+def handle_resume(sock, token, codecs=None):
+    """Kết nối lại phiên cũ: nhận lại tên, trận, nước đi đang chờ và các tin nhắn bị lỡ"""
+    if not isinstance(token, str):
+        # token đến thẳng từ client: list/dict không tra được trong sessions/suspended
+        send_json(sock, {"type": "resume_failed"})
+        return
+    old = None
+    with session_lock:
+        live = sessions.get(token)
+        if live is not None and live is not sock:
+            # Server chưa phát hiện kết nối cũ đã chết: giữ phiên rồi cắt kết nối cũ
+            old = live
+    if old is not None:
+        _suspend(old)
+        old.abort()
+
+    with session_lock:
+        placeholder = suspended.pop(token, None) if token else None
+        if placeholder is not None:
+            match, _ = _swap_player(placeholder, sock)
+            sock.session = token
+            sessions[token] = sock
+    if placeholder is None:
+        send_json(sock, {"type": "resume_failed"})
+        return
+
+    reply = {"type": "resumed", "session": token}
+    codec = negotiate(codecs) if codecs else None
+    if codec is not None:
+        reply["codec"] = codec.name
+    send_json(sock, reply)
+    if codec is not None:
+        sock.set_codec(codec)
+    RESUMES.inc()
+    print(f"[RESUME] {clients.get(sock)} from {sock.addr}")
+    save_log(f"{clients.get(sock)} resumed from {sock.addr}")
+
+    pending = placeholder.outbox or []
+    if match is not None and match.active and not pending and not match.has_moved(sock):
+        # Có thể request_move của round hiện tại đã mất cùng kết nối cũ
+        pending = [{"type": "request_move"}]
+    if pending:
+        send_many(sock, pending)
+    if placeholder.queued:
+        matchmaker.enqueue(sock)
+
+
+def expire_sessions(now=None):
+    """Dọn các phiên đã hết thời gian chờ (gọi định kỳ từ tầng I/O)"""
+    now = time.monotonic() if now is None else now
+    expired = []
+    with session_lock:
+        # suspended giữ thứ tự thêm vào = thứ tự hết hạn (RESUME_GRACE cố định)
+        for token, placeholder in suspended.items():
+            if placeholder.expires > now:
+                break
+            expired.append(placeholder)
+        for placeholder in expired:
+            del suspended[placeholder.token]
+    for placeholder in expired:
+        EXPIRED.inc()
+        print(f"[EXPIRE] {clients.get(placeholder)} không kết nối lại")
+        handle_disconnect(placeholder)
+
+
+def handle_disconnect(sock):
+    """Dọn trạng thái khi client ngắt kết nối
+
+    Nếu còn phiên (RESUME_GRACE > 0) thì chỉ tạm giữ chỗ để client kết nối lại.
+    Ngược lại thông báo cho đối thủ (nếu đang trong trận) và đưa đối thủ trở lại hàng đợi.
+    """
+    if _suspend(sock):
+        return
+    # Xóa khỏi clients trước: từ đây match_players không thể ghép socket này nữa
+    name = clients.pop(sock, None)
+    matchmaker.cancel(sock)
+    # Cùng thứ tự lock với _swap_player: queue_lock (giữ `matches`) rồi mới tới match.lock
+    with queue_lock:
+        match = matches.pop(sock, None)
+        if match is None:
+            return
+        with match.lock:
+            if not match.active:
+                return
+            match.active = False
+            match.moves[0] = match.moves[1] = None
+            if match.deadline is not None:
+                match.deadline.cancel()
+            opp = match.opponent(sock)
+            if matches.get(opp) is match:
+                del matches[opp]
+            played = match.rounds_played()
+
+    # Gửi thông báo và requeue ngoài mọi lock
+    # dùng type rõ ràng để client xử lý (không dừng vòng lắng nghe)
+    send_json(opp, {"type": "opponent_disconnected"})
+    if played:
+        # Rời trận đã bắt đầu: xử thua cả trận
+        FORFEITS.inc()
+        opp_name = clients.get(opp, "Unknown")
+        save_log(f"[FORFEIT] {name} rời trận, {opp_name} thắng")
+        score_sink(opp_name, RESULT_NAMES[Result.WIN], name or "Unknown", RESULT_NAMES[Result.LOSE])
+    if opp in clients:
+        try:
+            matchmaker.enqueue(opp)
+        except:
+            pass
+
+
+def _is_waiting(sock):
+    """Socket còn kết nối và chưa có trận"""
+    return sock in clients and sock not in matches
 
 
 def match_players():
@@ -48,116 +618,222 @@ def match_players():
 
     Lựa chọn cặp: tìm 2 socket trong queue mà vẫn đang kết nối (có trong `clients`) và chưa có trong `matches`.
     Nếu không tìm được cặp, trả lại socket chưa ghép vào queue.
+    Chỉ việc lấy cặp nằm trong `queue_lock`; gửi tin và ghi log làm sau khi nhả lock.
     """
-    with lock:
-        # Clean up any sockets in queue that are no longer connected
-        queue[:] = [s for s in queue if s in clients]
-
-        while True:
-            # Find first available unmatched player
-            p1 = None
-            while queue:
-                cand = queue.pop(0)
-                if cand in matches:
-                    # already matched elsewhere, skip
-                    continue
-                if cand not in clients:
-                    # disconnected, skip
-                    continue
-                p1 = cand
+    paired = []
+    start = time.perf_counter()
+    with queue_lock:
+        while len(queue) >= 2:
+            # Lấy 2 client chờ lâu nhất, client đã rời/đã có trận bị loại khỏi queue khi lấy ra
+            p1, t1 = queue.pop_with_time(_is_waiting)
+            if p1 is None:
                 break
-
-            if not p1:
+            p2, t2 = queue.pop_with_time(_is_waiting)
+            if p2 is None:
+                # Không tìm được đối thủ: trả p1 về đầu queue
+                queue.push_front(p1, t1)
                 break
 
-            # Find second available unmatched player
-            p2 = None
-            while queue:
-                cand = queue.pop(0)
-                if cand in matches or cand not in clients or cand == p1:
-                    continue
-                p2 = cand
-                break
+            # Found a valid pair -> create match
+            paired.append(_register_match(p1, p2))
+            now = time.perf_counter()
+            QUEUE_WAIT.observe(now - t1)
+            QUEUE_WAIT.observe(now - t2)
+    MATCH_PLAYERS_TIME.observe(time.perf_counter() - start)
+    MATCH_BATCH_PAIRS.observe(len(paired))
+    _announce_matches(paired)
 
-            if not p2:
-                # No partner found: put p1 back to the end of queue and stop
-                queue.append(p1)
-                break
 
-            # Found a valid pair -> create match
-            matches[p1] = p2
-            matches[p2] = p1
-            p1_name = clients.get(p1, "Unknown")
-            p2_name = clients.get(p2, "Unknown")
-            send_json(p1, {"type": "match_found", "opponent": p2_name})
-            send_json(p2, {"type": "match_found", "opponent": p1_name})
-            print(f"[MATCH] {p1_name} vs {p2_name}")
-            save_log(f"[MATCH] {p1_name} vs {p2_name}")
+def _register_match(p1, p2):
+    match = Match(p1, p2)
+    match.next_round()
+    matches[p1] = match
+    matches[p2] = match
+    MATCHES.inc()
+    if journal is not None:
+        journal.match(match.id, clients.get(p1, "Unknown"), clients.get(p2, "Unknown"))
+    return match
+
+
+def start_match(p1, p2):
+    """Tạo trận cho một cặp đã được ghép ở nơi khác (vd. coordinator của cluster)"""
+    with queue_lock:
+        match = _register_match(p1, p2)
+    _announce_matches([match])
+    return match
 
-            # Yêu cầu chọn nước đi
-            send_json(p1, {"type": "request_move"})
-            send_json(p2, {"type": "request_move"})
+
+def _announce_matches(paired):
+    """Gửi match_found và request_move cho mọi người chơi của một lô trận, rồi mới in/ghi log
+
+    Người chơi của cặp cuối lô không phải chờ việc in và ghi log của các cặp trước.
+    """
+    names = []
+    for match in paired:
+        p1, p2 = match.players
+        p1_name = clients.get(p1, "Unknown")
+        p2_name = clients.get(p2, "Unknown")
+        # match_found và yêu cầu chọn nước đi gửi chung một lần ghi
+        send_many(p1, [{"type": "match_found", "opponent": p2_name}, {"type": "request_move"}])
+        send_many(p2, [{"type": "match_found", "opponent": p1_name}, {"type": "request_move"}])
+        names.append((p1_name, p2_name))
+    for p1_name, p2_name in names:
+        print(f"[MATCH] {p1_name} vs {p2_name}")
+        save_log(f"[MATCH] {p1_name} vs {p2_name}")
 
 
 def handle_move(player_sock, move):
-    """Xử lý nước đi"""
-    opponent_sock = matches.get(player_sock)
-    if not opponent_sock:
+    """Xử lý nước đi
+
+    Lock của trận chỉ giữ khi ghi nhận nước đi; tính kết quả, gửi tin, ghi log và
+    cập nhật leaderboard đều làm ngoài lock.
+    """
+    match = matches.get(player_sock)
+    if match is None:
+        return
+
+    with HANDLE_MOVE_TIME.time():
+        _handle_move(match, player_sock, move)
+
+
+def _handle_move(match, player_sock, move, round_no=None):
+    with match.lock:
+        if not match.active or (round_no is not None and match.round != round_no):
+            return
+        i = 0 if player_sock is match.players[0] else 1
+        moves = match.moves
+        moves[i] = move
+        if journal is not None:
+            journal.move(match.id, match.round, i, move)
+        if moves[1 - i] is None:
+            match.first_move_at = time.perf_counter()
+            return
+        m1, m2 = moves
+        p1, p2 = match.players
+        first_move_at = match.first_move_at
+        r1, r2 = judge(m1, m2)
+        over = match.score_round(r1)
+
+    _finish_round(match, p1, m1, r1, p2, m2, r2, first_move_at, over)
+
+
+def _round_timeout(match, round_no):
+    """Hết giờ round `round_no`: đi hộ nước ngẫu nhiên hoặc xử thua người chưa đi"""
+    with match.lock:
+        if not match.active or match.round != round_no:
+            return
+        idle = [p for p in match.players if not match.has_moved(p)]
+    MOVE_TIMEOUTS.inc(len(idle))
+    for sock in idle:
+        missed = getattr(sock, "missed_rounds", 0) + 1
+        if not isinstance(sock, SuspendedSession):
+            sock.missed_rounds = missed
+        if missed >= MAX_MISSED_ROUNDS:
+            _reap(sock, f"hết giờ {missed} round liên tiếp")
+
+    if TIMEOUT_POLICY == "random":
+        for sock in idle:
+            move = random.choice(MOVES)
+            send_json(sock, {"type": "move_timeout", "move": MOVE_NAMES[move]})
+            _handle_move(match, sock, move, round_no)
         return
 
+    # forfeit: người chưa đi thua round; cả hai chưa đi thì hòa
+    with match.lock:
+        if not match.active or match.round != round_no:
+            return
+        p1, p2 = match.players
+        m1, m2 = match.moves
+        first_move_at = match.first_move_at if (m1 is not None or m2 is not None) else None
+        if m1 is not None and m2 is None:
+            r1, r2 = Result.WIN, Result.LOSE
+        elif m2 is not None and m1 is None:
+            r1, r2 = Result.LOSE, Result.WIN
+        else:
+            r1 = r2 = Result.DRAW
+        over = match.score_round(r1)
+    for sock in idle:
+        send_json(sock, {"type": "move_timeout", "move": None})
+    _finish_round(match, p1, m1, r1, p2, m2, r2, first_move_at, over)
+
+
+def _finish_round(match, player_sock, p_move, p_result, opponent_sock, o_move, o_result, first_move_at,
+                  over=False):
+    """Gửi kết quả round và ghi log (ngoài lock của trận); nếu trận đã kết thúc thì gửi
+    game_over, cập nhật leaderboard và đưa cả hai về hàng đợi
+
+    Nước đi (Move, None nếu hết giờ) và kết quả (Result) được đổi sang chuỗi ở đây.
+    """
+    p_move = MOVE_NAMES[p_move] if p_move is not None else None
+    o_move = MOVE_NAMES[o_move] if o_move is not None else None
+    p_result, o_result = RESULT_NAMES[p_result], RESULT_NAMES[o_result]
     player_name = clients.get(player_sock, "Unknown")
     opponent_name = clients.get(opponent_sock, "Unknown")
+    if over:
+        # Bỏ trận khỏi matches trước khi gửi game_over để client có thể join_queue lại ngay
+        with queue_lock:
+            for sock in match.players:
+                if matches.get(sock) is match:
+                    del matches[sock]
 
-    with lock:
-        moves[player_sock] = move
-        if opponent_sock in moves:
-            p_move = moves[player_sock]
-            o_move = moves[opponent_sock]
-
-            # Tính kết quả
-            if p_move == o_move:
-                p_result = o_result = "draw"
-            elif (p_move == "rock" and o_move == "scissors") or \
-                 (p_move == "scissors" and o_move == "paper") or \
-                 (p_move == "paper" and o_move == "rock"):
-                p_result, o_result = "win", "lose"
-            else:
-                p_result, o_result = "lose", "win"
-
-            # Gửi kết quả
-            send_json(player_sock, {
-                "type": "round_result",
-                "your_move": p_move,
-                "opponent_move": o_move,
-                "result": p_result})
-            
-            send_json(opponent_sock, {
-                "type": "round_result",
-                "your_move": o_move,
-                "opponent_move": p_move,
-                "result": o_result})
-
-            log_msg = f"{player_name}({p_move}) vs {opponent_name}({o_move}) => P1:{p_result}, P2:{o_result}"
-            print(f"[RESULT] {log_msg}")
-            save_log(log_msg)
-
-            # Cập nhật leaderboard
-            update_score(player_name, p_result)
-            update_score(opponent_name, o_result)
-
-            # Gọi hàm lưu file
-            from leaderboard import save_leaderboard_file
-            save_leaderboard_file()
-
-            # Xóa moves
-            del moves[player_sock]
-            del moves[opponent_sock]
-
-            # QUAN TRỌNG: Yêu cầu round tiếp theo
-            # Kiểm tra xem cả 2 client vẫn còn kết nối
-            if player_sock in clients and opponent_sock in clients:
-                if send_json(player_sock, {"type": "request_move"}):
-                    send_json(opponent_sock, {"type": "request_move"})
-                else:
-                    # Nếu không gửi được, có thể client đã disconnect
-                    print(f"[WARNING] Cannot send request_move to {player_name}")
\ No newline at end of file
+    # Gửi kết quả, kèm luôn yêu cầu round tiếp theo (hoặc game_over) trong cùng một lần ghi
+    # nếu cả 2 client vẫn còn kết nối
+    next_round = not over and match.active and player_sock in clients and opponent_sock in clients
+    p_msgs = [{
+        "type": "round_result",
+        "your_move": p_move,
+        "opponent_move": o_move,
+        "result": p_result}]
+    o_msgs = [{
+        "type": "round_result",
+        "your_move": o_move,
+        "opponent_move": p_move,
+        "result": o_result}]
+    if next_round:
+        p_msgs.append({"type": "request_move"})
+        o_msgs.append({"type": "request_move"})
+    elif over:
+        p_msgs.append(_game_over(match, player_sock))
+        o_msgs.append(_game_over(match, opponent_sock))
+
+    if not send_many(player_sock, p_msgs) and next_round:
+        # Nếu không gửi được, có thể client đã disconnect
+        print(f"[WARNING] Cannot send request_move to {player_name}")
+    send_many(opponent_sock, o_msgs)
+    ROUNDS.inc()
+    if first_move_at is not None:
+        MOVE_TO_RESULT.observe(time.perf_counter() - first_move_at)
+
+    log_msg = f"{player_name}({p_move}) vs {opponent_name}({o_move}) => P1:{p_result}, P2:{o_result}"
+    print(f"[RESULT] {log_msg}")
+    save_log(log_msg)
+    if over:
+        _end_match(match)
+
+
+def _game_over(match, sock):
+    i = match.players.index(sock)
+    winner = match.players[0 if match.wins[0] > match.wins[1] else 1]
+    return {"type": "game_over", "winner": clients.get(winner, "Unknown"),
+            "your_score": match.wins[i], "opponent_score": match.wins[1 - i]}
+
+
+def _end_match(match):
+    """Trận đã kết thúc: cập nhật leaderboard một lần cho cả trận rồi đưa hai người về hàng đợi"""
+    p1, p2 = match.players
+    p1_name, p2_name = clients.get(p1, "Unknown"), clients.get(p2, "Unknown")
+    w1, w2 = match.wins
+    r1, r2 = (Result.WIN, Result.LOSE) if w1 > w2 else (Result.LOSE, Result.WIN)
+    GAMES.inc()
+    log_msg = f"[GAME OVER] {p1_name} {w1}-{w2} {p2_name} ({match.draws} hòa)"
+    print(log_msg)
+    save_log(log_msg)
+
+    # Cập nhật leaderboard (chỉ trong bộ nhớ, thread write-behind sẽ ghi file)
+    score_sink(p1_name, RESULT_NAMES[r1], p2_name, RESULT_NAMES[r2])
+    for sock in match.players:
+        if sock in clients:
+            try:
+                matchmaker.enqueue(sock)
+            except:
+                pass
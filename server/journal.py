@@ -0,0 +1,364 @@
+# server/journal.py
+"""Journal nhị phân chỉ ghi nối (append-only) các sự kiện game: join, match, move, result
+
+Mỗi bản ghi:  crc32 (4) | độ dài payload (4) | loại (1) | thời điểm (8, float) | payload
+(little-endian; crc tính trên phần còn lại của bản ghi). Chuỗi trong payload = độ dài (2) + UTF-8.
+
+- Ghi: `append` chỉ đóng gói bản ghi và đưa vào hàng đợi; một thread nền gom bản ghi
+  trong tối đa `fsync_interval` giây rồi ghi + fsync một lần (group commit). Khi server
+  chết đột ngột chỉ có thể mất các bản ghi của lô cuối chưa fsync.
+- File: thư mục journal chứa các segment `00000001.log`, `00000002.log`, ... Mỗi lần khởi
+  động mở segment mới; segment được đóng khi vượt `segment_bytes` hoặc sau `snapshot_interval` giây.
+- Snapshot: `snapshot.json` = leaderboard sau khi áp dụng mọi segment <= `segment`. Sau mỗi lần
+  đóng segment, các segment đã đóng được replay lên snapshot cũ thành snapshot mới rồi bị xóa.
+- Khôi phục: nạp snapshot rồi replay các segment sau nó. Bản ghi cuối bị cắt dở (crc sai
+  hoặc thiếu byte) được bỏ qua: replay dừng ở đó và đi tiếp sang segment sau.
+
+Dòng lệnh:
+    python journal.py replay [DIR] [--out leaderboard.json]   # dựng lại leaderboard.json
+    python journal.py dump [DIR]                              # in các sự kiện
+    python journal.py compact [DIR]                           # gộp các segment cũ vào snapshot
+"""
+import atexit
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import leaderboard
+import metrics
+from rules import MOVE_NAMES, RESULT_NAMES
+
+JOURNAL_DIR = os.path.join(os.path.dirname(__file__), "journal")
+SNAPSHOT_FILE = "snapshot.json"
+
+JOIN, MATCH, MOVE, RESULT = 1, 2, 3, 4
+TYPE_NAMES = {JOIN: "join", MATCH: "match", MOVE: "move", RESULT: "result"}
+
+HEADER = struct.Struct("<IIBd")      # crc, len, type, ts
+BODY = struct.Struct("<IBd")         # phần header nằm trong crc
+MOVE_FIELDS = struct.Struct("<QIBB")  # match_id, round, người chơi (0/1), nước đi
+U16 = struct.Struct("<H")
+U64 = struct.Struct("<Q")
+
+RECORDS = metrics.counter("rps_journal_records_total", "Số bản ghi đã ghi vào journal")
+FSYNCS = metrics.counter("rps_journal_fsyncs_total", "Số lần fsync journal")
+FSYNC_TIME = metrics.histogram("rps_journal_fsync_seconds", "Thời gian ghi + fsync một lô journal")
+BATCH_SIZE = metrics.histogram("rps_journal_batch_records", "Số bản ghi mỗi lần fsync",
+                               buckets=(1, 2, 5, 10, 50, 100, 500, 1000, 5000))
+SNAPSHOTS = metrics.counter("rps_journal_snapshots_total", "Số lần gộp journal vào snapshot")
+
+
+# ---------------------------------------------------------------- mã hóa
+
+def _str(s: str) -> bytes:
+    data = s.encode("utf-8")
+    return U16.pack(len(data)) + data
+
+
+def _read_str(buf, pos):
+    (n,) = U16.unpack_from(buf, pos)
+    pos += 2
+    return bytes(buf[pos:pos + n]).decode("utf-8"), pos + n
+
+
+def encode(kind: int, payload: bytes, ts: float = None) -> bytes:
+    body = BODY.pack(len(payload), kind, time.time() if ts is None else ts) + payload
+    return struct.pack("<I", zlib.crc32(body)) + body
+
+
+def decode_payload(kind, payload):
+    """Payload -> tuple các trường của sự kiện"""
+    if kind == JOIN:
+        return (_read_str(payload, 0)[0],)
+    if kind == MATCH:
+        (match_id,) = U64.unpack_from(payload, 0)
+        p1, pos = _read_str(payload, 8)
+        p2, _ = _read_str(payload, pos)
+        return match_id, p1, p2
+    if kind == MOVE:
+        match_id, round_no, player, move = MOVE_FIELDS.unpack(payload)
+        return match_id, round_no, player, MOVE_NAMES[move]
+    if kind == RESULT:
+        player, pos = _read_str(payload, 0)
+        result = RESULT_NAMES[payload[pos]]
+        opponent, pos = _read_str(payload, pos + 1)
+        return player, result, opponent, RESULT_NAMES[payload[pos]]
+    raise ValueError(f"loại bản ghi không hợp lệ: {kind}")
+
+
+def read_segment(path):
+    """Đọc các bản ghi (kind, ts, fields) của một segment, dừng ở bản ghi hỏng/cắt dở đầu tiên"""
+    with open(path, "rb") as f:
+        buf = memoryview(f.read())
+    pos, end = 0, len(buf)
+    while pos < end:
+        stop = pos + HEADER.size
+        if stop <= end:
+            crc, length, kind, ts = HEADER.unpack_from(buf, pos)
+            stop += length
+        if stop > end or zlib.crc32(buf[pos + 4:stop]) != crc:
+            print(f"[JOURNAL] {os.path.basename(path)}: bỏ phần đuôi hỏng từ byte {pos}")
+            return
+        yield kind, ts, decode_payload(kind, buf[pos + HEADER.size:stop])
+        pos = stop
+
+
+# ---------------------------------------------------------------- segment và snapshot
+
+def list_segments(path):
+    """[(số thứ tự, đường dẫn)] của các segment trong thư mục, tăng dần"""
+    if not os.path.isdir(path):
+        return []
+    segments = []
+    for name in os.listdir(path):
+        stem, ext = os.path.splitext(name)
+        if ext == ".log" and stem.isdigit():
+            segments.append((int(stem), os.path.join(path, name)))
+    return sorted(segments)
+
+
+def load_snapshot(path):
+    """(segment, leaderboard) của snapshot mới nhất, (0, None) nếu chưa có"""
+    snap = os.path.join(path, SNAPSHOT_FILE)
+    if not os.path.exists(snap):
+        return 0, None
+    with open(snap, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data["segment"], data["leaderboard"]
+
+
+def write_snapshot(path, segment, data):
+    text = json.dumps({"segment": segment, "leaderboard": data}, ensure_ascii=False)
+    leaderboard._atomic_write(os.path.join(path, SNAPSHOT_FILE), text)
+
+
+def replay(path, upto=None):
+    """Dựng lại leaderboard từ snapshot + các segment sau nó (tới segment `upto` nếu có)
+
+    Trả về (data, segment cuối cùng đã áp dụng); data là None nếu thư mục chưa có gì.
+    """
+    last, data = load_snapshot(path)
+    segments = [(n, p) for n, p in list_segments(path) if n > last and (upto is None or n <= upto)]
+    if data is None and not segments:
+        return None, last
+    data = data if data is not None else {}
+    for n, seg in segments:
+        for kind, _, fields in read_segment(seg):
+            if kind == RESULT:
+                leaderboard.apply_match(data, *fields)
+        last = n
+    return data, last
+
+
+def compact(path, upto):
+    """Gộp các segment <= upto vào snapshot rồi xóa chúng"""
+    data, last = replay(path, upto)
+    if data is None:
+        return
+    write_snapshot(path, last, data)
+    for n, seg in list_segments(path):
+        if n <= last:
+            os.remove(seg)
+    SNAPSHOTS.inc()
+
+
+# ---------------------------------------------------------------- ghi
+
+class Journal:
+    """Ghi journal vào thư mục `path` bằng một thread nền, fsync theo lô"""
+
+    def __init__(self, path=JOURNAL_DIR, fsync_interval=0.05, segment_bytes=16 * 1024 * 1024,
+                 snapshot_interval=300.0):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.segment_bytes = segment_bytes
+        self.snapshot_interval = snapshot_interval
+        self.written = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._file = None
+        self._segment = 0
+        self._opened_at = 0.0
+        self._compact_lock = threading.Lock()
+        self._stop = object()
+        os.makedirs(path, exist_ok=True)
+
+    # --- sự kiện (gọi từ thread/loop bất kỳ, chỉ đóng gói và xếp hàng)
+
+    def append(self, kind, payload):
+        self._queue.put(encode(kind, payload))
+
+    def join(self, player):
+        self.append(JOIN, _str(player))
+
+    def match(self, match_id, p1, p2):
+        self.append(MATCH, U64.pack(match_id) + _str(p1) + _str(p2))
+
+    def move(self, match_id, round_no, player, move):
+        """move: rules.Move"""
+        self.append(MOVE, MOVE_FIELDS.pack(match_id, round_no, player, move))
+
+    def result(self, player, result, opponent, opponent_result):
+        self.append(RESULT, _str(player) + bytes((RESULT_NAMES.index(result),)) +
+                    _str(opponent) + bytes((RESULT_NAMES.index(opponent_result),)))
+
+    # --- thread ghi
+
+    def start(self):
+        if self._thread is not None:
+            return
+        segments = list_segments(self.path)
+        last, _ = load_snapshot(self.path)
+        # Luôn mở segment mới: đuôi hỏng của segment cũ (nếu có) không bị ghi nối tiếp
+        self._open_segment(max([last] + [n for n, _ in segments]) + 1)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Ghi + fsync nốt các bản ghi trong hàng đợi rồi dừng thread nền"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(self._stop)
+        thread.join(timeout=5)
+        self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open_segment(self, n):
+        if self._file is not None:
+            self._file.close()
+        self._segment = n
+        self._file = open(os.path.join(self.path, f"{n:08d}.log"), "ab")
+        self._opened_at = time.monotonic()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.fsync_interval
+            stopping = batch[0] is self._stop
+            while not stopping:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is self._stop:
+                    stopping = True
+                    break
+                batch.append(item)
+            if stopping:
+                batch = [item for item in batch if item is not self._stop]
+            if batch:
+                self._write(batch)
+            if stopping:
+                return
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        try:
+            self._file.write(b"".join(batch))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except OSError as e:
+            print(f"[JOURNAL] Write error: {e}")
+            return
+        FSYNC_TIME.observe(time.perf_counter() - start)
+        FSYNCS.inc()
+        BATCH_SIZE.observe(len(batch))
+        RECORDS.inc(len(batch))
+        self.written += len(batch)
+
+        if self._file.tell() >= self.segment_bytes or \
+                time.monotonic() - self._opened_at >= self.snapshot_interval:
+            closed = self._segment
+            self._open_segment(closed + 1)
+            # Gộp snapshot trên thread riêng để không chặn việc ghi
+            threading.Thread(target=self._compact, args=(closed,), daemon=True).start()
+
+    def _compact(self, upto):
+        with self._compact_lock:
+            try:
+                compact(self.path, upto)
+            except Exception as e:
+                print(f"[JOURNAL] Compaction error: {e}")
+
+
+_journal = None
+metrics.gauge("rps_journal_queue_depth", "Số bản ghi journal chờ ghi").set_function(
+    lambda: _journal._queue.qsize() if _journal is not None else 0)
+
+
+def setup(path=JOURNAL_DIR, recover=True):
+    """Bật journal cho tiến trình này
+
+    recover=True (tiến trình giữ leaderboard): nạp leaderboard từ snapshot + đuôi journal
+    và ghi kết quả trận vào journal; lần đầu dùng thì lấy leaderboard hiện có làm snapshot gốc.
+    Các sự kiện join/match/move được ghi qua game_manager.
+    """
+    global _journal
+    import game_manager
+    _journal = Journal(path)
+    if recover:
+        start = time.perf_counter()
+        data, last = replay(path)
+        if data is None:
+            leaderboard.load_store()
+            write_snapshot(path, last, leaderboard.export_data())
+        else:
+            leaderboard.restore(data)
+            print(f"[JOURNAL] Recovered {len(data)} players in {time.perf_counter() - start:.3f}s")
+        leaderboard.set_journal(_journal)
+    game_manager.set_journal(_journal)
+    _journal.start()
+    return _journal
+
+
+def shutdown():
+    if _journal is not None:
+        _journal.stop()
+
+
+def _dump(path):
+    _, snap = load_snapshot(path)
+    if snap is not None:
+        print(f"# snapshot: {len(snap)} players")
+    for n, seg in list_segments(path):
+        print(f"# segment {n}")
+        for kind, ts, fields in read_segment(seg):
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))
+            print(stamp, TYPE_NAMES.get(kind, kind), *fields)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Công cụ cho journal sự kiện")
+    parser.add_argument("command", choices=["replay", "dump", "compact"])
+    parser.add_argument("dir", nargs="?", default=JOURNAL_DIR)
+    parser.add_argument("--out", default=leaderboard.LEADERBOARD_FILE,
+                        help="file leaderboard.json để ghi khi replay")
+    args = parser.parse_args()
+
+    if args.command == "dump":
+        _dump(args.dir)
+    elif args.command == "compact":
+        segments = list_segments(args.dir)
+        if segments:
+            compact(args.dir, segments[-1][0])
+    else:
+        start = time.perf_counter()
+        data, last = replay(args.dir)
+        if data is None:
+            print(f"[JOURNAL] {args.dir}: không có snapshot hay segment nào")
+        else:
+            leaderboard._atomic_write(args.out, json.dumps(data, indent=4, ensure_ascii=False))
+            print(f"[JOURNAL] Rebuilt {args.out}: {len(data)} players, "
+                  f"up to segment {last} in {time.perf_counter() - start:.3f}s")
@@ -1,9 +1,61 @@
 # server/leaderboard.py
+import atexit
 import json
 import os
-from typing import Dict, List, Tuple
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from ranking import RankedIndex
+import leaderboard_db
+import metrics
 
 LEADERBOARD_FILE = os.path.join(os.path.dirname(__file__), "leaderboard.json")
+LEADERBOARD_DB = os.path.join(os.path.dirname(__file__), "leaderboard.db")
+
+# Nơi lưu: "json" ghi lại toàn bộ leaderboard.json mỗi lần flush,
+# "sqlite" chỉ upsert những người chơi thay đổi vào leaderboard.db (WAL)
+BACKENDS = ("json", "sqlite")
+_backend = "json"
+_db = None
+
+# Ghi trễ (write-behind): flush khi đủ số thay đổi hoặc hết chu kỳ
+FLUSH_INTERVAL = 2.0   # giây
+FLUSH_DIRTY = 200      # số lần cập nhật chưa ghi
+
+# Rating Elo, giữ song song với score (score để xếp hạng, rating để ghép cặp)
+DEFAULT_RATING = 1500.0
+ELO_K = 32
+_ELO_SCORE = {"win": 1.0, "draw": 0.5, "lose": 0.0}
+
+_data: Dict[str, dict] = None   # bảng điểm thường trú trong bộ nhớ
+_index = RankedIndex()          # thứ hạng theo score, cập nhật tăng dần
+_dirty = 0
+_changed = set()                # người chơi thay đổi từ lần flush trước
+_saved: Dict[str, dict] = None  # backend json: bản sao bảng điểm của thread ghi, flush chỉ chép người đã đổi
+TEXT_TOP = 100                  # số hạng ghi vào leaderboard.txt, 0 = không ghi
+_text = None                    # nội dung leaderboard.txt đã ghi, không đổi thì không ghi lại
+_data_lock = threading.Lock()
+_flush_event = threading.Event()
+_stop_event = threading.Event()
+_writer = None
+_journal = None                 # journal.Journal: ghi kết quả trận theo đúng thứ tự áp dụng
+
+# Ảnh chụp cho truy vấn get_leaderboard: thread ghi trễ dựng lại tối đa một lần mỗi
+# SNAPSHOT_INTERVAL giây, đường xử lý request chỉ đọc tham chiếu
+SNAPSHOT_INTERVAL = 1.0
+PAGE_LIMIT = 20                 # số dòng mặc định mỗi trang
+MAX_PAGE_LIMIT = 100
+PAGE_CACHE_SIZE = 256           # số trang đã encode giữ trong mỗi ảnh chụp
+_version = 0                    # tăng mỗi lần bảng điểm thay đổi
+_snapshot = None
+_snapshot_lock = threading.Lock()
+_external_snapshot = False      # worker của cluster: ảnh chụp do coordinator gửi tới
+
+FLUSHES = metrics.counter("rps_leaderboard_flushes_total", "Số lần ghi leaderboard ra đĩa")
+FLUSH_TIME = metrics.histogram("rps_leaderboard_flush_seconds", "Thời gian ghi leaderboard ra đĩa")
+metrics.gauge("rps_leaderboard_dirty", "Số cập nhật leaderboard chưa ghi").set_function(lambda: _dirty)
+SNAPSHOT_BUILDS = metrics.counter("rps_leaderboard_snapshots_total", "Số lần dựng lại ảnh chụp leaderboard")
 
 def init_leaderboard():
     """Khởi tạo file leaderboard nếu chưa có."""
@@ -16,9 +68,84 @@ def load_data() -> Dict[str, dict]:
     with open(LEADERBOARD_FILE, "r", encoding="utf-8") as f:
         return json.load(f)
 
+def _atomic_write(filename: str, text: str):
+    """Ghi file qua file tạm rồi rename để không bao giờ để lại file bị cắt dở."""
+    tmp = f"{filename}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+
 def save_data(data: Dict[str, dict]):
-    with open(LEADERBOARD_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
+    _atomic_write(LEADERBOARD_FILE, json.dumps(data, indent=4, ensure_ascii=False))
+
+def set_backend(name: str, path: Optional[str] = None):
+    """Chọn nơi lưu leaderboard ('json' | 'sqlite'), gọi trước start_writer."""
+    global _backend, LEADERBOARD_DB
+    if name not in BACKENDS:
+        raise ValueError(f"backend phải là một trong {BACKENDS}")
+    _backend = name
+    if path:
+        LEADERBOARD_DB = path
+
+def _load_backend() -> Dict[str, dict]:
+    global _db
+    if _backend == "sqlite":
+        _db = leaderboard_db.connect(LEADERBOARD_DB)
+        # Lần đầu dùng sqlite: chuyển dữ liệu cũ từ leaderboard.json sang
+        leaderboard_db.migrate_json(_db, LEADERBOARD_FILE)
+        return leaderboard_db.load_all(_db)
+    return load_data()
+
+def load_store():
+    """Nạp leaderboard vào bộ nhớ (chỉ đọc đĩa một lần)."""
+    global _data
+    with _data_lock:
+        if _data is None:
+            _data = _load_backend()
+            for player, stats in _data.items():
+                stats.setdefault("rating", DEFAULT_RATING)
+                _index.update(player, stats.get("score", 0))
+            _reset_saved(_data)
+
+def _reset_saved(data: Dict[str, dict]):
+    """Chép toàn bộ bảng điểm cho flush của backend json (lúc khởi động, gọi khi giữ _data_lock)."""
+    global _saved
+    _saved = {player: dict(stats) for player, stats in data.items()} if _backend == "json" else None
+
+def restore(data: Dict[str, dict]):
+    """Thay bảng điểm bằng dữ liệu đã khôi phục (từ journal), lần flush sau ghi lại toàn bộ."""
+    global _data, _dirty, _version
+    load_store()   # vẫn mở backend (connection sqlite) để flush
+    with _data_lock:
+        for player in _data:
+            if player not in data:
+                _index.remove(player)
+        _data = data
+        for player, stats in data.items():
+            stats.setdefault("rating", DEFAULT_RATING)
+            _index.update(player, stats.get("score", 0))
+        _reset_saved(data)
+        _changed.update(data)
+        _dirty += 1
+        _version += 1
+
+def export_data() -> Dict[str, dict]:
+    """Bản sao bảng điểm hiện tại."""
+    data = _store()
+    with _data_lock:
+        return {player: dict(stats) for player, stats in data.items()}
+
+def set_journal(journal):
+    """Ghi mọi kết quả trận vào journal, theo đúng thứ tự áp dụng vào bảng điểm."""
+    global _journal
+    _journal = journal
+
+def _store() -> Dict[str, dict]:
+    if _data is None:
+        load_store()
+    return _data
 
 def update_score(player_name: str, result: str):
     """
@@ -26,42 +153,295 @@ def update_score(player_name: str, result: str):
     result: 'win' | 'lose' | 'draw'
     Quy ước điểm: win +3, draw +1, lose +0
     """
-    data = load_data()
-    if player_name not in data:
-        data[player_name] = {"win": 0, "lose": 0, "draw": 0, "score": 0}
+    global _dirty, _version
+    if result not in ("win", "lose", "draw"):
+        raise ValueError("result phải là 'win'|'lose'|'draw'")
+
+    data = _store()
+    with _data_lock:
+        stats = data.get(player_name)
+        if stats is None:
+            stats = data[player_name] = _new_stats()
+
+        _add_result(stats, result)
+        _index.update(player_name, stats["score"])
+        _changed.add(player_name)
+
+        # Chỉ đánh dấu bẩn, việc ghi đĩa do thread write-behind đảm nhiệm
+        _dirty += 1
+        _version += 1
+        if _dirty >= FLUSH_DIRTY:
+            _flush_event.set()
+
+def _new_stats() -> dict:
+    return {"win": 0, "lose": 0, "draw": 0, "score": 0, "rating": DEFAULT_RATING}
 
+def _add_result(stats: dict, result: str):
+    stats[result] += 1
     if result == "win":
-        data[player_name]["win"] += 1
-        data[player_name]["score"] += 3
-    elif result == "lose":
-        data[player_name]["lose"] += 1
+        stats["score"] += 3
     elif result == "draw":
-        data[player_name]["draw"] += 1
-        data[player_name]["score"] += 1
-    else:
+        stats["score"] += 1
+
+def _add_rating(stats: dict, opp: dict, result: str):
+    ra, rb = stats["rating"], opp["rating"]
+    expected = 1.0 / (1.0 + 10 ** ((rb - ra) / 400.0))
+    delta = ELO_K * (_ELO_SCORE[result] - expected)
+    stats["rating"] = round(ra + delta, 1)
+    opp["rating"] = round(rb - delta, 1)
+
+def apply_match(data: Dict[str, dict], player_name: str, result: str,
+                opponent_name: str, opponent_result: str):
+    """Cộng kết quả một trận (điểm + rating) vào `data`, dùng chung cho server và replay journal."""
+    if result not in _ELO_SCORE or opponent_result not in _ELO_SCORE:
         raise ValueError("result phải là 'win'|'lose'|'draw'")
+    stats = data.get(player_name) or data.setdefault(player_name, _new_stats())
+    opp = data.get(opponent_name) or data.setdefault(opponent_name, _new_stats())
+    _add_result(stats, result)
+    _add_result(opp, opponent_result)
+    _add_rating(stats, opp, result)
+
+def record_match(player_name: str, result: str, opponent_name: str, opponent_result: str):
+    """Ghi kết quả một trận: điểm của cả hai người chơi và rating Elo."""
+    global _dirty, _version
+    data = _store()
+    with _data_lock:
+        apply_match(data, player_name, result, opponent_name, opponent_result)
+        if _journal is not None:
+            _journal.result(player_name, result, opponent_name, opponent_result)
+        for name in (player_name, opponent_name):
+            _index.update(name, data[name]["score"])
+            _changed.add(name)
+        _dirty += 1
+        _version += 1
+        if _dirty >= FLUSH_DIRTY:
+            _flush_event.set()
 
-    save_data(data)
+def rating_of(player_name: str) -> float:
+    """Rating hiện tại, DEFAULT_RATING nếu người chơi chưa có trong bảng."""
+    stats = _store().get(player_name)
+    return stats.get("rating", DEFAULT_RATING) if stats else DEFAULT_RATING
 
 def get_leaderboard() -> List[Tuple[str, dict]]:
     """Trả về danh sách (player, stats) đã sort theo score giảm dần."""
-    data = load_data()
-    sorted_board = sorted(data.items(), key=lambda x: x[1].get("score", 0), reverse=True)
-    return sorted_board
+    return leaderboard_range(0, None)
+
+def leaderboard_range(start: int, end: Optional[int]) -> List[Tuple[str, dict]]:
+    """Các hạng trong khoảng [start, end) lấy từ chỉ mục, không sort lại."""
+    data = _store()
+    with _data_lock:
+        if end is None:
+            end = len(_index)
+        return [(player, dict(data[player])) for player, _ in _index.range(start, end)]
+
+def top_k(k: int) -> List[Tuple[str, dict]]:
+    return leaderboard_range(0, k)
+
+def rank_of(player_name: str) -> Optional[int]:
+    """Thứ hạng (bắt đầu từ 1) của người chơi, None nếu chưa có trong bảng."""
+    _store()
+    with _data_lock:
+        return _index.rank_of(player_name)
+
+class BoardSnapshot:
+    """Ảnh chụp bất biến của bảng xếp hạng cho get_leaderboard
+
+    rows: tuple các (player, score, win, draw, lose, rating) theo thứ hạng. Mỗi trang
+    được encode một lần cho mỗi codec rồi dùng lại, nên hàng nghìn client hỏi cùng
+    một trang chỉ tốn một lần tra dict và một lần gửi.
+    """
+    __slots__ = ("rows", "ranks", "version", "built_at", "_pages")
+
+    def __init__(self, rows, version=0):
+        self.rows = rows
+        self.ranks = {row[0]: i for i, row in enumerate(rows, start=1)}
+        self.version = version
+        self.built_at = time.monotonic()
+        self._pages = {}
+
+    def page(self, codec, offset: int, limit: int) -> bytes:
+        """Tin nhắn `leaderboard` của trang [offset, offset + limit), đã encode bằng codec"""
+        key = (codec.name, offset, limit)
+        data = self._pages.get(key)
+        if data is None:
+            entries = [_row_dict(rank, row)
+                       for rank, row in enumerate(self.rows[offset:offset + limit], start=offset + 1)]
+            data = codec.encode({"type": "leaderboard", "offset": offset, "limit": limit,
+                                 "total": len(self.rows), "entries": entries})
+            if len(self._pages) < PAGE_CACHE_SIZE:
+                self._pages[key] = data
+        return data
+
+    def rank_message(self, player_name: str) -> dict:
+        """Tin nhắn `leaderboard_rank`: hạng của một người chơi (rank None nếu chưa có)"""
+        rank = self.ranks.get(player_name)
+        if rank is None:
+            return {"type": "leaderboard_rank", "player": player_name, "rank": None,
+                    "total": len(self.rows)}
+        return dict(_row_dict(rank, self.rows[rank - 1]), type="leaderboard_rank",
+                    total=len(self.rows))
+
+def _row_dict(rank: int, row) -> dict:
+    player, score, win, draw, lose, rating = row
+    return {"rank": rank, "player": player, "score": score, "win": win, "draw": draw,
+            "lose": lose, "rating": rating}
+
+def board_snapshot() -> BoardSnapshot:
+    """Ảnh chụp hiện tại.
+
+    Khi thread ghi trễ đang chạy, nó dựng lại ảnh chụp nên ở đây chỉ đọc tham chiếu; chỉ dựng
+    tại chỗ lần đầu (chưa có ảnh chụp) hoặc khi không có thread ghi trễ (script, benchmark).
+    """
+    snap = _snapshot
+    if _external_snapshot:
+        return snap or BoardSnapshot(())
+    if snap is not None and (_writer is not None or not _snapshot_stale(snap)):
+        return snap
+    return refresh_snapshot(blocking=snap is None)
+
+def _snapshot_stale(snap: BoardSnapshot) -> bool:
+    return snap.version != _version and time.monotonic() - snap.built_at >= SNAPSHOT_INTERVAL
+
+def refresh_snapshot(blocking: bool = True) -> Optional[BoardSnapshot]:
+    """Dựng lại ảnh chụp nếu bảng điểm đã đổi và ảnh chụp cũ hơn SNAPSHOT_INTERVAL.
+
+    Chỉ một thread dựng lại; blocking=False thì trả ảnh chụp cũ nếu thread khác đang dựng.
+    """
+    global _snapshot
+    if not _snapshot_lock.acquire(blocking=blocking):
+        return _snapshot
+    try:
+        if _snapshot is None or _snapshot_stale(_snapshot):
+            _snapshot = _build_snapshot()
+            SNAPSHOT_BUILDS.inc()
+        return _snapshot
+    finally:
+        _snapshot_lock.release()
+
+def _build_snapshot() -> BoardSnapshot:
+    """Chỉ giữ _data_lock lúc chép chỉ mục; dựng các dòng làm ngoài lock.
+
+    win/draw/lose/rating đọc ngoài lock nên có thể mới hơn score (lấy từ chỉ mục) vài trận,
+    chấp nhận được vì ảnh chụp vốn đã trễ tới SNAPSHOT_INTERVAL.
+    """
+    _store()
+    with _data_lock:
+        version = _version
+        data = _data
+        keys = _index.keys()
+    rows = []
+    for neg_score, player in keys:
+        st = data[player]
+        rows.append((player, -neg_score, st["win"], st["draw"], st["lose"],
+                     st.get("rating", DEFAULT_RATING)))
+    return BoardSnapshot(tuple(rows), version)
+
+def install_snapshot(rows, version=0):
+    """Dùng ảnh chụp dựng ở nơi khác (coordinator của cluster) thay cho bảng điểm cục bộ."""
+    global _snapshot, _external_snapshot
+    _external_snapshot = True
+    _snapshot = BoardSnapshot(tuple(tuple(row) for row in rows), version)
+
+def clamp_page(offset, limit) -> Tuple[int, int]:
+    """offset/limit từ client -> giá trị hợp lệ (số nguyên, limit trong [1, MAX_PAGE_LIMIT])"""
+    try:
+        offset = max(0, int(offset or 0))
+        limit = min(max(1, int(limit or PAGE_LIMIT)), MAX_PAGE_LIMIT)
+    except (TypeError, ValueError, OverflowError):   # 1e400 -> inf
+        offset, limit = 0, PAGE_LIMIT
+    return offset, limit
 
 # server/leaderboard.py
 
-def save_leaderboard_file(filename="leaderboard.txt"):
-    """Lưu bảng xếp hạng ra file dạng text giống khi in console"""
-    board = get_leaderboard()
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write("\n🏆 BẢNG XẾP HẠNG 🏆\n")
-        f.write("-" * 48 + "\n")
-        f.write(f"{'Hạng':4} {'Tên':20} {'Điểm':6} {'Thắng':6} {'Hòa':6} {'Thua':6}\n")
-        f.write("-" * 48 + "\n")
-        for i, (player, stats) in enumerate(board, start=1):
-            f.write(f"{i:4} {player:20} {stats['score']:6} {stats['win']:6} {stats['draw']:6} {stats['lose']:6}\n")
-        f.write("-" * 48 + "\n")
+def render_leaderboard(board) -> str:
+    """Tạo bảng xếp hạng dạng text giống khi in console"""
+    lines = ["", "🏆 BẢNG XẾP HẠNG 🏆", "-" * 55,
+             f"{'Hạng':4} {'Tên':20} {'Điểm':6} {'Thắng':6} {'Hòa':6} {'Thua':6} {'Elo':6}", "-" * 55]
+    for i, (player, stats) in enumerate(board, start=1):
+        rating = stats.get("rating", DEFAULT_RATING)
+        lines.append(f"{i:4} {player:20} {stats['score']:6} {stats['win']:6} {stats['draw']:6} "
+                     f"{stats['lose']:6} {rating:6.0f}")
+    lines.append("-" * 55)
+    return "\n".join(lines) + "\n"
+
+def print_leaderboard(limit: Optional[int] = None):
+    """In bảng xếp hạng (toàn bộ hoặc `limit` hạng đầu) ra console"""
+    print(render_leaderboard(leaderboard_range(0, limit)), end="")
+
+def flush(force: bool = False):
+    """Ghi bảng điểm trong bộ nhớ ra backend và TEXT_TOP hạng đầu ra leaderboard.txt (nếu có thay đổi).
+
+    Trong _data_lock chỉ chép những người chơi đã thay đổi (và TEXT_TOP hạng đầu với backend
+    json). Backend sqlite upsert những người đó trong một transaction rồi lấy TEXT_TOP hạng đầu
+    bằng top_k trên index; backend json cập nhật bản sao `_saved` rồi ghi lại cả file, đều ngoài lock.
+    """
+    global _dirty, _changed, _text
+    if _data is None:
+        return
+    with _data_lock:
+        if not _dirty and not force:
+            return
+        changed = {player: dict(_data[player]) for player in _changed}
+        board = None
+        if TEXT_TOP and _backend != "sqlite":
+            board = [(player, dict(_data[player])) for player, _ in _index.range(0, TEXT_TOP)]
+        _changed = set()
+        _dirty = 0
+    # Serialize và ghi đĩa ngoài lock để không chặn update_score
+    start = time.perf_counter()
+    if _backend == "sqlite":
+        leaderboard_db.upsert_many(_db, changed.items())
+        if TEXT_TOP:
+            board = leaderboard_db.top_k(_db, TEXT_TOP)
+    else:
+        _saved.update(changed)
+        save_data(_saved)
+    if board is not None:
+        text = render_leaderboard(board)
+        if text != _text:
+            _atomic_write("leaderboard.txt", text)
+            _text = text
+    FLUSH_TIME.observe(time.perf_counter() - start)
+    FLUSHES.inc()
+
+def _writer_loop(interval: float):
+    """Dựng lại ảnh chụp cho get_leaderboard mỗi SNAPSHOT_INTERVAL, flush mỗi `interval` hoặc khi đủ FLUSH_DIRTY"""
+    last_flush = time.monotonic()
+    while not _stop_event.is_set():
+        triggered = _flush_event.wait(min(interval, SNAPSHOT_INTERVAL))
+        _flush_event.clear()
+        try:
+            if not _external_snapshot:
+                refresh_snapshot()
+            now = time.monotonic()
+            if triggered or now - last_flush >= interval:
+                last_flush = now
+                flush()
+        except Exception as e:
+            print(f"[LEADERBOARD] Flush error: {e}")
+
+def start_writer(interval: float = FLUSH_INTERVAL):
+    """Nạp leaderboard vào bộ nhớ và chạy thread ghi trễ theo chu kỳ/số thay đổi."""
+    global _writer
+    load_store()
+    if _writer is not None:
+        return
+    if not _external_snapshot:
+        refresh_snapshot()   # ảnh chụp đầu tiên dựng trước khi có request
+    _stop_event.clear()
+    _writer = threading.Thread(target=_writer_loop, args=(interval,), daemon=True)
+    _writer.start()
+    atexit.register(stop_writer)
+
+def stop_writer():
+    """Dừng thread ghi trễ và flush lần cuối (gọi khi tắt server)."""
+    global _writer
+    if _writer is not None:
+        _stop_event.set()
+        _flush_event.set()
+        _writer.join(timeout=5)
+        _writer = None
+    flush()
 
 
 if __name__ == "__main__":
@@ -72,4 +452,5 @@ if __name__ == "__main__":
         update_score("Alice", "win")
         update_score("Bob", "lose")
         update_score("Alice", "draw")
+        flush()
     print_leaderboard()
\ No newline at end of file
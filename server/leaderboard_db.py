@@ -0,0 +1,115 @@
+# server/leaderboard_db.py
+"""Lưu leaderboard trong SQLite (WAL), dùng cho backend "sqlite" của leaderboard.py
+
+Mỗi người chơi là một dòng; cột score có index (score DESC, player) nên top-N và
+thứ hạng đọc theo index, không phải nạp cả bảng. Ghi theo lô: một transaction
+upsert tất cả người chơi thay đổi từ lần flush trước.
+"""
+import json
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leaderboard (
+    player TEXT PRIMARY KEY,
+    win    INTEGER NOT NULL DEFAULT 0,
+    lose   INTEGER NOT NULL DEFAULT 0,
+    draw   INTEGER NOT NULL DEFAULT 0,
+    score  INTEGER NOT NULL DEFAULT 0,
+    rating REAL    NOT NULL DEFAULT 1500
+);
+CREATE INDEX IF NOT EXISTS idx_leaderboard_score ON leaderboard (score DESC, player);
+"""
+
+UPSERT = """
+INSERT INTO leaderboard (player, win, lose, draw, score, rating) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (player) DO UPDATE SET
+    win = excluded.win, lose = excluded.lose, draw = excluded.draw, score = excluded.score,
+    rating = excluded.rating
+"""
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Mở (hoặc tạo) database ở chế độ WAL
+
+    synchronous=NORMAL: trong WAL vẫn an toàn khi tiến trình chết, chỉ có thể mất
+    transaction cuối nếu mất điện. Connection được dùng bởi thread write-behind
+    nên tắt check_same_thread.
+    """
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(leaderboard)")}
+    if "rating" not in columns:
+        # database tạo trước khi có rating
+        conn.execute("ALTER TABLE leaderboard ADD COLUMN rating REAL NOT NULL DEFAULT 1500")
+    return conn
+
+
+COLUMNS = "player, win, lose, draw, score, rating"
+
+
+def _row_stats(row) -> dict:
+    _, win, lose, draw, score, rating = row
+    return {"win": win, "lose": lose, "draw": draw, "score": score, "rating": rating}
+
+
+def load_all(conn: sqlite3.Connection) -> Dict[str, dict]:
+    rows = conn.execute(f"SELECT {COLUMNS} FROM leaderboard")
+    return {row[0]: _row_stats(row) for row in rows}
+
+
+def upsert_many(conn: sqlite3.Connection, items: Iterable[Tuple[str, dict]]) -> int:
+    """Ghi một lô (player, stats) trong một transaction, trả về số dòng"""
+    rows = [(player, s["win"], s["lose"], s["draw"], s["score"], s.get("rating", 1500))
+            for player, s in items]
+    if rows:
+        with conn:
+            conn.executemany(UPSERT, rows)
+    return len(rows)
+
+
+def top_k(conn: sqlite3.Connection, k: int, offset: int = 0) -> List[Tuple[str, dict]]:
+    """k người điểm cao nhất (bắt đầu từ hạng offset + 1), đọc theo index score"""
+    rows = conn.execute(
+        f"SELECT {COLUMNS} FROM leaderboard ORDER BY score DESC, player LIMIT ? OFFSET ?", (k, offset))
+    return [(row[0], _row_stats(row)) for row in rows]
+
+
+def rank_of(conn: sqlite3.Connection, player: str) -> Optional[int]:
+    """Thứ hạng (bắt đầu từ 1), cùng thứ tự với RankedIndex: score giảm dần rồi tên"""
+    row = conn.execute("SELECT score FROM leaderboard WHERE player = ?", (player,)).fetchone()
+    if row is None:
+        return None
+    score = row[0]
+    (ahead,) = conn.execute(
+        "SELECT COUNT(*) FROM leaderboard WHERE score > ? OR (score = ? AND player < ?)",
+        (score, score, player)).fetchone()
+    return ahead + 1
+
+
+def migrate_json(conn: sqlite3.Connection, json_path: str) -> int:
+    """Chuyển dữ liệu từ leaderboard.json sang database (chỉ khi database còn rỗng)"""
+    (count,) = conn.execute("SELECT COUNT(*) FROM leaderboard").fetchone()
+    if count or not os.path.exists(json_path):
+        return 0
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    items = [(player, {"win": s.get("win", 0), "lose": s.get("lose", 0),
+                       "draw": s.get("draw", 0), "score": s.get("score", 0),
+                       "rating": s.get("rating", 1500)})
+             for player, s in data.items()]
+    migrated = upsert_many(conn, items)
+    if migrated:
+        print(f"[LEADERBOARD] Migrated {migrated} players from {json_path}")
+    return migrated
+
+
+if __name__ == "__main__":
+    # Chuyển leaderboard.json sang leaderboard.db rồi in top 10
+    import leaderboard
+    db = connect(leaderboard.LEADERBOARD_DB)
+    migrate_json(db, leaderboard.LEADERBOARD_FILE)
+    print(leaderboard.render_leaderboard(top_k(db, 10)))
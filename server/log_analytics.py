@@ -0,0 +1,278 @@
+# server/log_analytics.py
+"""Thống kê từ game_log.txt theo kiểu streaming, chỉ đọc phần mới ở mỗi lần chạy
+
+Pipeline generator:  chunks (cắt phần mới của từng file thành các đoạn theo ranh giới
+dòng)  ->  scan_chunk (mmap đoạn đó, mỗi loại dòng một regex `findall`, đếm bằng Counter
+với khóa bytes; cả hai bước chạy trong C, không có vòng lặp Python theo từng dòng)  ->
+Stats.merge (giải mã tên và cộng dồn theo khóa phân biệt). Với --jobs > 1 các đoạn được
+quét song song bằng multiprocessing, kết quả vẫn gộp theo đúng thứ tự trong file.
+
+Checkpoint (JSON) lưu offset đã đọc của từng file log (theo inode) cùng toàn bộ số liệu
+cộng dồn, nên lần chạy sau chỉ xử lý các byte mới ghi thêm. File bị cắt ngắn thì đọc lại
+từ đầu. Dòng cuối chưa có '\\n' để dành cho lần sau. Khi có file đã xoay vòng, liệt kê
+file cũ trước (game_log.txt.1 game_log.txt) để thời gian phiên được ghép đúng thứ tự.
+
+    python log_analytics.py game_log.txt.1 game_log.txt [game_log.worker0.txt ...] [--jobs 4] \\
+        [--checkpoint log_stats.json] [--json report.json] [--csv players.csv] [--hourly-csv hourly.csv]
+
+Các dòng được nhận dạng (định dạng hiện có của game_manager/server); tên người chơi có
+'(' hoặc '[' không được tính:
+    <ts> - A joined from (...)            <ts> - A resumed from (...)      <ts> - A disconnected
+    <ts> - [MATCH] A vs B                 <ts> - A(rock) vs B(paper) => P1:lose, P2:win
+    <ts> - [GAME OVER] A 2-1 B (0 hòa)    <ts> - [FORFEIT] A rời trận, B thắng
+"""
+import argparse
+import csv
+import json
+import mmap
+import os
+import re
+import time
+from collections import Counter, defaultdict
+from operator import add, itemgetter
+
+CHECKPOINT_FILE = "log_stats.json"
+CHUNK_SIZE = 64 * 1024 * 1024
+
+# Mỗi mẫu bắt đầu bằng '\n' (ký tự đầu cố định để regex nhảy nhanh giữa các dòng),
+# ".{22}" bỏ qua "YYYY-MM-DD HH:MM:SS - "
+_MOVE = rb"\((?:rock|paper|scissors|None)\)"
+ROUND_RE = re.compile(
+    rb"\n.{22}([^\n(\[]+" + _MOVE + rb") vs ([^\n(]+" + _MOVE + rb") => P1:([wld])[a-z]+, P2:([wld])")
+MATCH_RE = re.compile(rb"\n(.{13}):.{8}\[MATCH\] ")
+GAME_RE = re.compile(rb"\n.{22}\[GAME OVER\] ([^\n]+) (\d+)-(\d+) ([^\n]+) \(\d+ h\xc3\xb2a\)")
+FORFEIT_RE = re.compile(rb"\n.{22}\[FORFEIT\] ([^\n]+) r\xe1\xbb\x9di tr\xe1\xba\xadn, ")
+SESSION_RE = re.compile(
+    rb"\n(.{19}) - ([^\n(\[]+?) ([jrd])(?:oined from |esumed from |isconnected$)", re.MULTILINE)
+
+RESULTS = {b"w": "win", b"l": "lose", b"d": "draw"}
+
+_hour_epoch = {}
+
+
+def to_epoch(ts: bytes) -> float:
+    """b"YYYY-MM-DD HH:MM:SS" (giờ địa phương) -> epoch; chỉ gọi mktime một lần mỗi giờ"""
+    hour = ts[:13]
+    base = _hour_epoch.get(hour)
+    if base is None:
+        base = _hour_epoch[hour] = time.mktime(time.strptime(hour.decode(), "%Y-%m-%d %H"))
+    return base + int(ts[14:16]) * 60 + int(ts[17:19])
+
+
+def complete_end(path, offset):
+    """Offset ngay sau '\\n' cuối cùng của file (không nhỏ hơn `offset`)"""
+    if os.path.getsize(path) <= offset:
+        return offset
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return max(mm.rfind(b"\n", offset) + 1, offset)
+
+
+def chunks(path, start, end, size=CHUNK_SIZE):
+    """Sinh (path, start, stop) chia [start, end) thành các đoạn ~size byte theo ranh giới dòng"""
+    if start >= end:
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        while start < end:
+            stop = mm.find(b"\n", min(start + size, end) - 1) + 1
+            yield path, start, stop
+            start = stop
+
+
+def scan_chunk(task):
+    """Quét một đoạn [start, end) bắt đầu/kết thúc ở ranh giới dòng -> số liệu thô (khóa bytes)"""
+    path, start, end = task
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if start == 0:
+            # Dòng đầu file không có '\n' đứng trước: quét riêng một bản có thêm '\n'
+            first = mm.find(b"\n", 0, end)
+            regions = [(b"\n" + mm[:first + 1], 0, first + 2), (mm, first, end)]
+        else:
+            regions = [(mm, start - 1, end)]
+        part = {"rounds": Counter(), "hourly": Counter(), "games": Counter(),
+                "forfeits": Counter(), "sessions": [], "round_count": 0}
+        for buf, pos, stop in regions:
+            rows = ROUND_RE.findall(buf, pos, stop)
+            part["round_count"] += len(rows)
+            # Khóa b"A(rock)w": tên + nước đi + kết quả trong một bytes, đếm hoàn toàn trong C
+            part["rounds"].update(map(add, map(itemgetter(0), rows), map(itemgetter(2), rows)))
+            part["rounds"].update(map(add, map(itemgetter(1), rows), map(itemgetter(3), rows)))
+            part["hourly"].update(MATCH_RE.findall(buf, pos, stop))
+            part["games"].update(GAME_RE.findall(buf, pos, stop))
+            part["forfeits"].update(FORFEIT_RE.findall(buf, pos, stop))
+            part["sessions"] += SESSION_RE.findall(buf, pos, stop)
+        return part
+
+
+class Stats:
+    """Số liệu cộng dồn, lưu/khôi phục được qua checkpoint"""
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.players = defaultdict(_new_player)
+        for name, p in data.get("players", {}).items():
+            self.players[name].update(p)
+        self.hourly = Counter(data.get("matches_per_hour", {}))
+        self.open_sessions = dict(data.get("open_sessions", {}))  # {player: thời điểm join}
+        self.totals = Counter(data.get("totals", {}))
+
+    def merge(self, part):
+        """Cộng số liệu thô của một đoạn; các đoạn phải được gộp theo thứ tự trong file"""
+        players = self.players
+        for key, n in part["rounds"].items():
+            name, _, rest = key.rpartition(b"(")
+            p = players[name.decode("utf-8", "replace")]
+            move = rest[:-2].decode()
+            if move != "None":
+                p[move] += n
+            p[RESULTS[rest[-1:]]] += n
+        self.totals["rounds"] += part["round_count"]
+        for hour, n in part["hourly"].items():
+            self.hourly[hour.decode()] += n
+            self.totals["matches"] += n
+        for (g1, w1, w2, g2), n in part["games"].items():
+            winner, loser = (g1, g2) if int(w1) > int(w2) else (g2, g1)
+            players[winner.decode("utf-8", "replace")]["games_won"] += n
+            players[loser.decode("utf-8", "replace")]["games_lost"] += n
+            self.totals["games"] += n
+        for name, n in part["forfeits"].items():
+            players[name.decode("utf-8", "replace")]["forfeits"] += n
+            self.totals["forfeits"] += n
+        open_sessions = self.open_sessions
+        for ts, name, kind in part["sessions"]:
+            name = name.decode("utf-8", "replace")
+            if kind != b"d":
+                players[name]["sessions"] += 1
+                open_sessions[name] = to_epoch(ts)
+                continue
+            joined = open_sessions.pop(name, None)
+            if joined is not None:
+                p = players[name]
+                p["closed_sessions"] += 1
+                p["session_seconds"] += max(0.0, to_epoch(ts) - joined)
+
+    def to_dict(self):
+        return {"players": dict(self.players), "matches_per_hour": dict(self.hourly),
+                "open_sessions": self.open_sessions, "totals": dict(self.totals)}
+
+    def report(self):
+        """Báo cáo tổng hợp: mỗi người chơi kèm tỉ lệ thắng, tần suất nước đi, thời gian phiên"""
+        players = {}
+        for name, p in sorted(self.players.items()):
+            moves = p["rock"] + p["paper"] + p["scissors"]
+            decided = p["win"] + p["lose"]
+            players[name] = dict(
+                p, rounds=decided + p["draw"],
+                win_rate=round(p["win"] / decided, 4) if decided else None,
+                move_freq={mv: round(p[mv] / moves, 4) if moves else 0.0
+                           for mv in ("rock", "paper", "scissors")},
+                avg_session_seconds=(round(p["session_seconds"] / p["closed_sessions"], 1)
+                                     if p["closed_sessions"] else None))
+        return {"totals": dict(self.totals), "matches_per_hour": dict(sorted(self.hourly.items())),
+                "players": players}
+
+
+def _new_player():
+    return {"rock": 0, "paper": 0, "scissors": 0, "win": 0, "lose": 0, "draw": 0,
+            "games_won": 0, "games_lost": 0, "forfeits": 0, "sessions": 0,
+            "closed_sessions": 0, "session_seconds": 0.0}
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return {}, Stats()
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data.get("files", {}), Stats(data.get("stats"))
+
+
+def save_checkpoint(path, files, stats):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"files": files, "stats": stats.to_dict()}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def process(paths, checkpoint=CHECKPOINT_FILE, jobs=1):
+    """Đọc phần mới của các file log, cập nhật checkpoint; trả về (Stats, số byte đã xử lý)"""
+    files, stats = load_checkpoint(checkpoint)
+    processed = 0
+    pool = None
+    if jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+    try:
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            # Checkpoint theo inode chứ không theo tên: game_log.txt sau khi xoay vòng thành
+            # game_log.txt.1 vẫn đọc tiếp đúng chỗ, file game_log.txt mới đọc từ đầu
+            st = os.stat(path)
+            key = f"{st.st_dev}:{st.st_ino}"
+            offset = files.get(key, {}).get("offset", 0)
+            if st.st_size < offset:
+                offset = 0   # file bị cắt ngắn
+            end = complete_end(path, offset)
+            tasks = chunks(path, offset, end)
+            for part in pool.imap(scan_chunk, tasks) if pool else map(scan_chunk, tasks):
+                stats.merge(part)
+            processed += end - offset
+            files[key] = {"path": os.path.abspath(path), "offset": end}
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    save_checkpoint(checkpoint, files, stats)
+    return stats, processed
+
+
+def write_csv(path, report):
+    fields = ["player", "rounds", "win", "lose", "draw", "win_rate", "rock", "paper", "scissors",
+              "games_won", "games_lost", "forfeits", "sessions", "avg_session_seconds"]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(fields)
+        for name, p in report["players"].items():
+            w.writerow([name] + [p[k] for k in fields[1:]])
+
+
+def write_hourly_csv(path, report):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["hour", "matches"])
+        for hour, count in report["matches_per_hour"].items():
+            w.writerow([hour, count])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Thống kê game_log.txt (chỉ đọc phần mới)")
+    parser.add_argument("logs", nargs="*", default=["game_log.txt"])
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE,
+                        help="file lưu offset và số liệu cộng dồn giữa các lần chạy")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="số tiến trình quét song song (mặc định: số CPU)")
+    parser.add_argument("--json", dest="json_out", help="ghi báo cáo đầy đủ ra file JSON")
+    parser.add_argument("--csv", dest="csv_out", help="ghi bảng theo người chơi ra CSV")
+    parser.add_argument("--hourly-csv", help="ghi số trận mỗi giờ ra CSV")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stats, processed = process(args.logs, args.checkpoint, args.jobs)
+    elapsed = time.perf_counter() - start
+    report = stats.report()
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.csv_out:
+        write_csv(args.csv_out, report)
+    if args.hourly_csv:
+        write_hourly_csv(args.hourly_csv, report)
+
+    totals = report["totals"]
+    print(f"[STATS] {processed / 1e6:.2f} MB mới trong {elapsed:.2f}s "
+          f"({processed / 1e6 / elapsed if elapsed else 0:.0f} MB/s)")
+    print(f"[STATS] {len(report['players'])} người chơi, {totals.get('matches', 0)} trận, "
+          f"{totals.get('rounds', 0)} round, {totals.get('games', 0)} game over")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,135 @@
-import logging
-from datetime import datetime
+import atexit
+import os
+import queue
+import threading
+import time
 
-def get_logger(name="RPS_Server"):
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
+import metrics
 
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+class EventLog:
+    """Ghi log sự kiện game (game_log.txt) theo lô bằng một thread nền
 
-    filename = f"logs_{datetime.now().strftime('%Y_%m_%d')}.log"
-    file_handler = logging.FileHandler(filename, encoding="utf-8")
-    file_handler.setFormatter(formatter)
+    `log()` chỉ đưa sự kiện vào hàng đợi có giới hạn; thread nền gom tối đa
+    `batch_size` sự kiện hoặc chờ tối đa `flush_interval` giây rồi ghi một lần.
+    Khi hàng đợi đầy: `on_full="drop"` bỏ sự kiện (tăng `dropped`), `"block"` chờ
+    tối đa `block_timeout` giây (backpressure). File được xoay vòng khi vượt
+    `max_bytes` (game_log.txt -> game_log.txt.1 -> ...).
+    """
 
-    if not logger.handlers:
-        logger.addHandler(file_handler)
+    def __init__(self, filename="game_log.txt", max_queue=10000, batch_size=500,
+                 flush_interval=0.5, max_bytes=10 * 1024 * 1024, backup_count=5,
+                 on_full="drop", block_timeout=1.0):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.on_full = on_full
+        self.block_timeout = block_timeout
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stop = object()
 
-    return logger
+    def log(self, msg: str):
+        """Đưa một sự kiện vào hàng đợi, không bao giờ ghi file trên thread gọi"""
+        if self._thread is None:
+            self.start()
+        item = (time.time(), msg)
+        try:
+            if self.on_full == "block":
+                self._queue.put(item, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self):
+        return {"written": self.written, "dropped": self.dropped, "queued": self._queue.qsize()}
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Ghi nốt các sự kiện còn trong hàng đợi rồi dừng thread nền"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(self._stop)
+        thread.join(timeout=5)
+        self._thread = None
+
+    def _run(self):
+        last_sec = None
+        stamp = ""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            stopping = batch[0] is self._stop
+            while not stopping and len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is self._stop:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            lines = []
+            for item in batch:
+                if item is self._stop:
+                    continue
+                ts, msg = item
+                sec = int(ts)
+                if sec != last_sec:
+                    # Chỉ format thời gian một lần mỗi giây
+                    last_sec = sec
+                    stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(sec))
+                lines.append(f"{stamp} - {msg}\n")
+            if lines:
+                self._write("".join(lines), len(lines))
+            if stopping:
+                return
+
+    def _write(self, text, count):
+        try:
+            with open(self.filename, "a", encoding="utf-8") as f:
+                f.write(text)
+                size = f.tell()
+            self.written += count
+            if self.max_bytes and size >= self.max_bytes:
+                self._rotate()
+        except OSError:
+            self.dropped += count
+
+    def _rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.filename}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.filename}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.filename, f"{self.filename}.1")
+        else:
+            os.remove(self.filename)
+
+
+event_log = EventLog()
+metrics.counter("rps_log_events_written_total", "Số sự kiện đã ghi vào game log").set_function(lambda: event_log.written)
+metrics.counter("rps_log_events_dropped_total", "Số sự kiện game log bị bỏ").set_function(lambda: event_log.dropped)
+metrics.gauge("rps_log_queue_depth", "Số sự kiện đang chờ ghi").set_function(lambda: event_log._queue.qsize())
+
+
+def save_log(msg: str):
+    """Lưu log vào file (qua hàng đợi của event_log, ghi theo lô)"""
+    event_log.log(msg)
@@ -0,0 +1,53 @@
+# server/match_queue.py
+import time
+from collections import OrderedDict
+
+
+class MatchQueue:
+    """Hàng đợi ghép cặp FIFO dựa trên OrderedDict.
+
+    push / pop / discard / `in` đều O(1), thay cho list với `pop(0)`, `remove`
+    và `in` (O(n)). Client đã ngắt kết nối không bị quét bỏ ngay mà được loại
+    khi tới lượt lấy ra (truyền `is_alive` cho `pop`). Mỗi phần tử nhớ thời điểm
+    vào hàng đợi để đo thời gian chờ.
+    """
+
+    def __init__(self):
+        self._items = OrderedDict()
+
+    def push(self, sock) -> bool:
+        """Thêm vào cuối hàng đợi, trả về False nếu đã có"""
+        if sock in self._items:
+            return False
+        self._items[sock] = time.perf_counter()
+        return True
+
+    def push_front(self, sock, enqueued_at=None):
+        """Trả một client về đầu hàng đợi (giữ nguyên lượt chờ)"""
+        self._items[sock] = enqueued_at if enqueued_at is not None else time.perf_counter()
+        self._items.move_to_end(sock, last=False)
+
+    def pop(self, is_alive=None):
+        """Lấy client chờ lâu nhất; bỏ qua (và loại luôn) những client mà is_alive trả về False"""
+        return self.pop_with_time(is_alive)[0]
+
+    def pop_with_time(self, is_alive=None):
+        """Như pop() nhưng trả về (sock, thời điểm vào hàng đợi); (None, None) nếu rỗng"""
+        while self._items:
+            sock, enqueued_at = self._items.popitem(last=False)
+            if is_alive is None or is_alive(sock):
+                return sock, enqueued_at
+        return None, None
+
+    def discard(self, sock):
+        """Bỏ client khỏi hàng đợi, trả về True nếu nó đang chờ"""
+        return self._items.pop(sock, None) is not None
+
+    def __contains__(self, sock):
+        return sock in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
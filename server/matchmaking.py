@@ -0,0 +1,166 @@
+# server/matchmaking.py
+"""Ghép cặp theo rating: chia người chờ vào các bucket theo rating, ghép theo tick
+
+`join_queue` chỉ thêm người chơi vào bucket (O(1)); việc ghép làm theo lô ở mỗi
+`tick()` do tầng I/O gọi định kỳ:
+
+1. Trong mỗi bucket (rating chênh nhau < BUCKET_WIDTH) ghép lần lượt hai người chờ lâu nhất.
+2. Mỗi bucket còn dư tối đa một người; những người dư được sắp theo rating và ghép với
+   người kế bên nếu chênh lệch nằm trong cửa sổ cho phép. Cửa sổ rộng dần theo thời gian
+   chờ, quá MAX_WAIT giây thì ghép với bất kỳ ai.
+
+Chi phí mỗi tick là O(số cặp + số bucket), không quét toàn bộ hàng đợi.
+"""
+import time
+from collections import OrderedDict
+
+import game_manager
+import leaderboard
+import metrics
+
+BUCKET_WIDTH = 50      # điểm rating mỗi bucket
+BASE_WINDOW = 100      # chênh lệch rating chấp nhận được khi vừa vào hàng đợi
+WIDEN_PER_SEC = 50     # cửa sổ rộng thêm mỗi giây chờ
+MAX_WAIT = 30.0        # chờ quá lâu: ghép với bất kỳ ai
+TICK_INTERVAL = 0.1    # giây giữa hai lần ghép
+
+TICK_TIME = metrics.histogram("rps_matchmaker_tick_seconds", "Thời gian một tick ghép cặp theo rating")
+TICK_PAIRS = metrics.histogram("rps_matchmaker_tick_pairs", "Số cặp ghép được mỗi tick",
+                               buckets=(0, 1, 2, 5, 10, 50, 100, 500, 1000, 5000, 10000))
+
+
+def window(wait):
+    """Chênh lệch rating tối đa cho người đã chờ `wait` giây"""
+    if wait >= MAX_WAIT:
+        return float("inf")
+    return BASE_WINDOW + WIDEN_PER_SEC * wait
+
+
+class RatingBuckets:
+    """Người chơi chờ ghép, chia bucket theo rating
+
+    buckets: {bucket_id: OrderedDict{sock: (enqueued_at, rating)}} theo thứ tự vào hàng đợi.
+    Không tự khóa; RatingMatchmaker giữ `queue_lock` khi gọi.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.where = {}   # {sock: bucket_id}
+
+    def add(self, sock, rating, enqueued_at=None):
+        if sock in self.where:
+            return False
+        bucket_id = int(rating // BUCKET_WIDTH)
+        bucket = self.buckets.get(bucket_id)
+        if bucket is None:
+            bucket = self.buckets[bucket_id] = OrderedDict()
+        bucket[sock] = (enqueued_at if enqueued_at is not None else time.perf_counter(), rating)
+        self.where[sock] = bucket_id
+        return True
+
+    def discard(self, sock):
+        bucket_id = self.where.pop(sock, None)
+        if bucket_id is None:
+            return False
+        bucket = self.buckets[bucket_id]
+        del bucket[sock]
+        if not bucket:
+            del self.buckets[bucket_id]
+        return True
+
+    def __contains__(self, sock):
+        return sock in self.where
+
+    def __len__(self):
+        return len(self.where)
+
+    def collect_pairs(self, now, is_alive=None):
+        """Lấy ra các cặp ghép được ở thời điểm `now`
+
+        Trả về list (p1, t1, p2, t2) với t là thời điểm vào hàng đợi.
+        """
+        pairs = []
+        leftovers = []
+        for bucket_id in list(self.buckets):
+            bucket = self.buckets[bucket_id]
+            waiting = None
+            while bucket:
+                sock, (enqueued_at, rating) = bucket.popitem(last=False)
+                del self.where[sock]
+                if is_alive is not None and not is_alive(sock):
+                    continue
+                if waiting is None:
+                    waiting = (sock, enqueued_at, rating)
+                else:
+                    pairs.append((waiting[0], waiting[1], sock, enqueued_at))
+                    waiting = None
+            del self.buckets[bucket_id]
+            if waiting is not None:
+                leftovers.append((waiting[2], waiting[1], waiting[0]))
+
+        # Người dư của các bucket: ghép với người kế bên theo rating nếu trong cửa sổ
+        leftovers.sort(key=lambda item: item[0])
+        i = 0
+        while i < len(leftovers):
+            rating, enqueued_at, sock = leftovers[i]
+            if i + 1 < len(leftovers):
+                rating2, enqueued_at2, sock2 = leftovers[i + 1]
+                if rating2 - rating <= window(now - min(enqueued_at, enqueued_at2)):
+                    pairs.append((sock, enqueued_at, sock2, enqueued_at2))
+                    i += 2
+                    continue
+            # Chưa có đối thủ hợp: trả lại hàng đợi, giữ thời điểm vào
+            self.add(sock, rating, enqueued_at)
+            i += 1
+        return pairs
+
+
+class RatingMatchmaker:
+    """Bộ ghép cặp theo rating cho game_manager.set_matchmaker()
+
+    enqueue/cancel chỉ cập nhật bucket; ghép cặp xảy ra trong tick().
+    """
+
+    def __init__(self, rating_of=leaderboard.rating_of, tick_interval=TICK_INTERVAL):
+        self.rating_of = rating_of
+        self.tick_interval = tick_interval
+        self.waiting = RatingBuckets()
+        self.signalled_at = None   # lần vào hàng đợi đầu tiên từ tick trước (cho MATCH_TICK_DELAY)
+        metrics.gauge("rps_rating_queue_depth", "Số client chờ ghép theo rating").set_function(
+            lambda: len(self.waiting))
+
+    def enqueue(self, sock):
+        if isinstance(sock, game_manager.SuspendedSession):
+            sock.queued = True
+            return
+        rating = self.rating_of(game_manager.clients.get(sock, ""))
+        with game_manager.queue_lock:
+            if self.waiting.add(sock, rating) and self.signalled_at is None:
+                self.signalled_at = time.perf_counter()
+
+    def cancel(self, sock):
+        with game_manager.queue_lock:
+            return self.waiting.discard(sock)
+
+    def __contains__(self, sock):
+        return sock in self.waiting
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def tick(self):
+        start = time.perf_counter()
+        with game_manager.queue_lock:
+            signalled_at, self.signalled_at = self.signalled_at, None
+            pairs = self.waiting.collect_pairs(start, game_manager._is_waiting)
+            paired = []
+            for p1, t1, p2, t2 in pairs:
+                paired.append(game_manager._register_match(p1, p2))
+                game_manager.QUEUE_WAIT.observe(start - t1)
+                game_manager.QUEUE_WAIT.observe(start - t2)
+        if signalled_at is not None:
+            game_manager.MATCH_TICK_DELAY.observe(start - signalled_at)
+        # Gửi tin ngoài lock
+        game_manager._announce_matches(paired)
+        TICK_PAIRS.observe(len(paired))
+        TICK_TIME.observe(time.perf_counter() - start)
@@ -0,0 +1,202 @@
+# server/metrics.py
+"""Counter / gauge / histogram trong bộ nhớ, xuất theo định dạng text của Prometheus.
+
+Mỗi lần cập nhật chỉ là một phép cộng dưới lock riêng của metric (không I/O,
+không cấp phát), nên có thể bật thường trực. `start_metrics_server()` mở endpoint
+HTTP `/metrics` trên localhost bằng một thread nền.
+"""
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Bucket (giây) mặc định cho latency: 50µs .. 10s
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = {}   # {(name, labels): metric}
+_help = {}       # {name: (type, help)}
+_registry_lock = threading.Lock()
+
+
+def _label_str(labels, extra=None):
+    items = list(labels)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Counter:
+    def __init__(self, labels):
+        self.labels = labels
+        self.value = 0
+        self.fn = None
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+    def set_function(self, fn):
+        """Lấy giá trị từ một bộ đếm có sẵn lúc scrape (vd. event_log.written)"""
+        self.fn = fn
+
+    def samples(self, name):
+        value = self.fn() if self.fn is not None else self.value
+        yield f"{name}{_label_str(self.labels)} {value}"
+
+
+class Gauge:
+    def __init__(self, labels):
+        self.labels = labels
+        self.value = 0
+        self.fn = None
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+    def dec(self, n=1):
+        with self._lock:
+            self.value -= n
+
+    def set_function(self, fn):
+        """Giá trị được tính lúc scrape (vd. độ dài hàng đợi), không tốn gì trên hot path"""
+        self.fn = fn
+
+    def samples(self, name):
+        value = self.fn() if self.fn is not None else self.value
+        yield f"{name}{_label_str(self.labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, labels, buckets=DEFAULT_BUCKETS):
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """Context manager đo thời gian một khối lệnh"""
+        return _Timer(self)
+
+    def samples(self, name):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            yield f"{name}_bucket{_label_str(self.labels, ('le', bound))} {cumulative}"
+        yield f"{name}_bucket{_label_str(self.labels, ('le', '+Inf'))} {count}"
+        yield f"{name}_sum{_label_str(self.labels)} {total}"
+        yield f"{name}_count{_label_str(self.labels)} {count}"
+
+
+class _Timer:
+    __slots__ = ("hist", "start")
+
+    def __init__(self, hist):
+        self.hist = hist
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start)
+
+
+class TimedLock:
+    """Bọc một Lock, ghi thời gian chờ lấy lock vào histogram"""
+    __slots__ = ("lock", "hist")
+
+    def __init__(self, lock, hist):
+        self.lock = lock
+        self.hist = hist
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self.lock.acquire()
+        self.hist.observe(time.perf_counter() - start)
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+
+def _get(cls, kind, name, help_text, labels, **kwargs):
+    key = (name, tuple(sorted((labels or {}).items())))
+    with _registry_lock:
+        metric = _registry.get(key)
+        if metric is None:
+            metric = _registry[key] = cls(key[1], **kwargs)
+            _help.setdefault(name, (kind, help_text))
+        return metric
+
+
+def counter(name, help_text="", labels=None) -> Counter:
+    return _get(Counter, "counter", name, help_text, labels)
+
+
+def gauge(name, help_text="", labels=None) -> Gauge:
+    return _get(Gauge, "gauge", name, help_text, labels)
+
+
+def histogram(name, help_text="", labels=None, buckets=DEFAULT_BUCKETS) -> Histogram:
+    return _get(Histogram, "histogram", name, help_text, labels, buckets=buckets)
+
+
+def render() -> str:
+    """Toàn bộ metric theo định dạng text của Prometheus"""
+    with _registry_lock:
+        items = sorted(_registry.items(), key=lambda kv: kv[0])
+    lines = []
+    last_name = None
+    for (name, _), metric in items:
+        if name != last_name:
+            kind, help_text = _help[name]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            last_name = name
+        lines.extend(metric.samples(name))
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(host="127.0.0.1", port=9100):
+    """Mở endpoint http://host:port/metrics bằng thread nền, trả về HTTP server"""
+    httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    print(f"[METRICS] http://{host}:{port}/metrics")
+    return httpd
@@ -0,0 +1,88 @@
+# server/ranking.py
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from sortedcontainers import SortedList
+except ImportError:  # sortedcontainers không bắt buộc
+    SortedList = None
+
+
+class _BisectList:
+    """Danh sách sắp xếp dự phòng khi không có sortedcontainers (bisect + list)."""
+
+    def __init__(self):
+        self._items = []
+
+    def add(self, key):
+        insort(self._items, key)
+
+    def remove(self, key):
+        i = bisect_left(self._items, key)
+        if i < len(self._items) and self._items[i] == key:
+            del self._items[i]
+        else:
+            raise ValueError(key)
+
+    def bisect_left(self, key):
+        return bisect_left(self._items, key)
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __len__(self):
+        return len(self._items)
+
+
+class RankedIndex:
+    """Chỉ mục xếp hạng cập nhật tăng dần, khóa (-score, tên).
+
+    Thứ tự tăng dần của khóa chính là thứ hạng: điểm cao trước, cùng điểm thì theo tên.
+    Cập nhật một người chơi là O(log n) với sortedcontainers, nên không cần sort lại
+    toàn bộ bảng điểm sau mỗi round.
+    """
+
+    def __init__(self, scores: Optional[Dict[str, int]] = None):
+        self._keys = SortedList() if SortedList is not None else _BisectList()
+        self._scores: Dict[str, int] = {}
+        for player, score in (scores or {}).items():
+            self.update(player, score)
+
+    def update(self, player: str, score: int):
+        """Thêm hoặc cập nhật điểm của player"""
+        old = self._scores.get(player)
+        if old == score:
+            return
+        if old is not None:
+            self._keys.remove((-old, player))
+        self._scores[player] = score
+        self._keys.add((-score, player))
+
+    def remove(self, player: str):
+        old = self._scores.pop(player, None)
+        if old is not None:
+            self._keys.remove((-old, player))
+
+    def rank_of(self, player: str) -> Optional[int]:
+        """Thứ hạng (bắt đầu từ 1) của player, None nếu chưa có"""
+        score = self._scores.get(player)
+        if score is None:
+            return None
+        return self._keys.bisect_left((-score, player)) + 1
+
+    def range(self, start: int, end: int) -> List[Tuple[str, int]]:
+        """Các hạng trong khoảng [start, end) (tính từ 0) dưới dạng (player, score)"""
+        return [(player, -neg) for neg, player in self._keys[start:end]]
+
+    def keys(self) -> List[Tuple[int, str]]:
+        """Bản sao mọi khóa (-score, player) theo thứ hạng, không đổi dạng như range() nên rất nhanh"""
+        return self._keys[0:len(self._keys)]
+
+    def top_k(self, k: int) -> List[Tuple[str, int]]:
+        return self.range(0, k)
+
+    def __contains__(self, player):
+        return player in self._scores
+
+    def __len__(self):
+        return len(self._keys)
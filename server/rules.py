@@ -0,0 +1,47 @@
+# server/rules.py
+"""Luật oẳn tù tì: nước đi và kết quả là số nguyên nhỏ, thắng thua tra bảng
+
+Trong server nước đi/kết quả luôn là `Move`/`Result` (IntEnum, so sánh và làm chỉ số
+như int); chỉ đổi sang chuỗi ("rock", "win", ...) ở giao thức, log và leaderboard.
+"""
+from enum import IntEnum
+
+
+class Move(IntEnum):
+    ROCK = 0
+    PAPER = 1
+    SCISSORS = 2
+
+
+class Result(IntEnum):
+    WIN = 0
+    LOSE = 1
+    DRAW = 2
+
+
+MOVES = tuple(Move)
+MOVE_NAMES = ("rock", "paper", "scissors")       # theo giá trị của Move
+RESULT_NAMES = ("win", "lose", "draw")          # theo giá trị của Result
+MOVES_BY_NAME = {name: Move(i) for i, name in enumerate(MOVE_NAMES)}
+
+# OUTCOME[a][b]: kết quả của người đi a khi đối thủ đi b
+W, L, D = Result.WIN, Result.LOSE, Result.DRAW
+OUTCOME = (
+    #  rock paper scissors
+    (D, L, W),   # rock
+    (W, D, L),   # paper
+    (L, W, D),   # scissors
+)
+# Kết quả của đối thủ ứng với kết quả của mình
+OPPOSITE = (Result.LOSE, Result.WIN, Result.DRAW)
+
+
+def parse_move(name):
+    """"rock" | "paper" | "scissors" -> Move, None nếu không hợp lệ"""
+    return MOVES_BY_NAME.get(name) if isinstance(name, str) else None
+
+
+def judge(a, b):
+    """(kết quả của a, kết quả của b)"""
+    result = OUTCOME[a][b]
+    return result, OPPOSITE[result]
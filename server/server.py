@@ -1,127 +1,163 @@
+import argparse
 import socket
 import threading
-import json
-from datetime import datetime
+import time
 
-from game_manager import handle_move, match_players, clients, queue, matches, moves, lock
-from leaderboard import update_score, save_leaderboard_file
+from connection import SocketConnection, CONNECTIONS, ACTIVE_CONNECTIONS
+import admission
+import game_manager
+from game_manager import handle_message, handle_connect, handle_disconnect, clients, set_resume_grace
+from leaderboard import start_writer, stop_writer, set_backend, BACKENDS
+from logger import save_log, event_log
+import metrics
 
 HOST = '127.0.0.1'
 PORT = 9009
+METRICS_PORT = 9100
 
-def save_log(msg):
-    """Lưu log vào file"""
+def recv_message(conn):
+    """Nhận tin nhắn từ client (framer của kết nối giữ lại các tin nhắn gửi dồn)"""
     try:
-        with open("game_log.txt", "a", encoding="utf-8") as f:
-            f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - {msg}\n")
-    except:
-        pass
-
-def send_json(client_socket, obj):
-    """Gửi JSON tới client"""
-    try:
-        client_socket.sendall((json.dumps(obj) + "\n").encode())
-        return True
-    except:
-        return False
-
-def recv_json(client_socket):
-    """Nhận JSON từ client"""
-    try:
-        data = b""
-        while b"\n" not in data:
-            part = client_socket.recv(4096)
-            if not part:
-                return None
-            data += part
-        line, _, _ = data.partition(b"\n")
-        return json.loads(line.decode())
-    except:
+        return conn.recv_message()
+    except (OSError, ValueError):  # gồm cả FrameTooLarge và dữ liệu lỗi
         return None
 
 def handle_client(client_socket, addr):
     """Xử lý client"""
     print(f"[CONNECT] {addr} connected")
-    player_name = None
+    conn = SocketConnection(client_socket, addr)
+    handle_connect(conn)
     try:
         while True:
-            msg = recv_json(client_socket)
+            msg = recv_message(conn)
             if not msg:
                 break
-            msg_type = msg.get("type")
-
-            if msg_type == "join":
-                player_name = msg.get("player", f"Player_{addr[1]}")
-                with lock:
-                    clients[client_socket] = player_name
-                print(f"[JOIN] {player_name} from {addr}")
-                save_log(f"{player_name} joined from {addr}")
-
-            elif msg_type == "join_queue":
-                with lock:
-                    if client_socket not in queue:
-                        queue.append(client_socket)
-                match_players()  # gọi trực tiếp hàm match_players từ game_manager
-
-            elif msg_type == "move":
-                move = msg.get("move")
-                if move in ["rock", "paper", "scissors"]:
-                    handle_move(client_socket, move)  # gọi trực tiếp
+            handle_message(conn, msg)
 
     finally:
         # Khi client ngắt kết nối
-        requeue_opp = None
-        with lock:
-            if client_socket in queue:
-                queue.remove(client_socket)
-            if client_socket in matches:
-                opp = matches[client_socket]
-                # Thông báo cho đối thủ rằng đối phương đã rời
-                try:
-                    # dùng type rõ ràng để client xử lý (không dừng vòng lắng nghe)
-                    send_json(opp, {"type": "opponent_disconnected"})
-                except:
-                    pass
-
-                # Xóa mapping match 2 chiều
-                if opp in matches:
-                    del matches[opp]
-                del matches[client_socket]
+        player_name = clients.get(conn)
+        handle_disconnect(conn)
+        conn.close()
+        ACTIVE_CONNECTIONS.dec()
+        print(f"[DISCONNECT] {player_name or addr}")
+        if player_name:
+            save_log(f"{player_name} disconnected")
 
-                # Nếu đối thủ vẫn đang kết nối, đánh dấu để requeue (thực hiện ngoài lock)
-                if opp in clients and opp not in queue:
-                    queue.append(opp)
-                    requeue_opp = True
-            if client_socket in moves:
-                del moves[client_socket]
-            if client_socket in clients:
-                del clients[client_socket]
+def reject_client(client_socket):
+    """Quá MAX_CONNECTIONS: báo `error` nếu gửi được ngay rồi đóng, không tạo thread"""
+    try:
+        client_socket.setblocking(False)
+        client_socket.send(admission.SERVER_FULL)
+    except OSError:
+        pass
+    client_socket.close()
 
-        # Gọi match_players ngoài lock để tránh deadlock (match_players cũng lấy lock)
-        if requeue_opp:
-            try:
-                match_players()
-            except:
-                pass
-        client_socket.close()
-        print(f"[DISCONNECT] {player_name or addr}")
+def run_timers():
+    """Thread nền quay bánh xe hạn giờ: hết giờ round, kết nối rảnh, phiên, tick ghép cặp"""
+    timers = game_manager.timers
+    while True:
+        time.sleep(timers.tick)
+        timers.advance()
 
-def start_server():
+def start_server(host=HOST, port=PORT, metrics_port=METRICS_PORT):
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server.bind((HOST, PORT))
+    server.bind((host, port))
     server.listen()
-    print(f"[SERVER] Running on {HOST}:{PORT}")
+    print(f"[SERVER] Running on {host}:{port}")
     save_log("Server started")
+    start_writer()
+    game_manager.schedule_housekeeping()
+    threading.Thread(target=run_timers, daemon=True).start()
+    if metrics_port:
+        metrics.start_metrics_server(port=metrics_port)
 
     try:
         while True:
             client_socket, addr = server.accept()
+            if not admission.admit_connection():
+                reject_client(client_socket)
+                continue
+            # Tính kết nối ngay khi accept để trần kết nối không bị vượt khi nhiều client vào cùng lúc
+            CONNECTIONS.inc()
+            ACTIVE_CONNECTIONS.inc()
             threading.Thread(target=handle_client, args=(client_socket, addr), daemon=True).start()
     except KeyboardInterrupt:
         print("[SERVER] Shutting down...")
         save_log("Server stopped")
         server.close()
+        stop_writer()
+        event_log.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Rock Paper Scissors server")
+    parser.add_argument("--mode", choices=["thread", "async", "cluster"], default="thread",
+                        help="thread: mỗi kết nối một thread | async: một event loop asyncio | "
+                             "cluster: nhiều worker process + coordinator")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="số worker process ở chế độ cluster (mặc định: số CPU)")
+    parser.add_argument("--leaderboard", choices=BACKENDS, default="json",
+                        help="nơi lưu leaderboard: json (leaderboard.json) | sqlite (leaderboard.db, WAL)")
+    parser.add_argument("--matchmaker", choices=["fifo", "rating"], default="fifo",
+                        help="fifo: ghép hai người chờ lâu nhất | rating: ghép theo rating Elo, theo tick")
+    parser.add_argument("--match-tick", type=float, default=game_manager.MATCH_TICK,
+                        help="fifo: join_queue chỉ vào hàng đợi, ghép cả hàng đợi mỗi lượt sau chừng này giây "
+                             "(làm tròn lên theo tick 0.1s, 0 = ghép ngay mỗi lần join_queue)")
+    parser.add_argument("--match-batch", type=int, default=game_manager.MATCH_BATCH,
+                        help="fifo: hàng đợi đủ chừng này người thì ghép ngay, không chờ tick")
+    parser.add_argument("--best-of", type=int, default=3,
+                        help="số round tối đa mỗi trận; thắng quá nửa số đó thì thắng trận")
+    parser.add_argument("--move-timeout", type=float, default=30.0,
+                        help="số giây cho mỗi round (0 = không giới hạn)")
+    parser.add_argument("--timeout-policy", choices=["random", "forfeit"], default="random",
+                        help="hết giờ round: random = đi hộ nước ngẫu nhiên | forfeit = người chưa đi thua round")
+    parser.add_argument("--idle-timeout", type=float, default=300.0,
+                        help="ngắt kết nối không gửi gì trong chừng này giây, trừ khi đang chờ ghép/trong trận (0 = tắt)")
+    parser.add_argument("--resume-grace", type=float, default=30.0,
+                        help="số giây giữ trận cho client mất kết nối để kết nối lại (0 = tắt)")
+    parser.add_argument("--journal", metavar="DIR", default=None,
+                        help="bật journal nhị phân các sự kiện trong thư mục DIR (vd. journal); "
+                             "khi khởi động leaderboard được khôi phục từ snapshot + journal")
+    parser.add_argument("--max-connections", type=int, default=admission.MAX_CONNECTIONS,
+                        help="số kết nối đang mở tối đa (mỗi worker ở chế độ cluster), quá thì từ chối lúc accept (0 = tắt)")
+    parser.add_argument("--max-backlog", type=int, default=admission.MAX_BACKLOG,
+                        help="số người chờ ghép tối đa, quá thì từ chối join_queue bằng `error` (0 = tắt)")
+    parser.add_argument("--rate-scale", type=float, default=1.0,
+                        help="nhân mọi giới hạn tốc độ tin nhắn của mỗi kết nối (admission.RATE_LIMITS) với hệ số này (0 = tắt)")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="cổng HTTP cho /metrics trên localhost (0 = tắt); ở chế độ cluster "
+                             "coordinator dùng cổng này, worker i dùng cổng + 1 + i")
+    args = parser.parse_args()
+    if args.mode == "cluster" and args.matchmaker == "rating":
+        # Worker chuyển mọi join_queue sang coordinator, nơi chỉ ghép FIFO
+        parser.error("--matchmaker rating chưa hỗ trợ ở --mode cluster (coordinator ghép FIFO)")
+    set_backend(args.leaderboard)
+    set_resume_grace(args.resume_grace)
+    admission.set_limits(args.max_connections, args.max_backlog, args.rate_scale)
+    game_manager.set_best_of(args.best_of)
+    game_manager.set_match_tick(args.match_tick, args.match_batch)
+    game_manager.set_timeouts(args.move_timeout, args.timeout_policy, args.idle_timeout)
+    if args.matchmaker == "rating":
+        from matchmaking import RatingMatchmaker
+        game_manager.set_matchmaker(RatingMatchmaker())
+
+    if args.mode == "cluster":
+        from cluster import start_cluster
+        start_cluster(args.host, args.port, args.workers, metrics_port=args.metrics_port,
+                      journal_dir=args.journal)
+        return
+    if args.journal:
+        import journal
+        journal.setup(args.journal)
+    if args.mode == "async":
+        from async_server import start_async_server
+        start_async_server(args.host, args.port, args.metrics_port)
+    else:
+        start_server(args.host, args.port, args.metrics_port)
 
 if __name__ == "__main__":
-    start_server()
+    main()
+
@@ -0,0 +1,88 @@
+# server/timer_wheel.py
+"""Bánh xe thời gian (hashed timing wheel) cho mọi hạn giờ của server
+
+Thay cho một `threading.Timer` (một thread) cho mỗi hạn giờ: hạn giờ được bỏ vào ô
+`tick % len(slots)` của bánh xe, `schedule()` và `cancel()` đều O(1). Tầng I/O gọi
+`advance()` đều đặn (mỗi `tick` giây) từ một thread hoặc từ event loop; callback chạy
+trên chính thread/loop đó, ngoài lock của bánh xe.
+"""
+import math
+import threading
+import time
+
+
+class Timer:
+    __slots__ = ("due", "fn", "args", "cancelled")
+
+    def __init__(self, due, fn, args):
+        self.due = due
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        # Chỉ đánh dấu; bánh xe bỏ qua khi quay tới ô của nó
+        self.cancelled = True
+
+
+class TimerWheel:
+    def __init__(self, tick=0.1, slots=1024):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.current = 0          # tick cuối cùng đã xử lý
+        self.pending = 0          # số hạn giờ còn trong bánh xe (kể cả đã hủy)
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def schedule(self, delay, fn, *args) -> Timer:
+        """Gọi fn(*args) sau khoảng `delay` giây (làm tròn lên theo tick)"""
+        ticks = max(1, math.ceil(delay / self.tick))
+        with self._lock:
+            timer = Timer(self.current + ticks, fn, args)
+            self.slots[timer.due % len(self.slots)].append(timer)
+            self.pending += 1
+        return timer
+
+    def every(self, interval, fn, *args):
+        """Gọi fn(*args) mỗi `interval` giây"""
+        def run():
+            try:
+                fn(*args)
+            finally:
+                self.schedule(interval, run)
+        return self.schedule(interval, run)
+
+    def advance(self, now=None):
+        """Chạy các hạn giờ đã tới, trả về số callback đã gọi"""
+        now = time.monotonic() if now is None else now
+        target = int((now - self._start) / self.tick)
+        fired = []
+        with self._lock:
+            slots = self.slots
+            while self.current < target:
+                self.current += 1
+                slot = slots[self.current % len(slots)]
+                if not slot:
+                    continue
+                # Ô chứa cả hạn giờ của các vòng quay sau: giữ lại những cái chưa tới
+                keep = []
+                for timer in slot:
+                    if timer.cancelled:
+                        self.pending -= 1
+                    elif timer.due <= self.current:
+                        self.pending -= 1
+                        fired.append(timer)
+                    else:
+                        keep.append(timer)
+                slots[self.current % len(slots)] = keep
+        for timer in fired:
+            if timer.cancelled:
+                continue
+            try:
+                timer.fn(*timer.args)
+            except Exception as e:
+                print(f"[TIMER] {getattr(timer.fn, '__name__', timer.fn)} error: {e}")
+        return len(fired)
+
+    def __len__(self):
+        return self.pending
@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "client"))
+from bots import MOVE_NAMES, BotPool
+
+
+class NullClient:
+    """Client giả: chỉ đếm số tin nhắn gửi đi"""
+
+    def __init__(self, bot_id):
+        self.bot_id = bot_id
+        self.sent = 0
+
+    def send_json(self, obj):
+        self.sent += 1
+
+
+class NullLoop:
+    def call_soon(self, callback, *args):
+        pass   # bench tự gọi _flush sau mỗi round
+
+
+def bench_pool(bots, strategy, rounds=20, per_bot=False):
+    """Round/s (mỗi round 2 bot) qua đường thật của BotPool: _on_messages từng bot rồi _flush
+
+    Mặc định một _flush cho cả round (như khi chạy thật); per_bot=True thì flush sau từng
+    bot, tức chiến lược tính riêng cho từng bot như khi không gom lô.
+    """
+    pool = BotPool([(strategy, bots)], seed=1)
+    pool._loop = NullLoop()
+    pool.clients = [NullClient(i) for i in range(bots)]
+    rng = np.random.default_rng(2)
+    opp = rng.integers(0, 3, size=(rounds, bots)).tolist()
+    start = time.perf_counter()
+    for r in range(rounds):
+        for client, move in zip(pool.clients, opp[r]):
+            pool._on_messages(client, [
+                {"type": "round_result", "opponent_move": MOVE_NAMES[move], "result": "draw"},
+                {"type": "request_move"},
+            ])
+            if per_bot:
+                pool._flush()
+        pool._flush()
+    return rounds * bots / 2 / (time.perf_counter() - start)
+
+
+def run_bench():
+    print(f"{'bots':>7} " + " ".join(f"{name:>10}" for name in ("random", "frequency", "markov", "mixed")) +
+          f" {'markov/bot':>11}   (round/s, không tính mạng)")
+    for bots in (1_000, 10_000, 50_000):
+        rates = [bench_pool(bots, name) for name in ("random", "frequency", "markov", "mixed")]
+        per_bot = bench_pool(bots, "markov", rounds=2, per_bot=True)
+        print(f"{bots:7} " + " ".join(f"{rate:10.0f}" for rate in rates) + f" {per_bot:11.0f}")
+
+
+if __name__ == "__main__":
+    run_bench()
@@ -0,0 +1,44 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.codec import CODECS
+
+MESSAGES = {
+    "round_result": {"type": "round_result", "your_move": "rock",
+                     "opponent_move": "scissors", "result": "win"},
+    "request_move": {"type": "request_move"},
+}
+
+
+def bench_codec(codec, msg, count):
+    """Đo encode và decode (qua framer) cho `count` tin nhắn, trả về (encode/s, decode/s, bytes/msg)"""
+    encode = codec.encode
+    start = time.perf_counter()
+    for _ in range(count):
+        encode(msg)
+    encode_rate = count / (time.perf_counter() - start)
+
+    wire = encode(msg) * count
+    framer = codec.framer()
+    framer.max_frame = len(wire)
+    decode = codec.decode
+    start = time.perf_counter()
+    framer.feed(wire)
+    for frame in framer.frames():
+        decode(frame)
+    decode_rate = count / (time.perf_counter() - start)
+    return encode_rate, decode_rate, len(wire) // count
+
+
+def run_bench(count=200_000):
+    print(f"{'codec':8} {'message':14} {'encode/s':>12} {'decode/s':>12} {'bytes':>6}")
+    for name, codec in CODECS.items():
+        for msg_name, msg in MESSAGES.items():
+            enc, dec, size = bench_codec(codec, msg, count)
+            print(f"{name:8} {msg_name:14} {enc:12,.0f} {dec:12,.0f} {size:6}")
+
+
+if __name__ == "__main__":
+    run_bench(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from common.codec import JSON
+from connection import Connection
+import game_manager
+import leaderboard
+
+
+class NullConnection(Connection):
+    """Kết nối giả: đếm số byte gửi đi thay vì gửi"""
+    __slots__ = ("sent",)
+
+    def __init__(self, addr):
+        super().__init__(addr)
+        self.sent = 0
+
+    def sendall(self, data):
+        self.sent += len(data)
+
+
+def _fill(players):
+    """Bảng điểm giả `players` người chơi, chỉ trong bộ nhớ (không đọc/ghi đĩa)"""
+    leaderboard._data = {}
+    leaderboard._index = type(leaderboard._index)()
+    leaderboard._snapshot = None
+    for i in range(players):
+        leaderboard._data[f"Player_{i}"] = leaderboard._new_stats()
+    for i in range(players):
+        leaderboard.record_match(f"Player_{i}", "win", f"Player_{(i * 7 + 1) % players}", "lose")
+
+
+def bench_queries(players, queries=20_000, limit=20):
+    """Thời gian trung bình (µs) của một get_leaderboard: qua ảnh chụp, và tính trực tiếp như trước"""
+    _fill(players)
+    conns = [NullConnection(("127.0.0.1", i)) for i in range(100)]
+    for i, conn in enumerate(conns):
+        game_manager.clients[conn] = f"Player_{i * 13}"
+
+    leaderboard.board_snapshot()   # dựng trước, như khi server đã chạy
+    start = time.perf_counter()
+    for i in range(queries):
+        game_manager.handle_get_leaderboard(conns[i % len(conns)], 0, limit)
+    cached_us = (time.perf_counter() - start) / queries * 1e6
+
+    start = time.perf_counter()
+    for i in range(queries):
+        conn = conns[i % len(conns)]
+        board = leaderboard.leaderboard_range(0, limit)
+        rank = leaderboard.rank_of(game_manager.clients[conn])
+        conn.sendall(JSON.encode({"type": "leaderboard", "entries": board}) +
+                     JSON.encode({"type": "leaderboard_rank", "rank": rank}))
+    direct_us = (time.perf_counter() - start) / queries * 1e6
+
+    start = time.perf_counter()
+    leaderboard._snapshot = None
+    leaderboard.board_snapshot()
+    rebuild_ms = (time.perf_counter() - start) * 1e3
+    game_manager.clients.clear()
+    return cached_us, direct_us, rebuild_ms
+
+
+def run_bench():
+    print(f"{'players':>8} {'snapshot µs/query':>18} {'direct µs/query':>16} {'rebuild ms':>11}")
+    for players in (1_000, 10_000, 100_000):
+        cached_us, direct_us, rebuild_ms = bench_queries(players)
+        print(f"{players:8} {cached_us:18.1f} {direct_us:16.1f} {rebuild_ms:11.1f}")
+
+
+if __name__ == "__main__":
+    run_bench()
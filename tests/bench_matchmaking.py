@@ -0,0 +1,96 @@
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from connection import Connection
+from matchmaking import RatingBuckets, TICK_INTERVAL
+import game_manager
+
+
+class NullConnection(Connection):
+    """Kết nối giả: bỏ dữ liệu gửi đi"""
+    __slots__ = ()
+
+    def sendall(self, data):
+        pass
+
+
+def bench_tick(size, arrivals):
+    """Một hàng đợi `size` người chờ, mỗi tick thêm `arrivals` người mới rồi ghép.
+
+    Trả về (thời gian tick đầu, thời gian tick trung bình sau đó, số cặp tick đầu).
+    """
+    rng = random.Random(1)
+    waiting = RatingBuckets()
+    now = time.perf_counter()
+    next_id = 0
+    for _ in range(size):
+        waiting.add(next_id, rng.gauss(1500, 300), now - rng.uniform(0, 20))
+        next_id += 1
+
+    start = time.perf_counter()
+    first_pairs = len(waiting.collect_pairs(time.perf_counter()))
+    first = time.perf_counter() - start
+
+    times = []
+    for _ in range(50):
+        for _ in range(arrivals):
+            waiting.add(next_id, rng.gauss(1500, 300))
+            next_id += 1
+        start = time.perf_counter()
+        waiting.collect_pairs(time.perf_counter())
+        times.append(time.perf_counter() - start)
+    return first, sum(times) / len(times), first_pairs
+
+
+def bench_burst(joins, tick):
+    """`joins` người cùng join_queue rồi được ghép hết (hàng đợi FIFO)
+
+    tick=0: mỗi join_queue chạy một lượt match_players như trước; tick>0: chỉ vào hàng
+    đợi, một lượt ghép cho cả lô (ngưỡng MATCH_BATCH đặt bằng số người để không ghép sớm).
+    Trả về (µs mỗi join tính cả ghép, số lượt match_players).
+    """
+    game_manager.save_log = lambda msg: None   # không ghi game_log.txt khi đo
+    game_manager.set_match_tick(tick, joins + 1)
+    mm = game_manager.LocalMatchmaker()
+    conns = [NullConnection(("127.0.0.1", i)) for i in range(joins)]
+    for i, conn in enumerate(conns):
+        game_manager.clients[conn] = f"Player_{i}"
+    passes = game_manager.MATCH_PLAYERS_TIME.count
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for conn in conns:
+            mm.enqueue(conn)
+        if tick:
+            mm.tick()   # lượt ghép do bánh xe gọi
+        elapsed = time.perf_counter() - start
+    passes = game_manager.MATCH_PLAYERS_TIME.count - passes
+    assert len(game_manager.matches) == joins
+    game_manager.clients.clear()
+    game_manager.matches.clear()
+    return elapsed / joins * 1e6, passes
+
+
+def run_bench():
+    print(f"tick = {TICK_INTERVAL * 1000:.0f} ms")
+    print(f"{'queue':>8} {'arrivals':>9} {'first tick ms':>14} {'pairs':>7} {'steady tick ms':>15}")
+    for size, arrivals in ((1_000, 100), (10_000, 1_000), (50_000, 5_000)):
+        first, steady, pairs = bench_tick(size, arrivals)
+        print(f"{size:8} {arrivals:9} {first * 1000:14.2f} {pairs:7} {steady * 1000:15.2f}")
+
+    print()
+    print("FIFO, login burst (socket giả, không ghi log)")
+    print(f"{'joins':>8} {'per-join µs':>12} {'passes':>7} {'batched µs':>11} {'passes':>7}")
+    for joins in (1_000, 10_000, 50_000):
+        per_join, per_join_passes = bench_burst(joins, 0)
+        batched, batched_passes = bench_burst(joins, 0.1)
+        print(f"{joins:8} {per_join:12.2f} {per_join_passes:7} {batched:11.2f} {batched_passes:7}")
+
+
+if __name__ == "__main__":
+    run_bench()
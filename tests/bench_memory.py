@@ -0,0 +1,74 @@
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from connection import Connection
+import game_manager
+
+
+class IdleConnection(Connection):
+    """Kết nối giả: không có socket, bỏ qua mọi tin gửi đi"""
+    __slots__ = ()
+
+    def sendall(self, data):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def _traced():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def bench_sessions(count):
+    """`count` kết nối đã join, rồi ghép toàn bộ thành count // 2 trận
+
+    Trả về (byte mỗi kết nối rảnh, byte mỗi trận đang chơi). Tính cả phần trong các
+    bảng của game_manager (clients, sessions, matches) và hạn giờ trên bánh xe.
+    """
+    game_manager.save_log = lambda msg: None
+    tracemalloc.start()
+    base = _traced()
+    conns = []
+    with open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            for i in range(count):
+                conn = IdleConnection(("127.0.0.1", 10000 + i % 50000))
+                game_manager.handle_connect(conn)
+                game_manager.handle_join(conn, f"Player_{i}", conn.addr)
+                conns.append(conn)
+        finally:
+            sys.stdout = stdout
+    idle = _traced()
+
+    with game_manager.queue_lock:
+        for i in range(0, count - 1, 2):
+            game_manager._register_match(conns[i], conns[i + 1])
+    active = _traced()
+    tracemalloc.stop()
+
+    per_conn = (idle - base) / count
+    per_match = (active - idle) / (count // 2)
+
+    # Dọn trạng thái cho lần đo sau
+    game_manager.clients.clear()
+    game_manager.matches.clear()
+    game_manager.sessions.clear()
+    game_manager.timers = type(game_manager.timers)()
+    return per_conn, per_match
+
+
+def run_bench():
+    print(f"{'sessions':>9} {'bytes/idle conn':>16} {'bytes/match':>12}")
+    for count in (10_000, 100_000):
+        per_conn, per_match = bench_sessions(count)
+        print(f"{count:9} {per_conn:16.0f} {per_match:12.0f}")
+
+
+if __name__ == "__main__":
+    run_bench()
@@ -0,0 +1,47 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from timer_wheel import TimerWheel
+
+
+def bench_wheel(count, timeout=30.0):
+    """`count` trận cùng lúc, mỗi trận một hạn giờ round; phần lớn round xong trước hạn
+    (hủy rồi đặt hạn mới), một phần hết giờ. Trả về thời gian trung bình mỗi thao tác (µs).
+    """
+    wheel = TimerWheel(tick=0.1)
+    fired = []
+    rng = random.Random(1)
+    start = time.perf_counter()
+    timers = [wheel.schedule(timeout, fired.append, i) for i in range(count)]
+    schedule_us = (time.perf_counter() - start) / count * 1e6
+
+    start = time.perf_counter()
+    for i in range(count):
+        if rng.random() < 0.9:
+            timers[i].cancel()
+            timers[i] = wheel.schedule(timeout, fired.append, i)
+    reschedule_us = (time.perf_counter() - start) / count * 1e6
+
+    # Quay hết một vòng hạn giờ theo từng tick như tầng I/O
+    now = wheel._start
+    start = time.perf_counter()
+    ticks = int(timeout * 2 / wheel.tick)
+    for _ in range(ticks):
+        now += wheel.tick
+        wheel.advance(now)
+    advance_us = (time.perf_counter() - start) / ticks * 1e6
+    return schedule_us, reschedule_us, advance_us, len(fired)
+
+
+def run_bench():
+    print(f"{'timers':>8} {'schedule µs':>12} {'cancel+resched µs':>18} {'advance µs/tick':>16} {'fired':>7}")
+    for count in (1_000, 10_000, 50_000):
+        schedule_us, reschedule_us, advance_us, fired = bench_wheel(count)
+        print(f"{count:8} {schedule_us:12.2f} {reschedule_us:18.2f} {advance_us:16.1f} {fired:7}")
+
+
+if __name__ == "__main__":
+    run_bench()
@@ -0,0 +1,191 @@
+"""Bộ tạo tải asyncio cho server.
+
+Mỗi client ảo chạy đúng vòng lặp của `test_clients.client_simulator`
+(join -> join_queue -> move khi nhận request_move), nhưng hàng nghìn client chạy
+trên một event loop. Có giai đoạn tăng dần (ramp) và giai đoạn ổn định (steady);
+số liệu throughput/latency chỉ tính trong giai đoạn ổn định.
+
+Ví dụ:
+    python tests/loadgen.py --clients 2000 --ramp 10 --duration 30 --think 0.05 --json run.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "client"))
+from client_logic import AsyncClient
+from test_clients import HOST, PORT, MOVES
+
+
+class Stats:
+    def __init__(self):
+        self.steady = False
+        self.connected = 0
+        self.connect_errors = 0
+        self.connect_times = []       # perf_counter lúc từng kết nối join xong
+        self.disconnects = 0          # kết nối bị server đóng trước khi hết giờ
+        self.match_found = 0
+        self.round_results = 0
+        self.errors = 0
+        self.request_to_result = []   # giây, từ lúc nhận request_move tới round_result
+        self.move_to_result = []      # giây, từ lúc gửi move tới round_result
+
+    def reset_steady(self):
+        self.steady = True
+        self.match_found = 0
+        self.round_results = 0
+        self.request_to_result = []
+        self.move_to_result = []
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+async def client_loop(client_id, args, stats, stop):
+    """Một client ảo: join -> join_queue -> trả lời request_move cho tới khi hết giờ"""
+    loop = asyncio.get_running_loop()
+    requested_at = moved_at = None
+
+    def move():
+        nonlocal moved_at
+        if client.send_json({"type": "move", "move": random.choice(MOVES)}):
+            moved_at = time.perf_counter()
+
+    def on_messages(client, batch):
+        nonlocal requested_at, moved_at
+        now = time.perf_counter()
+        for msg in batch:
+            msg_type = msg.get("type")
+
+            if msg_type == "match_found":
+                stats.match_found += 1
+
+            elif msg_type == "request_move":
+                requested_at = now
+                if args.think:
+                    loop.call_later(random.uniform(0, 2 * args.think), move)
+                else:
+                    move()
+
+            elif msg_type == "round_result":
+                stats.round_results += 1
+                if stats.steady and requested_at is not None and moved_at is not None:
+                    stats.request_to_result.append(now - requested_at)
+                    stats.move_to_result.append(now - moved_at)
+                requested_at = moved_at = None
+
+            elif msg_type in ("game_over", "opponent_disconnected"):
+                # Server tự đưa cả hai về hàng đợi, không cần gửi join_queue
+                requested_at = moved_at = None
+
+            elif msg_type == "error":
+                stats.errors += 1
+
+    client = AsyncClient(on_messages)
+    try:
+        await client.connect(args.host, args.port)
+        await client.join(f"Load_{client_id}", codecs=[args.codec])
+    except OSError:
+        stats.connect_errors += 1
+        return
+    stats.connected += 1
+    stats.connect_times.append(time.perf_counter())
+    client.send_json({"type": "join_queue"})
+    reader = asyncio.ensure_future(client.run())
+    try:
+        await asyncio.wait([reader, asyncio.ensure_future(stop.wait())], return_when=asyncio.FIRST_COMPLETED)
+        if not stop.is_set():
+            stats.disconnects += 1
+    finally:
+        client.close()
+        reader.cancel()
+
+
+async def run_load(args):
+    stats = Stats()
+    stop = asyncio.Event()
+    tasks = []
+
+    # Giai đoạn ramp: mở đều các kết nối trong args.ramp giây. Kết nối thứ i mở lúc
+    # ramp_start + i*interval để độ trễ của từng lần sleep không cộng dồn
+    ramp_start = time.perf_counter()
+    interval = args.ramp / args.clients if args.clients else 0
+    for i in range(args.clients):
+        tasks.append(asyncio.create_task(client_loop(i, args, stats, stop)))
+        delay = ramp_start + (i + 1) * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    # Chờ các kết nối cuối cùng hoàn tất
+    await asyncio.sleep(min(1.0, args.ramp * 0.1 + 0.1))
+    connected_in_ramp = stats.connected
+    # Tốc độ kết nối tính theo thời điểm join xong thật, không theo lịch mở kết nối
+    connect_time = stats.connect_times[-1] - ramp_start if stats.connect_times else 0
+
+    # Giai đoạn ổn định
+    stats.reset_steady()
+    steady_start = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    steady_time = time.perf_counter() - steady_start
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    def ms(values):
+        result = {}
+        for p in (50, 95, 99):
+            v = percentile(values, p)
+            result[f"p{p}"] = None if v is None else round(v * 1000, 3)
+        return result
+
+    return {
+        "config": {"host": args.host, "port": args.port, "clients": args.clients,
+                   "ramp_s": args.ramp, "duration_s": args.duration, "think_s": args.think,
+                   "codec": args.codec},
+        "connections": connected_in_ramp,
+        "connect_errors": stats.connect_errors,
+        "disconnects": stats.disconnects,
+        "errors": stats.errors,
+        "connections_per_sec": round(connected_in_ramp / connect_time, 2) if connect_time else None,
+        # match_found/round_result đến cả hai người chơi nên chia đôi
+        "matches_per_sec": round(stats.match_found / 2 / steady_time, 2),
+        "rounds_per_sec": round(stats.round_results / 2 / steady_time, 2),
+        "latency_ms": {
+            "request_move_to_round_result": ms(stats.request_to_result),
+            "move_to_round_result": ms(stats.move_to_result),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator cho server Rock Paper Scissors")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--ramp", type=float, default=5.0, help="số giây để mở hết các kết nối")
+    parser.add_argument("--duration", type=float, default=20.0, help="số giây đo ở trạng thái ổn định")
+    parser.add_argument("--think", type=float, default=0.0, help="thời gian suy nghĩ trung bình (giây)")
+    parser.add_argument("--codec", default="json", help="codec đề xuất khi join (json | orjson | msgpack)")
+    parser.add_argument("--json", dest="json_out", help="ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_load(args))
+    text = json.dumps(report, indent=2)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,14 @@
+import os
 import socket
+import sys
 import json
 import random
 import time
 import threading
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.framing import LineFramer, recv_frame
+
 HOST = '127.0.0.1'
 PORT = 9009
 
@@ -17,18 +22,14 @@ def send_json(sock, obj):
     except Exception as e:
         return False
 
-def recv_json(sock):
-    """Nhận JSON từ server"""
+def recv_json(sock, framer):
+    """Nhận JSON từ server (framer giữ lại các tin nhắn gửi dồn)"""
     try:
         sock.settimeout(5)  # Timeout 5s cho mỗi lần recv
-        data = b""
-        while b"\n" not in data:
-            part = sock.recv(4096)
-            if not part:
-                return None
-            data += part
-        line, _, _ = data.partition(b"\n")
-        return json.loads(line.decode("utf-8"))
+        line = recv_frame(sock, framer)
+        if line is None:
+            return None
+        return json.loads(line)
     except socket.timeout:
         return {"type": "timeout"}
     except Exception as e:
@@ -40,6 +41,7 @@ def client_simulator(client_id):
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         s.connect((HOST, PORT))
+        framer = LineFramer()
         print(f"[Client {client_id}] ✅ Kết nối thành công!")
 
         player_name = f"Tester_{client_id}"
@@ -65,7 +67,7 @@ def client_simulator(client_id):
 
         # Vòng lặp nhận message từ server
         while consecutive_timeouts < 3 and rounds_played < max_rounds:
-            resp = recv_json(s)
+            resp = recv_json(s, framer)
             
             if resp is None:
                 print(f"[Client {client_id}] ❌ Mất kết nối với server")